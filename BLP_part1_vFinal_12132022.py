@@ -4,10 +4,15 @@
 
 # SECOND VERSION OF SCRIPT, THIRD MAJOR UPDATE 2 (v2.3)
 # Handles 12 samples at a time
+# Imports helper modules from this directory (bead_cleanup, mix_timing, mock_protocol (time model for mix_timing), temperature_program, well_index). Copy them to /data/user_storage (or another directory on the
+# robot's Python path) before running; uploading this file alone through the Opentrons app fails on those imports.
 # Changes made according to OT2 testing on 02/01/2023
 
 from opentrons import protocol_api
-from opentrons import types
+from bead_cleanup import BeadCleanup
+from mix_timing import timed_mix
+from temperature_program import TemperatureProgram
+from well_index import well_index
 
 metadata = {
     'apiLevel': '2.8',
@@ -16,10 +21,18 @@ metadata = {
     'author': 'Max Benjamin'
 }
 
+# Sample volume (ul) in each sample well at the start, a module-level setting so it can be swept (see simulation_farm.py)
+starting_sample_volume = 48
+
+# Dispense the AMPure beads while the block cools from 65C instead of waiting for 20C first. Off by default: the
+# beads are validated at room temperature, and the time saved is only the cooling ramp.
+early_bead_addition = False
+
 def run(protocol: protocol_api.ProtocolContext):
     # Load modules into worktable locations
     magnetic_module = protocol.load_module('magnetic module gen2', 1)
     temperature_module = protocol.load_module('temperature module gen2', 3)
+    temperature_program = TemperatureProgram(protocol, temperature_module) # Starts ramps without blocking the pipettes
 
     # Set tip box locations #
     p20x1_tips1 = protocol.load_labware('opentrons_96_tiprack_20ul', 9)
@@ -35,20 +48,27 @@ def run(protocol: protocol_api.ProtocolContext):
     mag_plate = magnetic_module.load_labware('eppendorf0030129504lobindpcr_96_wellplate_250ul',
                                              label='LoBind PCR plate with Adapter Basepiece on Mag Module')
 
+    # Precomputed well coordinates (built once per labware) for the pipetting loops below #
+    temp_plate_wells = well_index(temp_plate)
+    mag_plate_wells = well_index(mag_plate)
+    p300x8_tips1_wells = well_index(p300x8_tips1)
+    reagent_tube_carrier_wells = well_index(reagent_tube_carrier)
+    ethanol_reservoir_wells = well_index(ethanol_reservoir)
+    water_reservoir_wells = well_index(water_reservoir)
+
     # Set mounted pipette types #
     p20x1 = protocol.load_instrument('p20_single_gen2', 'left', tip_racks=[p20x1_tips1])
     p300x8 = protocol.load_instrument('p300_multi_gen2', 'right', tip_racks=[p300x8_tips1])
 
     # Declare liquid handling variables #
-    starting_sample_volume = 48
     nebnext_ffpe_dna_repair_buffer = 3.5
     ultra_ii_end_prep_reaction_buffer = 3.5
     ultra_ii_end_prep_enzyme_mix = 3
     nebnext_ffpe_dna_repair_mix = 2
     total_rxn_volume = starting_sample_volume + nebnext_ffpe_dna_repair_buffer + ultra_ii_end_prep_reaction_buffer + ultra_ii_end_prep_enzyme_mix + nebnext_ffpe_dna_repair_mix
 
-    # Set temp module to 4C to prevent rxn from starting during setup
-    temperature_module.set_temperature(4)
+    # Cool temp module to 4C to prevent rxn from starting during setup; the buffers go in while it cools
+    temperature_program.start(4)
 
     # Liquid handling commands for gDNA repair rxn setup #
     p20x1.flow_rate.aspirate = 2.0 # p20 single gen2 default flowrate = 7.6 ul/sec
@@ -58,6 +78,8 @@ def run(protocol: protocol_api.ProtocolContext):
     reagent_tube_index = 0
     for tube in reagent_tube_list:
         reagent_tube_index += 1
+        if tube == 3:
+            temperature_program.await_setpoint() # Enzyme mixes only go into samples at 4C
         sourceWellIndex = (reagent_tube_index - 1) * 4
 
         if tube == 1:
@@ -72,8 +94,8 @@ def run(protocol: protocol_api.ProtocolContext):
         sample_well_list = [0, 1, 2, 3, 4, 5, 8, 9, 10, 11, 12, 13]
         for well in range(0, 12):
             destinationWellIndex = sample_well_list[well]
-            sourceLocation = reagent_tube_carrier.wells()[sourceWellIndex]
-            destinationLocation = temp_plate.wells()[destinationWellIndex]
+            sourceLocation = reagent_tube_carrier_wells.well(sourceWellIndex)
+            destinationLocation = temp_plate_wells.well(destinationWellIndex)
 
             p20x1.pick_up_tip()
             p20x1.aspirate(volume=transfer_volume,
@@ -82,13 +104,13 @@ def run(protocol: protocol_api.ProtocolContext):
 
             # Move commands to mimic a tip-wipe to eliminate reagent droplets
             tip_wipe_x_offset = 4.5
-            p20x1.move_to(location=sourceLocation.top().move(types.Point(x=tip_wipe_x_offset, y=0, z=0)),
+            p20x1.move_to(location=reagent_tube_carrier_wells.top(sourceWellIndex, 0, x=tip_wipe_x_offset),
                           speed=80,
                           publish=True)
-            p20x1.move_to(location=sourceLocation.top(-5.0).move(types.Point(x=tip_wipe_x_offset, y=0, z=0)),
+            p20x1.move_to(location=reagent_tube_carrier_wells.top(sourceWellIndex, -5.0, x=tip_wipe_x_offset),
                           speed=80,  # Default is 400mm/sec; set to Tip-touch max of 80mm/sec
                           publish=True)
-            p20x1.move_to(location=sourceLocation.top().move(types.Point(x=tip_wipe_x_offset, y=0, z=0)),
+            p20x1.move_to(location=reagent_tube_carrier_wells.top(sourceWellIndex, 0, x=tip_wipe_x_offset),
                           speed=80,
                           publish=True)
 
@@ -109,30 +131,30 @@ def run(protocol: protocol_api.ProtocolContext):
 
     for column in range(0,2):
         columnIndex = column*8
-        p300x8.pick_up_tip(location=p300x8_tips1.wells()[columnIndex])
+        p300x8.pick_up_tip(location=p300x8_tips1_wells.well(columnIndex))
         p300x8.mix(repetitions=3,
                 volume=(total_rxn_volume-10),
-                location=temp_plate.wells()[columnIndex].bottom(1.0),
+                location=temp_plate_wells.bottom(columnIndex, 1.0),
                 rate=1.0) # 25% flow rate to avoid bubbles, already set above
-        p300x8.blow_out(temp_plate.wells()[columnIndex].bottom(1.0))
-        p300x8.drop_tip(location=p300x8_tips1.wells()[columnIndex])
-        p300x8_tips1.return_tips(start_well=p300x8_tips1.wells()[columnIndex], num_channels=8)
+        p300x8.blow_out(temp_plate_wells.bottom(columnIndex, 1.0))
+        p300x8.drop_tip(location=p300x8_tips1_wells.well(columnIndex))
+        p300x8_tips1.return_tips(start_well=p300x8_tips1_wells.well(columnIndex), num_channels=8)
 
-    # Incubate samples at 20C for 10min
-    temperature_module.set_temperature(20)
-    protocol.delay(seconds=0, minutes=10, msg="20C hold for 10min")
+    # Incubate samples at 20C for 10min, timed from when the block reaches 20C
+    temperature_program.hold(20, minutes=10, msg="20C hold for 10min")
 
-    # Incubate samples at 65C for 10min
-    temperature_module.set_temperature(65)
-    protocol.delay(seconds=0, minutes=10, msg="65C hold for 10min")
+    # Incubate samples at 65C for 10min, timed from when the block reaches 65C
+    temperature_program.hold(65, minutes=10, msg="65C hold for 10min")
     
-    # Reset temp module to room temp
-    temperature_module.set_temperature(20)
+    # Reset temp module to room temp. Beads go in once the block is back at 20C, unless early_bead_addition is set
+    temperature_program.start(20)
+    if not early_bead_addition:
+        temperature_program.await_setpoint()
 
     # Add AMPure XP beads to samples
     ampure_xp_beads = 40
     sourceWellIndex = 16
-    sourceLocation = reagent_tube_carrier.wells()[sourceWellIndex]
+    sourceLocation = reagent_tube_carrier_wells.well(sourceWellIndex)
 
     p20x1.flow_rate.aspirate = 15  # 200% p20 single gen2 default flowrate = 15.2 ul/sec
     p20x1.flow_rate.dispense = 15
@@ -141,7 +163,7 @@ def run(protocol: protocol_api.ProtocolContext):
     p20x1.pick_up_tip()
     for well in range(0,12):
         destinationWellIndex = sample_well_list[well]
-        destinationLocation = temp_plate.wells()[destinationWellIndex].top(-4.0) # Dispense from just barely inside the well
+        destinationLocation = temp_plate_wells.top(destinationWellIndex, -4.0) # Dispense from just barely inside the well
 
         for dispense in range(0,2): # AMPure multidispense loop
             p20x1.aspirate(volume=ampure_xp_beads/2,
@@ -163,21 +185,17 @@ def run(protocol: protocol_api.ProtocolContext):
 
     total_rxn_volume += ampure_xp_beads
         
-    # Very slow sample mix to replicate Hula mixing step
-    p300x8.flow_rate.aspirate = 18  # 90ul at 18/sec = 1 mix cycle per 10 sec = 6 cycles/min; 10min = 60 cycles
+    # Very slow sample mix to replicate Hula mixing step, once samples are back at room temp
+    if early_bead_addition:
+        temperature_program.await_setpoint()
+    p300x8.flow_rate.aspirate = 18  # Slow aspirate/dispense; mix repetitions follow from this flow rate (see mix_timing.py)
     p300x8.flow_rate.dispense = 18
 
-    for cycle in range(0,5): # 5 cycles X 3 mixes for each of 2 columns per cycle
-        for column in range(0,2):
-            columnIndex = column*8
-            p300x8.pick_up_tip(location=p300x8_tips1.wells()[columnIndex])
-            p300x8.mix(repetitions=3,
-                    volume=total_rxn_volume,
-                    location=temp_plate.wells()[columnIndex].bottom(1.0),
-                    rate=1.0)
-            p300x8.blow_out()
-            p300x8.drop_tip(location=p300x8_tips1.wells()[columnIndex])
-            p300x8_tips1.return_tips(start_well=p300x8_tips1.wells()[columnIndex], num_channels=8)
+    timed_mix(protocol, p300x8,
+              mix_locations=[temp_plate_wells.bottom(0, 1.0), temp_plate_wells.bottom(8, 1.0)],
+              tip_locations=[p300x8_tips1_wells.well(0), p300x8_tips1_wells.well(8)],
+              volume=total_rxn_volume,
+              minutes=10) # Both columns in turn for 10min
     
     # Transfer samples from temp module plate to mag module plate
     p300x8.flow_rate.aspirate = 94 # Default flow rate, adjusted below by rate kwargs
@@ -185,10 +203,10 @@ def run(protocol: protocol_api.ProtocolContext):
 
     for column in range(0,2):
         columnIndex = column*8
-        sourceLocation = temp_plate.wells()[columnIndex].bottom(1.0)
-        destinationLocation = mag_plate.wells()[columnIndex].center()
+        sourceLocation = temp_plate_wells.bottom(columnIndex, 1.0)
+        destinationLocation = mag_plate_wells.center(columnIndex)
 
-        p300x8.pick_up_tip(location=p300x8_tips1.wells()[columnIndex])
+        p300x8.pick_up_tip(location=p300x8_tips1_wells.well(columnIndex))
         p300x8.aspirate(volume=total_rxn_volume+100, # Extra volume to get everything
                         location=sourceLocation,
                         rate=0.1) # 10% default flowrate for better aspiration at well bottom
@@ -196,145 +214,37 @@ def run(protocol: protocol_api.ProtocolContext):
                         location=destinationLocation,
                         rate=1.0)
         p300x8.blow_out()
-        p300x8.drop_tip(location=p300x8_tips1.wells()[columnIndex])
-
-    # Engage magnet module to pellet magbeads
-    magnetic_module.engage(14.5) # This should bring magbeads to the center/right (odd-number columns) or center/left(even-number columns) of wells. Reused in subsequent mag module steps.
-    protocol.delay(seconds=0, minutes=3, msg="Wait for magnetic beads to pellet")
-
-    ### COLUMNWISE PROCESSING STEPS ###
-    def columnwiseProcessing(columnIndex):
-        # Remove supernatant from magbeads
-        if columnIndex == 0:
-            x_offset = -1.5
-        if columnIndex == 8:
-            x_offset = 1.5
-
-        sourceLocation = mag_plate.wells()[columnIndex].bottom(0).move(types.Point(x=x_offset, y=0, z=0))  # Bottom left/bottom right well locations
-
-        p300x8.flow_rate.aspirate = 94 # p300 multi gen2 default flowrate = 94 ul/sec
-        p300x8.flow_rate.dispense = 94
-
-        p300x8.pick_up_tip(location=p300x8_tips1.wells()[columnIndex])
-        p300x8.aspirate(volume=total_rxn_volume,
-                        location=sourceLocation,
-                        rate=0.10)  # 10% very slow aspirate speed
-        p300x8.drop_tip()
-
-        # Add Ethanol (first wash)
-        ethanol_volume = 200
-
-        if columnIndex == 0:
-            x_offset = 1.5
-        if columnIndex == 8:
-            x_offset = -1.5
-
-        sourceLocation = ethanol_reservoir.wells()[0].bottom(2.0)
-        destinationLocation = mag_plate.wells()[columnIndex].top(-4.0).move(types.Point(x=x_offset, y=0,z=0))  # Upper-right (odd-numbered columns) or upper left (even-numbered columns) in well
-
-        p300x8.pick_up_tip()
-        p300x8.aspirate(volume=ethanol_volume,
-                        location=sourceLocation,
-                        rate=0.5) # 50% slow aspirate for ethanol
-        p300x8.air_gap(volume=20) # 20ul airgap to keep ethanol from dripping
-        p300x8.dispense(volume=220,
-                        location=destinationLocation,
-                        rate=0.5) # 50% gentle dispense to keep magbeads from getting knocked to bottom of wells
-
-        # Remove Ethanol (first wash removal)
-        if columnIndex == 0:
-            aspirate_x_offset = -1.5
-        if columnIndex == 8:
-            aspirate_x_offset = 1.5
-
-        sourceLocation = mag_plate.wells()[columnIndex].bottom(0).move(types.Point(x=aspirate_x_offset, y=0, z=0)) # Bottom-left (odd columns) or right (even columns)
-
-        p300x8.aspirate(volume=300, # Full pipette volume for extra removal
-                        location=sourceLocation,
-                        rate=0.10) # 10% very slow aspirate speed
-        p300x8.blow_out(location=protocol.fixed_trash['A1'])
-        p300x8.drop_tip()
-
-        # Add Ethanol (second wash)
-        ethanol_volume = 200
-
-        if columnIndex == 0:
-            x_offset = 1.5
-        if columnIndex == 8:
-            x_offset = -1.5
+        p300x8.drop_tip(location=p300x8_tips1_wells.well(columnIndex))
 
-        sourceLocation = ethanol_reservoir.wells()[0].bottom(2.0)
-        destinationLocation = mag_plate.wells()[columnIndex].top(-4.0).move(types.Point(x=x_offset, y=0, z=0))  # Upper-right (odd-numbered columns) or upper left (even-numbered columns) in well
-
-        p300x8.pick_up_tip()
-        p300x8.aspirate(volume=ethanol_volume,
-                        location=sourceLocation,
-                        rate=0.5)  # 50% slow aspirate for ethanol
-        p300x8.air_gap(volume=20)  # 20ul airgap to keep ethanol from dripping
-        p300x8.dispense(volume=220,
-                        location=destinationLocation,
-                        rate=0.5)  # 50% gentle dispense to keep magbeads from getting knocked to bottom of wells
+    # Magbead cleanup of both columns under one magnet engagement: each column's supernatant removal, ethanol washes and
+    # elution water back to back, then one disengage to resuspend both (see bead_cleanup.py)
+    bead_cleanup = BeadCleanup(protocol, p300x8, magnetic_module, mag_plate_wells, column_indexes=[0, 8])
+    bead_cleanup.pellet(minutes=3) # Brings magbeads to the center/right (odd-number columns) or center/left (even-number columns) of wells
 
-        # Remove Ethanol (second wash removal)
-        if columnIndex == 0:
-            aspirate_x_offset = -1.5
-        if columnIndex == 8:
-            aspirate_x_offset = 1.5
-
-        sourceLocation = mag_plate.wells()[columnIndex].bottom(-1.0).move(types.Point(x=aspirate_x_offset, y=0, z=0))  # Bottom-left (odd columns) or right (even columns)
-
-        p300x8.aspirate(volume=300, # Extra volume, full pipette volume of 300ul
-                        location=sourceLocation,
-                        rate=0.10)  # 10% very slow aspirate speed
-        p300x8.blow_out(location=protocol.fixed_trash['A1'])
-        p300x8.drop_tip()
-
-        # Disengage magnet module
-        magnetic_module.disengage()
-
-        # Water elution
-        water_volume = 61
-        if columnIndex == 0:
-            dispense_offset = 1.0
-        if columnIndex == 8:
-            dispense_offset = -1.0
-        sourceLocation = water_reservoir.wells()[0]
-        p300x8.pick_up_tip()
-        p300x8.aspirate(volume=water_volume,
-                        location=sourceLocation,
-                        rate=1.0)
-        destinationLocation = mag_plate.wells()[columnIndex].top(-4.0).move(types.Point(x=dispense_offset, y=0, z=0))
-        p300x8.dispense(volume=water_volume,
-                        location=destinationLocation,
-                        rate=1.0)
-        if columnIndex == 0:
-            aspirate_x_offset = -1.5
-            dispense_x_offset = 1.5
-        if columnIndex == 8:
-            aspirate_x_offset = 1.5
-            dispense_x_offset = -1.5
-        sourceLocation = mag_plate.wells()[columnIndex].bottom(0).move(types.Point(x=aspirate_x_offset, y=0, z=0))
-        destinationLocation = mag_plate.wells()[columnIndex].center().move(types.Point(x=dispense_x_offset, y=0, z=0))
-
-        for mix in range(0, 15):  # 15 Water washes
-            p300x8.aspirate(volume=water_volume,
-                            location=sourceLocation,
-                            rate=1.0)
-            p300x8.dispense(volume=water_volume,
-                            location=destinationLocation,
-                            rate=3.0)  # Faster dispense to dislodge magbeads
-        p300x8.blow_out(destinationLocation)
-        p300x8.drop_tip()
+    p300x8.flow_rate.aspirate = 94 # p300 multi gen2 default flowrate = 94 ul/sec
+    p300x8.flow_rate.dispense = 94
 
-    columnwiseProcessing(0) # COLUMN 1 PROCESSING
-    columnwiseProcessing(8) # COLUMN 2 PROCESSING
+    for columnIndex in bead_cleanup.column_indexes:
+        bead_cleanup.remove_supernatant(columnIndex,
+                                        volume=total_rxn_volume,
+                                        tip_location=p300x8_tips1_wells.well(columnIndex)) # The column's transfer tip, trashed after the removal
+        bead_cleanup.ethanol_washes(columnIndex,
+                                    source=ethanol_reservoir_wells.bottom(0, 2.0),
+                                    volume=200,
+                                    removal_volume=300, # Full pipette volume for extra removal
+                                    removal_heights=(0, -1.0), # Second removal goes deeper
+                                    tip_per_wash=True) # New tip for each wash
+        bead_cleanup.add_water(columnIndex,
+                               source=water_reservoir_wells.well(0),
+                               volume=61, # Straight after the last ethanol removal so the pellet doesn't dry
+                               water_offset=1.0)
+    bead_cleanup.elute(mix_count=15) # 15 Water washes
 
     # Delay to incubate at room temp
     protocol.delay(seconds=0, minutes=2, msg="Incubate at room temp while gDNA elutes")
 
     # Engage magnet module to pellet magbeads
-    magnetic_module.engage(14.5)
-    protocol.delay(seconds=0, minutes=2, msg="Wait for magnetic beads to pellet")
+    bead_cleanup.pellet(minutes=2)
 
     # Separate eluate from magbeads
     p300x8.flow_rate.aspirate = 9.4  # 10% default p300 multi gen2 aspirate speed
@@ -349,8 +259,8 @@ def run(protocol: protocol_api.ProtocolContext):
         elif column == 1:
             aspirate_x_offset = 1.5
 
-        sourceLocation = mag_plate.wells()[sourceColumnIndex].bottom(-1.0).move(types.Point(x=aspirate_x_offset, y=0, z=0))  # Bottom-left (odd columns) or right (even columns)
-        destinationLocation = temp_plate.wells()[destinationColumnIndex].bottom(1.0)
+        sourceLocation = mag_plate_wells.bottom(sourceColumnIndex, -1.0, x=aspirate_x_offset)  # Bottom-left (odd columns) or right (even columns)
+        destinationLocation = temp_plate_wells.bottom(destinationColumnIndex, 1.0)
 
         p300x8.transfer(volume=61 + 10, # Add dead volume to final aspirate
                         source=sourceLocation,
@@ -362,5 +272,5 @@ def run(protocol: protocol_api.ProtocolContext):
                         blowout_location='destination well',
                         touch_tip=False)
 
-    # 4C hold for sample stability
-    temperature_module.set_temperature(4)
\ No newline at end of file
+    # 4C hold for sample stability; the module keeps cooling to 4C after the run ends
+    temperature_program.start(4)
\ No newline at end of file
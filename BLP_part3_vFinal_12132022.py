@@ -4,10 +4,13 @@
 
 # SECOND VERSION OF SCRIPT, FINAL MAJOR UPDATES (vFinal)
 # Handles 6 pooled samples at a time from column 9 of a 96w plate
+# Imports helper modules from this directory (mix_timing, mock_protocol (time model for mix_timing), temperature_program, well_index). Copy them to /data/user_storage (or another directory on the
+# robot's Python path) before running; uploading this file alone through the Opentrons app fails on those imports.
 
 from opentrons import protocol_api
-from opentrons import types
-import math
+from temperature_program import TemperatureProgram
+from mix_timing import timed_mix
+from well_index import well_index
 
 metadata = {
     'apiLevel': '2.8',
@@ -16,10 +19,14 @@ metadata = {
     'author': 'Max Benjamin'
 }
 
+# Sample volume (ul) in each sample well at the start, a module-level setting so it can be swept (see simulation_farm.py)
+starting_sample_volume = 65
+
 def run(protocol: protocol_api.ProtocolContext):
     # Load modules into worktable locations
     magnetic_module = protocol.load_module('magnetic module gen2', 1)
     temperature_module = protocol.load_module('temperature module gen2', 3)
+    temperature_program = TemperatureProgram(protocol, temperature_module) # Starts ramps without blocking the pipettes
 
     # Set tip box locations #
     p20x1_tips1 = protocol.load_labware('opentrons_96_tiprack_20ul', 9)
@@ -34,12 +41,18 @@ def run(protocol: protocol_api.ProtocolContext):
     mag_plate = magnetic_module.load_labware('eppendorf0030129504lobindpcr_96_wellplate_250ul',
                                              label='LoBind PCR plate with Adapter Basepiece on Mag Module')
 
+    # Precomputed well coordinates (built once per labware) for the pipetting loops below #
+    temp_plate_wells = well_index(temp_plate)
+    mag_plate_wells = well_index(mag_plate)
+    p300x8_tips1_wells = well_index(p300x8_tips1)
+    reagent_tube_carrier_wells = well_index(reagent_tube_carrier)
+    reagent_reservoir_plate_wells = well_index(reagent_reservoir_plate)
+
     # Set mounted pipette types #
     p20x1 = protocol.load_instrument('p20_single_gen2', 'left', tip_racks=[p20x1_tips1])
     p300x8 = protocol.load_instrument('p300_multi_gen2', 'right', tip_racks=[p300x8_tips1])
 
     # Declare liquid handling variables #
-    starting_sample_volume = 65
     adapter_mix_ii = 5
     nebnext_quick_ligation_reaction_buffer = 20
     t4_dna_ligase = 10
@@ -74,8 +87,8 @@ def run(protocol: protocol_api.ProtocolContext):
                 else:
                     tube_adjustment_offset = 1.0
 
-                sourceLocation = reagent_tube_carrier.wells()[sourceWellIndex]
-                destinationLocation = temp_plate.wells()[destinationWellIndex]
+                sourceLocation = reagent_tube_carrier_wells.well(sourceWellIndex)
+                destinationLocation = temp_plate_wells.well(destinationWellIndex)
                 p20x1.pick_up_tip()
                 p20x1.aspirate(volume=transfer_volume,
                                location=sourceLocation.bottom(tube_adjustment_offset),
@@ -87,13 +100,13 @@ def run(protocol: protocol_api.ProtocolContext):
                     elif tip_wipe == 1:
                         tip_wipe_x_offset = -4.5
 
-                    p20x1.move_to(location=sourceLocation.top().move(types.Point(x=tip_wipe_x_offset, y=0, z=0)),
+                    p20x1.move_to(location=reagent_tube_carrier_wells.top(sourceWellIndex, 0, x=tip_wipe_x_offset),
                                   speed=60,
                                   publish=False)
-                    p20x1.move_to(location=sourceLocation.top(-5.0).move(types.Point(x=tip_wipe_x_offset, y=0, z=0)),
+                    p20x1.move_to(location=reagent_tube_carrier_wells.top(sourceWellIndex, -5.0, x=tip_wipe_x_offset),
                                   speed=60,  # Default is 400mm/sec; set to Tip-touch max of 80mm/sec
                                   publish=False)
-                    p20x1.move_to(location=sourceLocation.top().move(types.Point(x=tip_wipe_x_offset, y=0, z=0)),
+                    p20x1.move_to(location=reagent_tube_carrier_wells.top(sourceWellIndex, 0, x=tip_wipe_x_offset),
                                   speed=60,
                                   publish=False)
 
@@ -109,6 +122,7 @@ def run(protocol: protocol_api.ProtocolContext):
                 p20x1.drop_tip()
             reagent_tube_index += 1
 
+    temperature_program.start(20) # Block reaches 20C while the ligation rxns are set up
     rxn_setup_from_tubes()
 
     # Mix adapter ligation rxn and incubate for 20min at 20C
@@ -117,8 +131,8 @@ def run(protocol: protocol_api.ProtocolContext):
         p300x8.flow_rate.dispense = 94
 
         columnIndex = 64  # Well Index 64 to start at column 9
-        sourceLocation = temp_plate.wells()[columnIndex].bottom(1.0)
-        tipLocation = p300x8_tips1.wells()[0]
+        sourceLocation = temp_plate_wells.bottom(columnIndex, 1.0)
+        tipLocation = p300x8_tips1_wells.well(0)
         p300x8.pick_up_tip(location=tipLocation)
         p300x8.mix(repetitions=3,
                    volume=(ligation_rxn_volume-10),
@@ -130,8 +144,7 @@ def run(protocol: protocol_api.ProtocolContext):
 
     pre_incubation_mix()
 
-    temperature_module.set_temperature(20)
-    protocol.delay(seconds=0, minutes=20, msg="20C hold for 20min")
+    temperature_program.hold(20, minutes=20, msg="20C hold for 20min")
 
     # Add AMPure XP beads to samples
     def ampure_bead_addition():
@@ -139,12 +152,12 @@ def run(protocol: protocol_api.ProtocolContext):
         p20x1.flow_rate.dispense = 15
         p20x1.flow_rate.blow_out = 15  # Increase blowout speed to compensate for higher dispense height
         sourceWellIndex = 12
-        sourceLocation = reagent_tube_carrier.wells()[sourceWellIndex]
+        sourceLocation = reagent_tube_carrier_wells.well(sourceWellIndex)
 
         p20x1.pick_up_tip()
         for well in range(0, len(sample_well_list)):
             destinationWellIndex = sample_well_list[well]
-            destinationLocation = temp_plate.wells()[destinationWellIndex].top(-4.0)  # Dispense from just barely inside the well
+            destinationLocation = temp_plate_wells.top(destinationWellIndex, -4.0)  # Dispense from just barely inside the well
             p20x1.transfer(volume=ampure_xp_beads_volume,
                            source=sourceLocation,
                            dest=destinationLocation,
@@ -163,28 +176,22 @@ def run(protocol: protocol_api.ProtocolContext):
     # Hula mix replication
     def hula_mix_replication(mix_time, mix_volume):
         mix_speed = mix_volume/10 # Calc to get 1 aspirate or dispense per 10 sec; 1 mix cycle per 20 sec
-        mix_count = math.ceil((mix_time*60)/20) # Turn min into sec, then div by seconds per cycle  
-        p300x8.flow_rate.aspirate = mix_speed  # 150ul at 15/sec = 1 mix per 20 sec = 3 mix/min; 10min = 30 cycles
+        p300x8.flow_rate.aspirate = mix_speed  # Mix repetitions follow from this flow rate (see mix_timing.py)
         p300x8.flow_rate.dispense = mix_speed
-        
-        columnIndex = 64
-        tipLocation = p300x8_tips1.wells()[0]
-        p300x8.pick_up_tip()
-        p300x8.mix(repetitions=mix_count,
-                   volume=mix_volume,
-                   location=temp_plate.wells()[columnIndex].bottom(1.0),
-                   rate=1.0)
-        p300x8.blow_out()
-        p300x8.drop_tip(location=tipLocation)
-        p300x8_tips1.return_tips(start_well=tipLocation, num_channels=8)
+
+        timed_mix(protocol, p300x8,
+                  mix_locations=[temp_plate_wells.bottom(64, 1.0)],
+                  tip_locations=[p300x8_tips1_wells.well(0)],
+                  volume=mix_volume,
+                  minutes=mix_time)
 
     hula_mix_replication(10, total_rxn_volume) # Mix for 10min
 
     # Transfer samples from temp module plate to mag module plate
     def temp_to_mag_transfer(transfer_volume, columnIndex):
-        sourceLocation = temp_plate.wells()[columnIndex].bottom(1.0)
-        destinationLocation = mag_plate.wells()[columnIndex].center()
-        tipLocation=p300x8_tips1.wells()[0]
+        sourceLocation = temp_plate_wells.bottom(columnIndex, 1.0)
+        destinationLocation = mag_plate_wells.center(columnIndex)
+        tipLocation=p300x8_tips1_wells.well(0)
 
         p300x8.flow_rate.aspirate = 94
         p300x8.flow_rate.dispense = 94
@@ -200,6 +207,7 @@ def run(protocol: protocol_api.ProtocolContext):
         p300x8_tips1.return_tips(start_well=tipLocation, num_channels=8)
 
     temp_to_mag_transfer(total_rxn_volume, 64)
+    temperature_program.start(37) # Temp plate is empty until the eluate comes back; it warms to 37C during the washes
 
     # Engage magnet module to pellet magbeads
     magnetic_module.engage(14.5) # This should bring magbeads to the bottom/right (odd-number columns) or bottom/left(even-number columns)
@@ -211,10 +219,10 @@ def run(protocol: protocol_api.ProtocolContext):
         p300x8.flow_rate.dispense = 94
         
         columnIndex = 64 # Well Index 64 to start at column 9
-        tipLocation = p300x8_tips1.wells()[0]
+        tipLocation = p300x8_tips1_wells.well(0)
 
         x_offset = -1.75
-        sourceLocation = mag_plate.wells()[columnIndex].bottom(0).move(types.Point(x=x_offset, y=0, z=0))  # Bottom left well location
+        sourceLocation = mag_plate_wells.bottom(columnIndex, 0, x=x_offset)  # Bottom left well location
 
         p300x8.pick_up_tip(location=tipLocation)
         p300x8.aspirate(volume=total_rxn_volume,
@@ -229,9 +237,9 @@ def run(protocol: protocol_api.ProtocolContext):
         magnetic_module.disengage()
         columnIndex = 64 # Well Index 64 to start at column 9
         # Add LFB to column 9 magplate
-        sourceLocation = reagent_reservoir_plate.wells()[0].bottom(0.5) # Long Fragment Buffer located in wells A1:F1
+        sourceLocation = reagent_reservoir_plate_wells.bottom(0, 0.5) # Long Fragment Buffer located in wells A1:F1
         x_offset = 1.75
-        destinationLocation = mag_plate.wells()[columnIndex].top(-4.0).move(types.Point(x=x_offset, y=0, z=0))  # Upper-right (odd-numbered columns) in well
+        destinationLocation = mag_plate_wells.top(columnIndex, -4.0, x=x_offset)  # Upper-right (odd-numbered columns) in well
 
         p300x8.flow_rate.aspirate = 94  # default aspirate flow rate
         p300x8.flow_rate.dispense = 94 # default dispense flow rate
@@ -245,8 +253,8 @@ def run(protocol: protocol_api.ProtocolContext):
         # Now mix, using currently loaded tips
         aspirate_x_offset = -1.75
         dispense_x_offset = 1.75
-        sourceLocation = mag_plate.wells()[columnIndex].bottom(1.0).move(types.Point(x=aspirate_x_offset, y=0, z=0))  # Bottom-left (odd columns)
-        destinationLocation = mag_plate.wells()[columnIndex].center().move(types.Point(x=dispense_x_offset, y=0, z=0))  # Top-right (odd-number columns)
+        sourceLocation = mag_plate_wells.bottom(columnIndex, 1.0, x=aspirate_x_offset)  # Bottom-left (odd columns)
+        destinationLocation = mag_plate_wells.center(columnIndex, x=dispense_x_offset)  # Top-right (odd-number columns)
 
         for loop in range(0,15):
             p300x8.aspirate(volume=long_fragment_buffer,
@@ -261,7 +269,7 @@ def run(protocol: protocol_api.ProtocolContext):
         protocol.delay(seconds=0, minutes=3, msg="Wait for magnetic beads to pellet")
 
         aspirate_x_offset = -1.75
-        sourceLocation = mag_plate.wells()[columnIndex].bottom(0).move(types.Point(x=aspirate_x_offset, y=0, z=0))  # Bottom-left (odd columns)
+        sourceLocation = mag_plate_wells.bottom(columnIndex, 0, x=aspirate_x_offset)  # Bottom-left (odd columns)
 
         p300x8.aspirate(volume=long_fragment_buffer,
                         location=sourceLocation,
@@ -281,9 +289,9 @@ def run(protocol: protocol_api.ProtocolContext):
         magnetic_module.disengage()
         columnIndex = 64  # Well Index 64 to start at column 9
         # Add EB to column 9 magplate
-        sourceLocation = reagent_reservoir_plate.wells()[8].bottom(0.5)  # Elution Buffer located in wells A2:F2
+        sourceLocation = reagent_reservoir_plate_wells.bottom(8, 0.5)  # Elution Buffer located in wells A2:F2
         x_offset = 1.75
-        destinationLocation = mag_plate.wells()[columnIndex].center().move(types.Point(x=x_offset, y=0, z=0))  # Upper-right (odd-numbered columns) in well
+        destinationLocation = mag_plate_wells.center(columnIndex, x=x_offset)  # Upper-right (odd-numbered columns) in well
 
         p300x8.flow_rate.aspirate = 94  # default aspirate flow rate
         p300x8.flow_rate.dispense = 94  # default dispense flow rate
@@ -297,8 +305,8 @@ def run(protocol: protocol_api.ProtocolContext):
         # Now mix, using currently loaded tips
         aspirate_x_offset = -1.75
         dispense_x_offset = 1.75
-        sourceLocation = mag_plate.wells()[columnIndex].bottom(-1.0).move(types.Point(x=aspirate_x_offset, y=0, z=0))  # Bottom-left (odd columns)
-        destinationLocation = mag_plate.wells()[columnIndex].center().move(types.Point(x=dispense_x_offset, y=0, z=0))  # Middle-right (odd-number columns)
+        sourceLocation = mag_plate_wells.bottom(columnIndex, -1.0, x=aspirate_x_offset)  # Bottom-left (odd columns)
+        destinationLocation = mag_plate_wells.center(columnIndex, x=dispense_x_offset)  # Middle-right (odd-number columns)
 
         for loop in range(0, 30): # 30 Elution buffer washes
             p300x8.aspirate(volume=transfer_volume,
@@ -325,8 +333,8 @@ def run(protocol: protocol_api.ProtocolContext):
         elif ((sourceColumnIndex/8)+1) % 2 != 0:
             aspirate_x_offset = -1.75
 
-        sourceLocation = mag_plate.wells()[sourceColumnIndex].bottom(-1.0).move(types.Point(x=aspirate_x_offset, y=0, z=0))  # Bottom-left (odd columns) or right (even columns)
-        destinationLocation = temp_plate.wells()[destinationColumnIndex].bottom(1.0)
+        sourceLocation = mag_plate_wells.bottom(sourceColumnIndex, -1.0, x=aspirate_x_offset)  # Bottom-left (odd columns) or right (even columns)
+        destinationLocation = temp_plate_wells.bottom(destinationColumnIndex, 1.0)
 
         p300x8.transfer(volume=transfer_volume,
                         source=sourceLocation,
@@ -338,8 +346,7 @@ def run(protocol: protocol_api.ProtocolContext):
                         blowout_location='destination well',
                         touch_tip=False)
     mag_to_temp_transfer(elution_buffer, 64)
-    temperature_module.set_temperature(37)
-    protocol.delay(seconds=0, minutes=20, msg="Wait for Elution Incubation")
+    temperature_program.hold(37, minutes=20, msg="Wait for Elution Incubation")
 
     # Transfer samples back to mag module
     temp_to_mag_transfer(elution_buffer, 64)
@@ -349,5 +356,5 @@ def run(protocol: protocol_api.ProtocolContext):
     protocol.delay(seconds=0, minutes=3, msg="Wait for magnetic beads to pellet")
     mag_to_temp_transfer(elution_buffer, 64)
 
-    # 4C hold to preserve prepped samples at end of script
-    temperature_module.set_temperature(4)
\ No newline at end of file
+    # 4C hold to preserve prepped samples at end of script; the module keeps cooling to 4C after the run ends
+    temperature_program.start(4)
\ No newline at end of file
@@ -0,0 +1,110 @@
+# Script name: aspiration_planner.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python aspiration_planner.py worklist.csv --max-volume 300 --disposal-volume 50
+# Splits each consolidated cherrypick group into aspirations that fit the pipette once the disposal volume is counted.
+# The plan is plain lists/dicts (JSON-friendly), so it can be printed or saved and checked before anything runs.
+
+import argparse
+import json
+import math
+
+
+def split_oversized_volumes(volumes, working_volume):
+    # A destination that needs more than one tip-full is split into equal parts, same as pipette.distribute() does
+    dispenses = []
+    for destination_index, volume in enumerate(volumes):
+        part_count = int(math.ceil(volume / working_volume))
+        for part in range(0, part_count):
+            dispenses.append((destination_index, volume / part_count))
+    return dispenses
+
+
+def pack_dispenses(dispenses, working_volume):
+    # First-fit decreasing bin packing: largest dispenses are placed first, each into the first aspiration that still
+    # has room. This never needs more than 11/9 of the optimal number of aspirations (+1), and for the common
+    # equal-volume worklists it is optimal.
+    bins = []
+    bin_volumes = []
+    for dispense_number in sorted(range(len(dispenses)), key=lambda n: (-dispenses[n][1], n)):
+        volume = dispenses[dispense_number][1]
+        for bin_number in range(len(bins)):
+            if bin_volumes[bin_number] + volume <= working_volume + 1e-9:
+                bins[bin_number].append(dispense_number)
+                bin_volumes[bin_number] += volume
+                break
+        else:
+            bins.append([dispense_number])
+            bin_volumes.append(volume)
+
+    # Keep the worklist order inside each aspiration and between aspirations so plates are still visited in order
+    bins = [sorted(bin_dispenses) for bin_dispenses in bins]
+    bins.sort(key=lambda bin_dispenses: bin_dispenses[0])
+    return bins
+
+
+def plan_group_aspirations(dictionary, max_volume, disposal_volume):
+    # Returns the list of aspirations for one consolidated group (one Source Plate:Source Well combination)
+    working_volume = max_volume - disposal_volume
+    if working_volume <= 0:
+        raise ValueError('Disposal volume ({} uL) leaves no room in a {} uL pipette'.format(disposal_volume, max_volume))
+
+    dispenses = split_oversized_volumes(dictionary['Volumes'], working_volume)
+    aspirations = []
+    for bin_dispenses in pack_dispenses(dispenses, working_volume):
+        destination_indexes = [dispenses[n][0] for n in bin_dispenses]
+        volumes = [dispenses[n][1] for n in bin_dispenses]
+        aspirations.append({
+            'Destination Plates': [dictionary['Destination Plates'][index] for index in destination_indexes],
+            'Destination Wells': [dictionary['Destination Wells'][index] for index in destination_indexes],
+            'Volumes': volumes,
+            'Dispense Volume': sum(volumes),
+            'Aspirate Volume': sum(volumes) + disposal_volume
+        })
+    return aspirations
+
+
+def plan_aspirations(transfer_info_consolidated, max_volume, disposal_volume):
+    # Copy of transfer_info_consolidated where every group also carries its 'Aspirations' list
+    aspiration_plan = []
+    for dictionary in transfer_info_consolidated:
+        planned_group = dict(dictionary)
+        planned_group['Aspirations'] = plan_group_aspirations(dictionary, max_volume, disposal_volume)
+        aspiration_plan.append(planned_group)
+    return aspiration_plan
+
+
+def sequential_aspiration_count(volumes, working_volume):
+    # Aspirations needed when destinations are filled strictly in worklist order (the old pipette.distribute() split)
+    aspiration_count = 0
+    current_volume = None
+    for destination_index, volume in split_oversized_volumes(volumes, working_volume):
+        if current_volume is None or current_volume + volume > working_volume + 1e-9:
+            aspiration_count += 1
+            current_volume = 0
+        current_volume += volume
+    return aspiration_count
+
+
+def aspiration_plan_report(aspiration_plan, max_volume, disposal_volume):
+    # Summary lines for protocol.comment(): planned aspirations and how many were saved over in-order filling
+    working_volume = max_volume - disposal_volume
+    planned_count = sum(len(dictionary['Aspirations']) for dictionary in aspiration_plan)
+    sequential_count = sum(sequential_aspiration_count(dictionary['Volumes'], working_volume)
+                           for dictionary in aspiration_plan)
+    return ['{} aspirations planned ({} uL working volume, {} uL disposal); {} saved over in-order filling'.format(
+        planned_count, working_volume, disposal_volume, sequential_count - planned_count)]
+
+
+if __name__ == '__main__':
+    from cherrypick_worklist import consolidate_transfers, read_worklist
+
+    parser = argparse.ArgumentParser(description='Print the aspiration plan for a cherrypick worklist as JSON')
+    parser.add_argument('worklist_path')
+    parser.add_argument('--max-volume', type=float, default=300)
+    parser.add_argument('--disposal-volume', type=float, default=50)
+    args = parser.parse_args()
+
+    plan = plan_aspirations(consolidate_transfers(read_worklist(args.worklist_path)), args.max_volume, args.disposal_volume)
+    print(json.dumps(plan, indent=2))
+    for report_line in aspiration_plan_report(plan, args.max_volume, args.disposal_volume):
+        print(report_line)
@@ -16,6 +16,9 @@ metadata = {
     'author': 'Max Benjamin'
 }
 
+# Sample volume (ul) in each sample well at the start, a module-level setting so it can be swept (see simulation_farm.py)
+starting_sample_volume = 48
+
 def run(protocol: protocol_api.ProtocolContext):
     # Load modules into worktable locations
     magnetic_module = protocol.load_module('magnetic module gen2', 1)
@@ -40,7 +43,6 @@ def run(protocol: protocol_api.ProtocolContext):
     p300x8 = protocol.load_instrument('p300_multi_gen2', 'right', tip_racks=[p300x8_tips1])
 
     # Declare liquid handling variables #
-    starting_sample_volume = 48
     nebnext_ffpe_dna_repair_buffer = 3.5
     ultra_ii_end_prep_reaction_buffer = 3.5
     ultra_ii_end_prep_enzyme_mix = 3
@@ -0,0 +1,138 @@
+# Script name: bead_cleanup.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Magnetic bead cleanup shared by the BLP protocols: pellet, supernatant removal, ethanol washes, elution water and
+# resuspension for any list of sample columns on the magnet plate.
+# The BLP scripts used to clean up one column at a time, disengaging the magnet for each column's elution and
+# engaging it again (with another pellet wait) for the next column. Here the magnet stays engaged from the first
+# supernatant removal until every column has its elution water, pellet() skips its wait while the beads are still
+# pelleted, and the magnet is released once to resuspend all columns. The scripts still run each column's supernatant
+# removal, ethanol washes and water back to back (remove_supernatant(), ethanol_washes() and add_water() take one
+# column), so a pellet is only ever bare for a tip change and never waits on the other columns' washes, whatever the
+# column count. Pipetting still grows with the column count; the waits don't.
+# Tips follow the BLP scripts: the ethanol washes of a column share one tip unless tip_per_wash is set, and the
+# resuspension mix reuses the column's water tip (put back in its rack spot in between) unless new_elution_tip is set.
+# Column indexes are well indexes of the top well of each column (0 = column 1, 8 = column 2, ...). Beads pull to the
+# right of the well in odd-numbered plate columns and to the left in even ones; liquid is taken off the other side
+# (side_offset mm from the well center) and added down the bead side.
+
+
+class BeadCleanup:
+    def __init__(self, protocol, pipette, magnetic_module, plate_wells, column_indexes, engage_height=14.5, side_offset=1.5,
+                 new_elution_tip=False):
+        self.protocol = protocol
+        self.pipette = pipette
+        self.magnetic_module = magnetic_module
+        self.plate_wells = plate_wells # well_index() of the plate on the magnetic module
+        self.column_indexes = list(column_indexes)
+        self.engage_height = engage_height
+        self.side_offset = side_offset
+        self.new_elution_tip = new_elution_tip
+        self.pelleted = False
+        self.water_volumes = {} # column index -> elution water added by add_water()
+        self.water_tips = {} # column index -> rack spot of the tip add_water() put back for the elution mix
+
+    def bead_side(self, column_index):
+        return self.side_offset if (column_index // 8) % 2 == 0 else -self.side_offset
+
+    def pellet(self, minutes=3, msg='Wait for magnetic beads to pellet'):
+        # Engage the magnet and wait for the pellet, unless the beads are still pelleted from an earlier wait
+        if self.pelleted:
+            return
+        self.magnetic_module.engage(self.engage_height)
+        self.protocol.delay(seconds=0, minutes=minutes, msg=msg)
+        self.pelleted = True
+
+    def release(self):
+        self.magnetic_module.disengage()
+        self.pelleted = False
+
+    def check_pelleted(self, step):
+        if not self.pelleted:
+            raise ValueError('{} needs pelleted beads; call pellet() first'.format(step))
+
+    def remove_supernatant(self, column_index, volume, tip_location=None, height=0, rate=0.10):
+        # tip_location: a tip to reuse (e.g. one returned after mixing the same samples), else a new tip
+        self.check_pelleted('Supernatant removal')
+        self.pipette.pick_up_tip(location=tip_location)
+        self.pipette.aspirate(volume=volume,
+                              location=self.plate_wells.bottom(column_index, height, x=-self.bead_side(column_index)),
+                              rate=rate) # Very slow aspirate to leave the pellet behind
+        self.pipette.drop_tip()
+
+    def next_tip(self):
+        # Next unused tip (column) in the pipette's tip racks, the one pick_up_tip() would take
+        for tip_rack in self.pipette.tip_racks:
+            tip = tip_rack.next_tip(self.pipette.channels)
+            if tip is not None:
+                return tip
+        raise ValueError('The {} pipette has no tips left for the bead cleanup'.format(self.pipette.name))
+
+    def ethanol_washes(self, column_index, source, volume=200, removal_volume=300, removal_heights=(0, -1.0), air_gap=20,
+                       dispense_rate=0.5, removal_air_gap=0, tip_per_wash=False):
+        # One wash per removal height, all on one tip unless tip_per_wash; the ethanol is blown out in the trash
+        self.check_pelleted('Ethanol wash')
+        if not tip_per_wash:
+            self.pipette.pick_up_tip()
+        for removal_height in removal_heights:
+            if tip_per_wash:
+                self.pipette.pick_up_tip()
+            self.pipette.aspirate(volume=volume,
+                                  location=source,
+                                  rate=0.5) # 50% slow aspirate for ethanol
+            self.pipette.air_gap(volume=air_gap) # Airgap to keep ethanol from dripping
+            self.pipette.dispense(volume=volume + air_gap,
+                                  location=self.plate_wells.top(column_index, -4.0, x=self.bead_side(column_index)),
+                                  rate=dispense_rate) # Gentle dispense down the bead side to keep the pellet in place
+            self.pipette.aspirate(volume=removal_volume,
+                                  location=self.plate_wells.bottom(column_index, removal_height, x=-self.bead_side(column_index)),
+                                  rate=0.10) # 10% very slow aspirate speed
+            if removal_air_gap:
+                self.pipette.air_gap(volume=removal_air_gap)
+            self.pipette.blow_out(location=self.protocol.fixed_trash['A1'])
+            if tip_per_wash:
+                self.pipette.drop_tip()
+        if not tip_per_wash:
+            self.pipette.drop_tip()
+
+    def add_water(self, column_index, source, volume, water_offset=None):
+        # Elution water from above on the bead side, with a new tip that goes back to its rack spot for the elution mix.
+        # Run it straight after the column's last ethanol removal: the pellet stays on the magnet under water until
+        # elute() resuspends it.
+        water_offset = self.side_offset if water_offset is None else water_offset
+        water_tip = self.next_tip()
+        self.pipette.pick_up_tip(location=water_tip)
+        self.pipette.aspirate(volume=volume,
+                              location=source,
+                              rate=1.0)
+        self.pipette.dispense(volume=volume,
+                              location=self.plate_wells.top(column_index, -4.0, x=water_offset if self.bead_side(column_index) > 0 else -water_offset),
+                              rate=1.0)
+        if self.new_elution_tip:
+            self.pipette.drop_tip()
+        else:
+            self.pipette.drop_tip(location=water_tip)
+            water_tip.parent.return_tips(start_well=water_tip, num_channels=self.pipette.channels)
+            self.water_tips[column_index] = water_tip
+        self.water_volumes[column_index] = volume
+
+    def elute(self, mix_count, mix_height=0, dispense_rate=3.0):
+        # Release the magnet and resuspend every column in its water, on the column's water tip (or a new one with
+        # new_elution_tip): aspirate away from the beads, dispense fast against them to knock them off the well side
+        dry_columns = [column_index for column_index in self.column_indexes if column_index not in self.water_volumes]
+        if dry_columns:
+            raise ValueError('Columns at well indexes {} have no elution water; call add_water() first'.format(dry_columns))
+        self.release()
+        for column_index in self.column_indexes:
+            volume = self.water_volumes[column_index]
+            aspirate_location = self.plate_wells.bottom(column_index, mix_height, x=-self.bead_side(column_index))
+            dispense_location = self.plate_wells.center(column_index, x=self.bead_side(column_index))
+            self.pipette.pick_up_tip(location=self.water_tips.get(column_index))
+            for mix in range(0, mix_count):
+                self.pipette.aspirate(volume=volume,
+                                      location=aspirate_location,
+                                      rate=1.0)
+                self.pipette.dispense(volume=volume,
+                                      location=dispense_location,
+                                      rate=dispense_rate)
+            self.pipette.blow_out(dispense_location)
+            self.pipette.drop_tip()
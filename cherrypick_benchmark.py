@@ -0,0 +1,266 @@
+# Script name: cherrypick_benchmark.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python cherrypick_benchmark.py --output cherrypick_benchmark_results.json
+# Command line (old vs indexed consolidation only) = python cherrypick_benchmark.py --legacy
+# Benchmarks the planning path of the multidispense cherrypick scripts on synthetic worklists from 1k to 1M rows.
+# Four worklist shapes are generated: random (LIMS-style), many_to_one (pooling many sources into few wells),
+# one_to_many (few sources spread over many wells) and column_aligned (A-H -> A-H columns for the 8-channel head).
+# Each worklist is written to a temporary .csv, then every step the protocol runs before the first pipette move is
+# timed on its own (CSV parse, pre-flight validation, multichannel classification, consolidation, destination routing
+# and aspiration planning), with the peak memory of each step from tracemalloc. Results go to a JSON file so runs can
+# be compared as the planner grows.
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+
+from aspiration_planner import plan_aspirations
+from cherrypick_multichannel import classify_transfers
+from cherrypick_route import optimize_routes, plate_well_positions
+from cherrypick_worklist import WORKLIST_COLUMNS, consolidate_transfers, read_worklist
+from mock_protocol import ProtocolContext
+from worklist_validator import validate_worklist
+
+row_counts = [100, 1000, 10000, 100000, 1000000]
+legacy_row_limit = 10000 # The old rescanning loop is O(n^2); don't wait minutes for it past this size
+rows_per_source_well = 4 # Average dispenses per consolidated group in the synthetic worklist
+well_names = [row + str(column) for column in range(1, 13) for row in 'ABCDEFGH']
+
+suite_row_counts = [1000, 10000, 100000, 1000000]
+worklist_shapes = ['random', 'many_to_one', 'one_to_many', 'column_aligned']
+route_row_limit = 100000 # 2-opt is quadratic in group size; routing is skipped for bigger worklists...
+route_group_limit = 200 # ...and for worklists with groups bigger than this
+max_volume = 300 # p300 single GEN2, same settings as the cherrypick scripts
+disposal_volume = 50
+mix_volume = 300
+min_volume = 20
+source_slots = ['1', '4', '7', '10']
+destination_slots = ['2', '5', '8', '11']
+
+
+def synthetic_worklist(row_count, seed=0):
+    # Random LIMS-style worklist: enough source plates that the number of groups grows with the row count
+    rng = random.Random(seed)
+    source_well_count = max(1, row_count // rows_per_source_well)
+    transfer_info = []
+    for _ in range(row_count):
+        source_index = rng.randrange(source_well_count)
+        transfer_info.append({
+            'Source Plate': 'Source {}'.format(source_index // 96 + 1),
+            'Source Well': well_names[source_index % 96],
+            'Destination Plate': 'Destination {}'.format(rng.randrange(4) + 1),
+            'Destination Well': rng.choice(well_names),
+            'Volume': str(rng.choice([10, 25, 50, 100]))
+        })
+    return transfer_info
+
+
+def legacy_consolidate_transfers(transfer_info):
+    # Original module-level loop from multidispense_cherrypick_VTT_05052023.py, kept only for comparison
+    transfer_info_consolidated = []
+    for transfer in transfer_info:
+        transfer_key = (transfer['Source Plate'], transfer['Source Well'])
+        transfer_exists = False
+        for consolidated_transfer in transfer_info_consolidated:
+            if (consolidated_transfer['Source Plate'], consolidated_transfer['Source Well']) == transfer_key:
+                consolidated_transfer['Destination Wells'].append(transfer['Destination Well'])
+                consolidated_transfer['Volumes'].append(float(transfer['Volume']))
+                consolidated_transfer['Destination Plates'].append(transfer['Destination Plate'])
+                consolidated_transfer['Total Volume'] += float(transfer['Volume'])
+                consolidated_transfer['Dispense Count'] = len(consolidated_transfer['Destination Wells'])
+                transfer_exists = True
+                break
+        if not transfer_exists:
+            transfer_info_consolidated.append({
+                'Source Plate': transfer['Source Plate'],
+                'Source Well': transfer['Source Well'],
+                'Destination Plates': [transfer['Destination Plate']],
+                'Destination Wells': [transfer['Destination Well']],
+                'Volumes': [float(transfer['Volume'])],
+                'Total Volume': float(transfer['Volume']),
+                'Dispense Count': 1
+            })
+    return transfer_info_consolidated
+
+
+def time_call(function, argument):
+    start_time = time.perf_counter()
+    result = function(argument)
+    return result, time.perf_counter() - start_time
+
+
+def transfer(source_index, destination_index, volume):
+    # Worklist row for the n-th source well and n-th destination well, counting wells across plates
+    return {
+        'Source Plate': 'Source {}'.format(source_index // 96 + 1),
+        'Source Well': well_names[source_index % 96],
+        'Destination Plate': 'Destination {}'.format(destination_index // 96 + 1),
+        'Destination Well': well_names[destination_index % 96],
+        'Volume': str(volume)
+    }
+
+
+def shaped_worklist(shape, row_count, seed=0):
+    rng = random.Random(seed)
+    if shape == 'random':
+        return synthetic_worklist(row_count, seed)
+    if shape == 'many_to_one':
+        # Every row has its own source well; each destination well pools 24 sources
+        return [transfer(row_number, row_number // 24, rng.choice([20, 25, 50])) for row_number in range(row_count)]
+    if shape == 'one_to_many':
+        # One source well per 480 rows (5 plates' worth of dispenses), destinations fill plate after plate
+        return [transfer(row_number // 480, row_number, rng.choice([20, 50, 100])) for row_number in range(row_count)]
+    if shape == 'column_aligned':
+        # Whole A-H columns, same volume down each column, from 12 source columns per plate to random destination columns
+        transfer_info = []
+        for batch_number in range(row_count // 8):
+            source_column = batch_number % 1200
+            destination_column = rng.randrange(max(12, row_count // 96))
+            volume = rng.choice([25, 50, 100])
+            for row_index in range(8):
+                transfer_info.append(transfer((source_column // 12) * 96 + (source_column % 12) * 8 + row_index,
+                                              (destination_column // 12) * 96 + (destination_column % 12) * 8 + row_index,
+                                              volume))
+        return transfer_info
+    raise ValueError('Unknown worklist shape "{}"'.format(shape))
+
+
+def write_worklist(transfer_info, worklist_path):
+    with open(worklist_path, 'w', newline='') as worklist_file:
+        csv_writer = csv.DictWriter(worklist_file, fieldnames=WORKLIST_COLUMNS)
+        csv_writer.writeheader()
+        csv_writer.writerows(transfer_info)
+
+
+def benchmark_deck_config(transfer_info):
+    # Every plate in the worklist gets a slot; plates beyond the 4 source and 4 destination slots are swapped by hand
+    deck_config = {}
+    for plate_column, slots in [('Source Plate', source_slots), ('Destination Plate', destination_slots)]:
+        plate_names = sorted(set(row[plate_column] for row in transfer_info), key=lambda plate_name: int(plate_name.split()[-1]))
+        for plate_number, plate_name in enumerate(plate_names):
+            deck_config[plate_name] = {'slot': slots[plate_number % len(slots)],
+                                       'labware': 'thermoscientificnunc_96_wellplate_2000ul'}
+    return deck_config
+
+
+def benchmark_plate_labware(deck_config):
+    # Plate name -> labware loaded on a mock ProtocolContext, as the scripts take it from the deck map
+    protocol = ProtocolContext()
+    labware_by_slot = {}
+    for entry in deck_config.values():
+        if entry['slot'] not in labware_by_slot:
+            labware_by_slot[entry['slot']] = protocol.load_labware(entry['labware'], entry['slot'])
+    return {plate_name: labware_by_slot[entry['slot']] for plate_name, entry in deck_config.items()}
+
+
+def measure(function, measure_memory):
+    # (result, seconds, peak MB). tracemalloc slows Python down, so memory is measured in its own pass.
+    if measure_memory:
+        tracemalloc.start()
+        result = function()
+        peak_memory = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        return result, None, peak_memory
+    start_time = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start_time, None
+
+
+def run_stages(worklist_path, deck_config, measure_memory):
+    # Run the planning path once, step by step, in the same order as run() in the cherrypick scripts
+    stages = {}
+    plate_labware = benchmark_plate_labware(deck_config)
+    transfer_info, stages['parse'], memory_parse = measure(lambda: list(read_worklist(worklist_path)), measure_memory)
+    (errors, _), stages['validate'], memory_validate = measure(lambda: validate_worklist(
+        worklist_path, plate_labware, deck_config, min_volume, None, disposal_volume, mix_volume), measure_memory)
+    (multichannel_transfer_info, single_transfer_info, single_count), stages['classify'], memory_classify = measure(
+        lambda: classify_transfers(lambda: transfer_info), measure_memory)
+    consolidated_groups, stages['consolidate'], memory_consolidate = measure(
+        lambda: consolidate_transfers(multichannel_transfer_info) + consolidate_transfers(single_transfer_info), measure_memory)
+
+    aspiration_plan, stages['plan'], memory_plan = measure(
+        lambda: plan_aspirations(consolidated_groups, max_volume, disposal_volume), measure_memory)
+
+    # Routing runs on the planned aspirations, like in the scripts
+    largest_group = max([group['Dispense Count'] for group in consolidated_groups] or [0])
+    plate_positions = plate_well_positions(plate_labware)
+    if len(transfer_info) <= route_row_limit and largest_group <= route_group_limit:
+        (aspiration_plan, route_report), stages['route'], memory_route = measure(
+            lambda: optimize_routes(aspiration_plan, plate_positions), measure_memory)
+    else:
+        stages['route'], memory_route = None, None
+
+    memory = {'parse': memory_parse, 'validate': memory_validate, 'classify': memory_classify,
+              'consolidate': memory_consolidate, 'route': memory_route, 'plan': memory_plan}
+    counts = {'groups': len(consolidated_groups), 'multichannel_batches': len(multichannel_transfer_info),
+              'aspirations': sum(len(group['Aspirations']) for group in aspiration_plan),
+              'validation_errors': len(errors), 'largest_group': largest_group}
+    return stages, memory, counts
+
+
+def run_suite(row_counts, shapes, output_path, measure_memory=True):
+    results = []
+    print('{:>15} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'shape', 'rows', 'parse', 'validate', 'classify', 'consol.', 'route', 'plan', 'peak MB'))
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        for shape in shapes:
+            for row_count in row_counts:
+                transfer_info = shaped_worklist(shape, row_count)
+                deck_config = benchmark_deck_config(transfer_info)
+                worklist_path = os.path.join(temporary_directory, '{}_{}.csv'.format(shape, row_count))
+                write_worklist(transfer_info, worklist_path)
+                del transfer_info
+
+                stages, _, counts = run_stages(worklist_path, deck_config, False)
+                memory = run_stages(worklist_path, deck_config, True)[1] if measure_memory else {}
+                results.append({'shape': shape, 'rows': row_count, 'seconds': stages, 'peak_memory_mb': memory,
+                                'counts': counts})
+
+                print('{:>15} {:>8} {} {:>9}'.format(shape, row_count, ' '.join(
+                    '{:>9.3f}'.format(stages[stage]) if stages[stage] is not None else '{:>9}'.format('-')
+                    for stage in ['parse', 'validate', 'classify', 'consolidate', 'route', 'plan']),
+                    '{:.1f}'.format(max(value for value in memory.values() if value is not None)) if memory else '-'))
+
+    with open(output_path, 'w') as output_file:
+        json.dump({'generated': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                   'machine': platform.machine(), 'results': results}, output_file, indent=2)
+    print('Results written to {}'.format(output_path))
+    return results
+
+
+def run_benchmark():
+    print('{:>10} {:>10} {:>12} {:>12} {:>14}'.format('rows', 'groups', 'indexed (s)', 'legacy (s)', 'ns per row'))
+    for row_count in row_counts:
+        transfer_info = synthetic_worklist(row_count)
+        consolidated, indexed_seconds = time_call(consolidate_transfers, transfer_info)
+
+        legacy_column = '-'
+        if row_count <= legacy_row_limit:
+            legacy_consolidated, legacy_seconds = time_call(legacy_consolidate_transfers, transfer_info)
+            if legacy_consolidated != consolidated:
+                raise RuntimeError('Indexed consolidation does not match the legacy output at {} rows'.format(row_count))
+            legacy_column = '{:.4f}'.format(legacy_seconds)
+
+        print('{:>10} {:>10} {:>12.4f} {:>12} {:>14.1f}'.format(row_count, len(consolidated), indexed_seconds,
+                                                               legacy_column, indexed_seconds / row_count * 1e9))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the cherrypick planning path on synthetic worklists')
+    parser.add_argument('--rows', type=int, nargs='+', default=suite_row_counts)
+    parser.add_argument('--shapes', nargs='+', choices=worklist_shapes, default=worklist_shapes)
+    parser.add_argument('--output', default='cherrypick_benchmark_results.json')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass (roughly halves the run time)')
+    parser.add_argument('--legacy', action='store_true', help='only compare indexed and legacy consolidation')
+    args = parser.parse_args()
+
+    if args.legacy:
+        run_benchmark()
+    else:
+        run_suite(args.rows, args.shapes, args.output, not args.no_memory)
@@ -0,0 +1,126 @@
+# Script name: cherrypick_checkpoint.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Checkpoint/resume for long cherrypick runs.
+# While a run goes, one short JSON line is appended to the checkpoint file for every tip pick-up, every aspiration
+# started and finished, and every finished group (index, tips used, volume dispensed). If the run is aborted, starting
+# the same protocol again with the same worklist reads the file back, skips everything already done and starts each
+# pipette at the next unused tip. A different worklist or different settings give a different run key, so an old
+# checkpoint is never applied to the wrong run; a run that finished marks its checkpoint complete so the next run
+# starts fresh.
+# An aspiration that was started but not finished when the run stopped may have dispensed into some of its wells. It is
+# never repeated: the resumed run lists its wells in the run log so they can be checked by hand.
+# Nothing is written while the protocol is being simulated (the app's upload check, opentrons_simulate), but an
+# existing checkpoint is still read so the simulation shows what the resumed run will do.
+
+import hashlib
+import json
+import os
+
+
+def run_key(run_order):
+    # Short hash of everything the run will do, in order. run_order items are JSON-friendly (mount, group) pairs.
+    return hashlib.sha1(json.dumps(run_order, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def next_tip(pipette, tips_used):
+    # Tip rack well the pipette's next pick-up should come from after tips_used pick-ups (whole columns for a multichannel)
+    if pipette.channels > 1:
+        tips = [well for tip_rack in pipette.tip_racks for well in tip_rack.rows()[0]]
+    else:
+        tips = [well for tip_rack in pipette.tip_racks for well in tip_rack.wells()]
+    if tips_used >= len(tips):
+        raise ValueError('The checkpoint says {} tips were used on the {} pipette, but it only has {} in its racks'.format(
+            tips_used, pipette.mount, len(tips)))
+    return tips[tips_used]
+
+
+class CherrypickCheckpoint:
+    def __init__(self, checkpoint_path, key, write=True):
+        # checkpoint_path=None turns checkpointing off; every method then does nothing
+        self.checkpoint_path = checkpoint_path
+        self.key = key
+        self.tips_used = {} # pipette mount -> tips picked up so far
+        self.started_aspirations = set() # (group index, aspiration index)
+        self.finished_aspirations = set()
+        self.finished_groups = set()
+        self.resuming = False
+        self._file = None
+
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            self._read()
+        if checkpoint_path is not None and write:
+            if self.resuming:
+                self._file = open(checkpoint_path, 'a')
+            else:
+                self._file = open(checkpoint_path, 'w')
+                self._write({'run': key})
+
+    def _read(self):
+        with open(self.checkpoint_path, 'r') as checkpoint_file:
+            records = []
+            for line in checkpoint_file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break # The last line can be cut short if the robot lost power mid-write
+        if not records or records[0].get('run') != self.key or any('complete' in record for record in records):
+            return
+
+        self.resuming = True
+        for record in records[1:]:
+            if 'tip' in record:
+                self.tips_used[record['tip']] = record['n']
+            elif 'start' in record:
+                self.started_aspirations.add(tuple(record['start']))
+            elif 'done' in record:
+                self.finished_aspirations.add(tuple(record['done']))
+            elif 'group' in record:
+                self.finished_groups.add(record['group'])
+
+    def _write(self, record):
+        # Flushed and synced straight away so the record survives the robot being switched off
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def group_done(self, group_index):
+        return group_index in self.finished_groups
+
+    def aspiration_done(self, group_index, aspiration_index):
+        # Started aspirations count as done too, so nothing is ever dispensed twice
+        return (group_index, aspiration_index) in self.started_aspirations
+
+    def interrupted_aspirations(self):
+        return sorted(self.started_aspirations - self.finished_aspirations)
+
+    def record_tip(self, pipette):
+        self.tips_used[pipette.mount] = self.tips_used.get(pipette.mount, 0) + 1
+        if self._file is not None:
+            self._write({'tip': pipette.mount, 'n': self.tips_used[pipette.mount]})
+
+    def start_aspiration(self, group_index, aspiration_index):
+        if self._file is not None:
+            self._write({'start': [group_index, aspiration_index]})
+
+    def finish_aspiration(self, group_index, aspiration_index, volume):
+        if self._file is not None:
+            self._write({'done': [group_index, aspiration_index], 'v': volume})
+
+    def finish_group(self, group_index, pipette, volume):
+        if self._file is not None:
+            self._write({'group': group_index, 'tips': self.tips_used.get(pipette.mount, 0), 'v': volume})
+
+    def complete(self):
+        # The whole run finished: the next run with this checkpoint file starts from the beginning
+        if self._file is not None:
+            self._write({'complete': True})
+            self._file.close()
+            self._file = None
+
+    def resume_report(self, group_count):
+        if not self.resuming:
+            return []
+        report_lines = ['Resuming from checkpoint: {} of {} groups already done'.format(len(self.finished_groups), group_count)]
+        for mount, tips_used in sorted(self.tips_used.items()):
+            report_lines.append('{} pipette: {} tips already used'.format(mount.capitalize(), tips_used))
+        return report_lines
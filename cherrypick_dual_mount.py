@@ -0,0 +1,78 @@
+# Script name: cherrypick_dual_mount.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Splits the consolidated groups of a cherrypick worklist between two single-channel pipettes (e.g. p300 on the left,
+# p20 on the right) by volume, and interleaves their planned groups so both pipettes work through the deck together
+# instead of one after the other. Dispenses below low_volume_cutoff go to the low-volume pipette for its accuracy and
+# 20 uL tips; everything else stays on the p300. A source well that needs both pipettes is visited by them back to back,
+# so the well is only mixed once (by the first pipette) and no plate swap falls between the two.
+# Every group picks up its own tip and drops it in the trash, so group order doesn't change tip or trash travel; the
+# interleaving only decides which source wells run next to each other.
+
+
+def volume_range_group(dictionary, dispense_indexes):
+    # A consolidated group with only the given dispenses, in their worklist order
+    volumes = [dictionary['Volumes'][dispense_index] for dispense_index in dispense_indexes]
+    return {
+        'Source Plate': dictionary['Source Plate'],
+        'Source Well': dictionary['Source Well'],
+        'Destination Plates': [dictionary['Destination Plates'][dispense_index] for dispense_index in dispense_indexes],
+        'Destination Wells': [dictionary['Destination Wells'][dispense_index] for dispense_index in dispense_indexes],
+        'Volumes': volumes,
+        'Total Volume': sum(volumes),
+        'Dispense Count': len(volumes)
+    }
+
+
+def split_groups_by_volume(transfer_info_consolidated, low_volume_cutoff):
+    # Returns (high_volume_groups, low_volume_groups), both in consolidated order. Each group is split as it comes off
+    # consolidate_transfers(); a group that only needs one pipette is handed on as it is, so the worklist is never held
+    # twice. A source well with dispenses on both sides of the cutoff gets a group in each list.
+    high_volume_groups = []
+    low_volume_groups = []
+    for dictionary in transfer_info_consolidated:
+        low_volume_indexes = [dispense_index for dispense_index, volume in enumerate(dictionary['Volumes']) if volume < low_volume_cutoff]
+        if not low_volume_indexes:
+            high_volume_groups.append(dictionary)
+        elif len(low_volume_indexes) == dictionary['Dispense Count']:
+            low_volume_groups.append(dictionary)
+        else:
+            low_volume_index_set = set(low_volume_indexes)
+            high_volume_groups.append(volume_range_group(dictionary, [dispense_index for dispense_index in range(dictionary['Dispense Count'])
+                                                                      if dispense_index not in low_volume_index_set]))
+            low_volume_groups.append(volume_range_group(dictionary, low_volume_indexes))
+    return high_volume_groups, low_volume_groups
+
+
+def interleave_plans(plans, swap_key):
+    # plans is a list of (pipette_key, aspiration_plan) in mount priority order. Returns (pipette_key, group,
+    # first_visit) tuples: groups that need the same swapped plates stay together (swap_key), then each source well's
+    # groups run back to back in the order its source first shows up. first_visit is False when another pipette has
+    # already been in that source well this run (so it doesn't need mixing again).
+    source_rank = {}
+    tagged_groups = []
+    for pipette_rank, (pipette_key, aspiration_plan) in enumerate(plans):
+        for dictionary in aspiration_plan:
+            source_key = (dictionary['Source Plate'], dictionary['Source Well'])
+            source_rank.setdefault(source_key, len(source_rank))
+            tagged_groups.append((pipette_rank, pipette_key, dictionary))
+
+    tagged_groups.sort(key=lambda tagged_group: (
+        swap_key([tagged_group[2]['Source Plate']] + tagged_group[2]['Destination Plates']),
+        source_rank[(tagged_group[2]['Source Plate'], tagged_group[2]['Source Well'])],
+        tagged_group[0]))
+
+    interleaved_groups = []
+    visited_sources = set()
+    for pipette_rank, pipette_key, dictionary in tagged_groups:
+        source_key = (dictionary['Source Plate'], dictionary['Source Well'])
+        interleaved_groups.append((pipette_key, dictionary, source_key not in visited_sources))
+        visited_sources.add(source_key)
+    return interleaved_groups
+
+
+def split_report(high_volume_groups, low_volume_groups, low_volume_cutoff):
+    high_volume_sources = set((dictionary['Source Plate'], dictionary['Source Well']) for dictionary in high_volume_groups)
+    shared_source_count = sum(1 for dictionary in low_volume_groups if (dictionary['Source Plate'], dictionary['Source Well']) in high_volume_sources)
+    return ['{} transfers below {} uL sent to the low-volume pipette, {} left on the p300; {} source wells use both'.format(
+        sum(dictionary['Dispense Count'] for dictionary in low_volume_groups), low_volume_cutoff,
+        sum(dictionary['Dispense Count'] for dictionary in high_volume_groups), shared_source_count)]
@@ -0,0 +1,81 @@
+# Script name: cherrypick_multichannel.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Finds column-aligned transfers in a cherrypick worklist that an 8-channel head can do in one go.
+# A column batch is 8 worklist rows that move rows A-H of one source column to rows A-H of one destination column
+# with the same volume. Batches are returned as ordinary worklist rows addressed to row A (how a multichannel head
+# is positioned), so they go through consolidate_transfers/plan_aspirations exactly like single-channel rows.
+
+from cherrypick_worklist import SOURCE_PLATE, SOURCE_WELL, DESTINATION_PLATE, DESTINATION_WELL, VOLUME
+
+multichannel_rows = 'ABCDEFGH'
+
+
+def split_well_name(well_name):
+    return well_name[0].upper(), int(well_name[1:])
+
+
+def row_candidate(transfer):
+    # (batch key, row letter) of a row-aligned transfer, or None. Batch key: (source plate, source column,
+    # destination plate, destination column, volume)
+    source_row, source_column = split_well_name(transfer[SOURCE_WELL])
+    destination_row, destination_column = split_well_name(transfer[DESTINATION_WELL])
+    if source_row != destination_row or source_row not in multichannel_rows:
+        return None
+    return (transfer[SOURCE_PLATE], source_column, transfer[DESTINATION_PLATE], destination_column,
+            float(transfer[VOLUME])), source_row
+
+
+def classify_transfers(open_transfers):
+    # Returns (multichannel_transfers, single_channel_transfers, single_channel_count). open_transfers() returns a fresh
+    # iterator over the worklist rows (e.g. lambda: read_worklist(path)); the worklist is streamed twice so the rows are
+    # never held in memory, only a row count per batch key. The first pass finds the batches, the second hands every row
+    # that isn't batched on to the single-channel pipette as a stream, in worklist order.
+    row_counts = {} # batch key -> {row letter: candidate rows}
+    first_row_numbers = {}
+    row_count = 0
+    for row_number, transfer in enumerate(open_transfers()):
+        row_count += 1
+        candidate = row_candidate(transfer)
+        if candidate is None:
+            continue
+        batch_key, row_letter = candidate
+        letter_counts = row_counts.setdefault(batch_key, {})
+        letter_counts[row_letter] = letter_counts.get(row_letter, 0) + 1
+        first_row_numbers.setdefault(batch_key, row_number)
+
+    # A batch needs every row A-H; repeated column transfers make as many batches as the least repeated row allows
+    batch_counts = {batch_key: min(letter_counts.values()) for batch_key, letter_counts in row_counts.items()
+                    if len(letter_counts) == len(multichannel_rows)}
+
+    # Batches in the worklist order of their first row
+    multichannel_transfers = []
+    for batch_key in sorted(batch_counts, key=first_row_numbers.get):
+        source_plate, source_column, destination_plate, destination_column, volume = batch_key
+        for batch_number in range(0, batch_counts[batch_key]):
+            multichannel_transfers.append({
+                SOURCE_PLATE: source_plate,
+                SOURCE_WELL: 'A' + str(source_column),
+                DESTINATION_PLATE: destination_plate,
+                DESTINATION_WELL: 'A' + str(destination_column),
+                VOLUME: volume
+            })
+
+    def single_channel_transfers():
+        # The first batch_count rows of each letter of a batch key went into batches; everything else streams on
+        batched_counts = {}
+        for transfer in open_transfers():
+            candidate = row_candidate(transfer)
+            if candidate is not None and candidate[0] in batch_counts:
+                batched_count = batched_counts.get(candidate, 0)
+                if batched_count < batch_counts[candidate[0]]:
+                    batched_counts[candidate] = batched_count + 1
+                    continue
+            yield transfer
+
+    single_channel_count = row_count - len(multichannel_transfers) * len(multichannel_rows)
+    return multichannel_transfers, single_channel_transfers(), single_channel_count
+
+
+def classification_report(multichannel_transfers, single_channel_count):
+    return ['{} column transfers batched for the 8-channel head ({} worklist rows), {} rows left for the single-channel pipette'.format(
+        len(multichannel_transfers), len(multichannel_transfers) * len(multichannel_rows), single_channel_count)]
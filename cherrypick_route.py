@@ -0,0 +1,116 @@
+# Script name: cherrypick_route.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Reorders the destinations inside each planned cherrypick aspiration to cut gantry travel between plates.
+# Runs on the aspiration plan (aspiration_planner.py): each aspiration starts at the source well, dispenses into its
+# destinations and goes back to the source well to blow out the disposal volume, so every aspiration is routed and
+# scored as its own round trip from the source. Well positions come from the loaded labware, so any plate format
+# (96, 384, reservoirs) is placed where the robot will actually move.
+
+import math
+
+gantry_speed = 400 # mm/sec, OT-2 default XY speed; only used to turn distance into an estimated time
+two_opt_max_passes = 20 # 2-opt stops earlier if a full pass finds no improvement
+
+
+def labware_well_positions(labware):
+    # Well name -> XY position on the deck, read once from a loaded labware
+    positions = {}
+    for well in labware.wells():
+        point = well.top().point
+        positions[well.well_name] = (point.x, point.y)
+    return positions
+
+
+def plate_well_positions(labware_by_plate):
+    # Worklist plate name -> well positions; plates that share a slot (and labware) share one position table
+    positions_by_labware = {}
+    plate_positions = {}
+    for plate_name, labware in labware_by_plate.items():
+        if id(labware) not in positions_by_labware:
+            positions_by_labware[id(labware)] = labware_well_positions(labware)
+        plate_positions[plate_name] = positions_by_labware[id(labware)]
+    return plate_positions
+
+
+def distance(point_a, point_b):
+    return math.hypot(point_a[0] - point_b[0], point_a[1] - point_b[1])
+
+
+def round_trip_length(start_point, points):
+    route = [start_point] + list(points) + [start_point]
+    return sum(distance(route[n], route[n + 1]) for n in range(len(route) - 1))
+
+
+def nearest_neighbour_order(start_point, points):
+    # Greedy route: from the source well, always go to the closest destination not visited yet
+    remaining = list(range(len(points)))
+    order = []
+    current_point = start_point
+    while remaining:
+        next_index = min(remaining, key=lambda index: distance(current_point, points[index]))
+        remaining.remove(next_index)
+        order.append(next_index)
+        current_point = points[next_index]
+    return order
+
+
+def two_opt(start_point, points, order):
+    # Improve a round trip from the source well and back by reversing segments that cross each other
+    route = [start_point] + [points[index] for index in order] + [start_point]
+    order = list(order)
+    for _ in range(two_opt_max_passes):
+        improved = False
+        for i in range(1, len(route) - 2):
+            for j in range(i + 1, len(route) - 1):
+                removed = distance(route[i - 1], route[i]) + distance(route[j], route[j + 1])
+                added = distance(route[i - 1], route[j]) + distance(route[i], route[j + 1])
+                if added < removed - 1e-9:
+                    route[i:j + 1] = route[i:j + 1][::-1]
+                    order[i - 1:j] = order[i - 1:j][::-1]
+                    improved = True
+        if not improved:
+            break
+    return order
+
+
+def optimize_aspiration_route(aspiration, source_point, plate_positions):
+    # Returns a copy of one planned aspiration with its destinations reordered, plus the before/after round trip lengths
+    points = [plate_positions[plate][well] for plate, well in zip(aspiration['Destination Plates'], aspiration['Destination Wells'])]
+    original_length = round_trip_length(source_point, points)
+    order = two_opt(source_point, points, nearest_neighbour_order(source_point, points))
+    optimized_length = round_trip_length(source_point, [points[index] for index in order])
+    if optimized_length >= original_length:
+        # Never make a route worse than the planned order
+        order = list(range(len(points)))
+        optimized_length = original_length
+
+    optimized_aspiration = dict(aspiration)
+    for key in ['Destination Plates', 'Destination Wells', 'Volumes']:
+        optimized_aspiration[key] = [aspiration[key][index] for index in order]
+    return optimized_aspiration, original_length, optimized_length
+
+
+def optimize_routes(aspiration_plan, plate_positions):
+    # Reorder the destinations of every aspiration in the plan. plate_positions maps worklist plate names ('Source 1',
+    # 'Destination 1', ...) to well positions (plate_well_positions()). Returns the reordered plan and the estimated
+    # travel before/after in mm.
+    optimized_plan = []
+    route_report = {'Original Travel (mm)': 0.0, 'Optimized Travel (mm)': 0.0}
+    for dictionary in aspiration_plan:
+        source_point = plate_positions[dictionary['Source Plate']][dictionary['Source Well']]
+        optimized_group = dict(dictionary)
+        optimized_group['Aspirations'] = []
+        for aspiration in dictionary['Aspirations']:
+            optimized_aspiration, original_length, optimized_length = optimize_aspiration_route(aspiration, source_point, plate_positions)
+            optimized_group['Aspirations'].append(optimized_aspiration)
+            route_report['Original Travel (mm)'] += original_length
+            route_report['Optimized Travel (mm)'] += optimized_length
+        optimized_plan.append(optimized_group)
+    return optimized_plan, route_report
+
+
+def route_report_lines(route_report):
+    saved_travel = route_report['Original Travel (mm)'] - route_report['Optimized Travel (mm)']
+    return ['Destination routing: {:.0f} mm -> {:.0f} mm of XY travel, {:.0f} mm (~{:.1f} sec) saved this run'.format(
+        route_report['Original Travel (mm)'], route_report['Optimized Travel (mm)'], saved_travel,
+        saved_travel / gantry_speed)]
@@ -0,0 +1,144 @@
+# Script name: cherrypick_worklist.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Shared worklist helpers for the multidispense cherrypick scripts (multidispense_cherrypick_VTT_*.py).
+# Keep this file next to the protocol scripts (and on the robot's Python path) so the protocols can import it.
+
+import csv
+import gzip
+
+# Worklist column names, shared with the csv_raw header used in the cherrypick scripts
+SOURCE_PLATE = 'Source Plate'
+SOURCE_WELL = 'Source Well'
+DESTINATION_PLATE = 'Destination Plate'
+DESTINATION_WELL = 'Destination Well'
+VOLUME = 'Volume'
+WORKLIST_COLUMNS = [SOURCE_PLATE, SOURCE_WELL, DESTINATION_PLATE, DESTINATION_WELL, VOLUME]
+
+
+def open_worklist(worklist_path):
+    # Open a worklist file as text; .gz files are decompressed on the fly so they never sit in memory uncompressed
+    if str(worklist_path).endswith('.gz'):
+        return gzip.open(worklist_path, 'rt', newline='')
+    return open(worklist_path, 'r', newline='')
+
+
+def worklist_delimiter(worklist_path):
+    # TSV exports from the LIMS are tab separated, everything else is treated as CSV
+    file_name = str(worklist_path)
+    if file_name.endswith('.gz'):
+        file_name = file_name[:-3]
+    if file_name.endswith('.tsv') or file_name.endswith('.txt'):
+        return '\t'
+    return ','
+
+
+def read_worklist(worklist_path, delimiter=None, row_check=None):
+    # Stream validated transfer rows from a .csv/.tsv worklist (optionally gzip-compressed), one row at a time.
+    # Nothing is read until the generator is iterated, and rows are not kept after they are handed on.
+    # row_check (e.g. WorklistValidator.check_rows) filters the raw (line number, csv row) pairs on the same pass.
+    if delimiter is None:
+        delimiter = worklist_delimiter(worklist_path)
+    with open_worklist(worklist_path) as worklist_file:
+        for transfer in validate_transfers(csv.DictReader(worklist_file, delimiter=delimiter), row_check):
+            yield transfer
+
+
+def parse_worklist_text(csv_text, delimiter=',', row_check=None):
+    # Stream validated transfer rows from an embedded csv_raw string. Blank lines around the table are skipped and line
+    # numbers count from the header; blank lines inside it are skipped by the reader but still counted.
+    csv_lines = (line if line.strip() else '' for line in csv_text.strip().splitlines())
+    for transfer in validate_transfers(csv.DictReader(csv_lines, delimiter=delimiter), row_check):
+        yield transfer
+
+
+def numbered_rows(csv_reader):
+    # (worklist line number, row) for each csv.DictReader row. The reader's own line count is used, so skipped blank
+    # lines and quoted fields spanning lines don't shift the numbers.
+    for row in csv_reader:
+        yield csv_reader.line_num, row
+
+
+def validate_transfers(csv_reader, row_check=None):
+    # Check each row as it streams past and raise a ValueError naming the worklist line on the first bad row.
+    # Volumes are converted to float here so later steps never see text.
+    missing_columns = [column for column in WORKLIST_COLUMNS if column not in (csv_reader.fieldnames or [])]
+    if missing_columns:
+        raise ValueError('Worklist is missing column(s): {}'.format(', '.join(missing_columns)))
+
+    csv_rows = numbered_rows(csv_reader) if row_check is None else row_check(numbered_rows(csv_reader))
+    for line_number, transfer in csv_rows:
+        for column in WORKLIST_COLUMNS:
+            if transfer[column] is None or not transfer[column].strip():
+                raise ValueError('Worklist line {}: {} is empty'.format(line_number, column))
+        try:
+            volume = float(transfer[VOLUME])
+        except ValueError:
+            raise ValueError('Worklist line {}: Volume "{}" is not a number'.format(line_number, transfer[VOLUME]))
+        if not volume > 0:
+            raise ValueError('Worklist line {}: Volume must be greater than 0, got {}'.format(line_number, volume))
+
+        yield {
+            SOURCE_PLATE: transfer[SOURCE_PLATE].strip(),
+            SOURCE_WELL: transfer[SOURCE_WELL].strip(),
+            DESTINATION_PLATE: transfer[DESTINATION_PLATE].strip(),
+            DESTINATION_WELL: transfer[DESTINATION_WELL].strip(),
+            VOLUME: volume
+        }
+
+
+def consolidate_transfers(transfer_info):
+    # Build a list of dictionaries, where each dictionary reps a unique Source Plate:Source Well combo.
+    # Groups are looked up through a dictionary keyed by (Source Plate, Source Well), so every row is handled in
+    # constant time and the whole worklist is consolidated in a single pass. transfer_info can be any iterable of
+    # rows, including the read_worklist()/parse_worklist_text() generators, so rows are consolidated as they stream in.
+    # Group order is the order in which each source first shows up in the worklist, and destinations keep their
+    # worklist order within each group.
+    transfer_info_consolidated = []
+    consolidated_transfer_index = {}
+    for transfer in transfer_info:
+        # Get the unique identifier for each transfer
+        transfer_key = (transfer[SOURCE_PLATE], transfer[SOURCE_WELL])
+        volume = float(transfer[VOLUME])
+
+        consolidated_transfer = consolidated_transfer_index.get(transfer_key)
+        if consolidated_transfer is None:
+            # If transfer does not exist in transfer_info_consolidated, create a new dictionary
+            consolidated_transfer = {
+                'Source Plate': transfer[SOURCE_PLATE],
+                'Source Well': transfer[SOURCE_WELL],
+                'Destination Plates': [],
+                'Destination Wells': [],
+                'Volumes': [],
+                'Total Volume': 0.0,
+                'Dispense Count': 0
+            }
+            consolidated_transfer_index[transfer_key] = consolidated_transfer
+            transfer_info_consolidated.append(consolidated_transfer)
+
+        consolidated_transfer['Destination Plates'].append(transfer[DESTINATION_PLATE])
+        consolidated_transfer['Destination Wells'].append(transfer[DESTINATION_WELL])
+        consolidated_transfer['Volumes'].append(volume)
+        consolidated_transfer['Total Volume'] += volume
+        consolidated_transfer['Dispense Count'] += 1
+
+    return transfer_info_consolidated
+
+
+def consolidation_report(transfer_info_consolidated):
+    # One line per transfer group with its total volume and dispense count, plus a run total on the last line.
+    # Returned as a list of strings so it can be printed or passed to protocol.comment() line by line.
+    report_lines = []
+    run_total_volume = 0.0
+    run_dispense_count = 0
+    for group_number, dictionary in enumerate(transfer_info_consolidated, start=1):
+        report_lines.append('Group {}: {} {} -> {} dispenses, {:.1f} uL total'.format(group_number,
+                                                                                     dictionary['Source Plate'],
+                                                                                     dictionary['Source Well'],
+                                                                                     dictionary['Dispense Count'],
+                                                                                     dictionary['Total Volume']))
+        run_total_volume += dictionary['Total Volume']
+        run_dispense_count += dictionary['Dispense Count']
+    report_lines.append('{} transfer groups, {} dispenses, {:.1f} uL total'.format(len(transfer_info_consolidated),
+                                                                                 run_dispense_count,
+                                                                                 run_total_volume))
+    return report_lines
@@ -0,0 +1,91 @@
+# Script name: deck_map.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Resolves worklist plate names ('Source 1', 'Destination 7', ...) to loaded labware through a prebuilt dictionary.
+# The deck config maps every plate name to a slot, labware type and label, e.g.
+#     {'Source 1': {'slot': '1', 'labware': 'thermoscientificnunc_96_wellplate_2000ul', 'label': 'Source Plate 1'}}
+# Any number of plates can be listed. Plates that share a slot are swapped by hand: the protocol pauses and asks the
+# operator to swap plates the first time a plate that isn't on the deck is needed.
+
+import json
+
+from well_index import well_index
+
+
+def load_deck_config(deck_config_path):
+    # Deck configs saved as JSON use the same layout as the deck_config dictionaries in the protocol scripts
+    with open(deck_config_path, 'r') as deck_config_file:
+        return json.load(deck_config_file)
+
+
+class DeckMap:
+    def __init__(self, protocol, deck_config):
+        self.protocol = protocol
+        self.plate_slots = {}
+        self.plate_labels = {}
+        self.labware_by_slot = {}
+        self.well_index_by_slot = {}
+        self.plate_in_slot = {}
+        self.labware_types = {}
+        self.shared_slots = set()
+
+        for plate_name, entry in deck_config.items():
+            slot = str(entry['slot'])
+            self.plate_slots[plate_name] = slot
+            self.plate_labels[plate_name] = entry.get('label', plate_name)
+
+            if slot not in self.labware_by_slot:
+                # The first plate listed for a slot is the one loaded at the start of the run
+                labware = protocol.load_labware(entry['labware'], slot, self.plate_labels[plate_name])
+                self.labware_by_slot[slot] = labware
+                self.well_index_by_slot[slot] = well_index(labware) # Built once per slot, reused for every lookup
+                self.plate_in_slot[slot] = plate_name
+                self.labware_types[slot] = entry['labware']
+            else:
+                # Swapped plates reuse the labware definition of the slot they go into
+                if entry['labware'] != self.labware_types[slot]:
+                    raise ValueError('{} and {} share slot {} but use different labware ({} vs {})'.format(
+                        self.plate_in_slot[slot], plate_name, slot, self.labware_types[slot], entry['labware']))
+                self.shared_slots.add(slot)
+
+    def resolve(self, plate_name):
+        # Labware for a worklist plate name; pauses for a manual swap if another plate is in its slot right now
+        try:
+            slot = self.plate_slots[plate_name]
+        except KeyError:
+            raise ValueError('Plate "{}" is not in the deck config'.format(plate_name))
+        if self.plate_in_slot[slot] != plate_name:
+            self.protocol.pause('Swap {} out of slot {} and put {} in its place, then resume'.format(
+                self.plate_labels[self.plate_in_slot[slot]], slot, self.plate_labels[plate_name]))
+            self.plate_in_slot[slot] = plate_name
+        return self.labware_by_slot[slot]
+
+    def well(self, plate_name, well_name):
+        # Well lookup through the per-slot index instead of calling wells_by_name() for every transfer
+        self.resolve(plate_name)
+        return self.well_index_by_slot[self.plate_slots[plate_name]].well(well_name)
+
+    def bottom(self, plate_name, well_name, z=0.0):
+        # Cached well.bottom(z) location from the per-slot well index
+        self.resolve(plate_name)
+        return self.well_index_by_slot[self.plate_slots[plate_name]].bottom(well_name, z)
+
+    def top(self, plate_name, well_name, z=0.0):
+        # Cached well.top(z) location from the per-slot well index
+        self.resolve(plate_name)
+        return self.well_index_by_slot[self.plate_slots[plate_name]].top(well_name, z)
+
+    def swap_key(self, plate_names):
+        # Sort key that clusters work needing the same swapped plates, so each swap happens once per run.
+        # Plates in slots that are never shared don't affect the key.
+        return tuple(sorted(set(plate_name for plate_name in plate_names
+                                if self.plate_slots[plate_name] in self.shared_slots)))
+
+    def check_no_swap_within(self, plate_names):
+        # One aspiration can't be split around a manual swap: every plate it needs must be able to sit on the deck at once
+        plates_by_slot = {}
+        for plate_name in set(plate_names):
+            slot = self.plate_slots[plate_name]
+            if slot in plates_by_slot:
+                raise ValueError('{} and {} share slot {} but are needed in the same aspiration'.format(
+                    plates_by_slot[slot], plate_name, slot))
+            plates_by_slot[slot] = plate_name
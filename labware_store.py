@@ -0,0 +1,118 @@
+# Script name: labware_store.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python labware_store.py pack "Test qPCR setup script_v1.json" --output "Test qPCR setup script_v1_packed.json"
+# Local labware definition store keyed by content hash, for Protocol Designer JSON protocols (see pd_json_protocol.py).
+# A definition's key is the SHA-256 of its canonical JSON ("sha256:<hex>"), so the same definition embedded in any number
+# of protocols is stored once. "pack" moves a protocol's labwareDefinitions into the store and leaves a
+# labwareDefinitionRefs map (definition id -> key) behind; load_pd_protocol() resolves the refs, and "unpack" puts the
+# definitions back for uploading to the Opentrons app (the app only reads embedded definitions).
+# Each definition is read, parsed and checked against its hash once per process and then kept (parsed_definitions,
+# shared by every store). Treat returned definitions as read-only, they are shared.
+# The store holds generated files; labware_store/ is in .gitignore.
+
+import argparse
+import hashlib
+import json
+import os
+
+default_store_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'labware_store')
+parsed_definitions = {} # key -> definition, memoized across every protocol loaded in this process
+
+
+def canonical_definition(definition):
+    return json.dumps(definition, sort_keys=True, separators=(',', ':'))
+
+
+def definition_key(definition):
+    return 'sha256:' + hashlib.sha256(canonical_definition(definition).encode('utf-8')).hexdigest()
+
+
+class LabwareStore:
+    def __init__(self, store_dir=None):
+        self.store_dir = store_dir if store_dir is not None else default_store_dir
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def definition_path(self, key):
+        if not key.startswith('sha256:'):
+            raise ValueError('"{}" is not a labware store key'.format(key))
+        return os.path.join(self.store_dir, key[len('sha256:'):] + '.json')
+
+    def put(self, definition):
+        key = definition_key(definition)
+        definition_path = self.definition_path(key)
+        if not os.path.exists(definition_path):
+            # Write then rename, so a parallel run never reads half a definition
+            temporary_path = '{}.{}.tmp'.format(definition_path, os.getpid())
+            with open(temporary_path, 'w') as definition_file:
+                definition_file.write(canonical_definition(definition))
+            os.replace(temporary_path, definition_path)
+        parsed_definitions.setdefault(key, definition)
+        return key
+
+    def get(self, key):
+        if key in parsed_definitions:
+            return parsed_definitions[key]
+        definition_path = self.definition_path(key)
+        if not os.path.exists(definition_path):
+            raise ValueError('Labware definition {} is not in the store at {}'.format(key, self.store_dir))
+        with open(definition_path, 'r') as definition_file:
+            definition = json.load(definition_file)
+        if definition_key(definition) != key:
+            raise ValueError('Labware definition file {} does not match its key'.format(definition_path))
+        parsed_definitions[key] = definition
+        return definition
+
+    def keys(self):
+        return sorted('sha256:' + file_name[:-len('.json')] for file_name in os.listdir(self.store_dir) if file_name.endswith('.json'))
+
+
+def pack_protocol(pd_protocol, labware_store):
+    # Copy of the protocol with its labware definitions moved into the store
+    packed_protocol = {key: value for key, value in pd_protocol.items() if key != 'labwareDefinitions'}
+    packed_protocol['labwareDefinitionRefs'] = {definition_id: labware_store.put(definition)
+                                                for definition_id, definition in pd_protocol['labwareDefinitions'].items()}
+    return packed_protocol
+
+
+def unpack_protocol(pd_protocol, labware_store):
+    # Copy of a packed protocol with its labware definitions embedded again
+    unpacked_protocol = {key: value for key, value in pd_protocol.items() if key != 'labwareDefinitionRefs'}
+    unpacked_protocol['labwareDefinitions'] = {definition_id: labware_store.get(key)
+                                               for definition_id, key in pd_protocol['labwareDefinitionRefs'].items()}
+    return unpacked_protocol
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Content-addressed labware definition store for JSON protocols')
+    parser.add_argument('action', choices=['pack', 'unpack', 'add', 'list'])
+    parser.add_argument('paths', nargs='*', help='protocol JSON (pack/unpack) or labware definition JSON files (add)')
+    parser.add_argument('--store', default=default_store_dir)
+    parser.add_argument('--output', help='output protocol path for pack/unpack (default: overwrite the input)')
+    args = parser.parse_args()
+
+    store = LabwareStore(args.store)
+    if args.action == 'list':
+        for store_key in store.keys():
+            stored_definition = store.get(store_key)
+            print('{} {}'.format(store_key, stored_definition['parameters']['loadName']))
+    elif args.action == 'add':
+        for definition_json_path in args.paths:
+            with open(definition_json_path, 'r') as definition_json_file:
+                print('{} {}'.format(store.put(json.load(definition_json_file)), definition_json_path))
+    else:
+        if len(args.paths) != 1:
+            parser.error('{} takes one protocol file'.format(args.action))
+        with open(args.paths[0], 'r') as protocol_file:
+            protocol_json = json.load(protocol_file)
+        if args.action == 'pack':
+            if 'labwareDefinitionRefs' in protocol_json:
+                parser.error('{} is already packed'.format(args.paths[0]))
+            protocol_json = pack_protocol(protocol_json, store)
+        else:
+            if 'labwareDefinitionRefs' not in protocol_json:
+                parser.error('{} is not packed'.format(args.paths[0]))
+            protocol_json = unpack_protocol(protocol_json, store)
+        output_path = args.output if args.output else args.paths[0]
+        with open(output_path, 'w') as output_file:
+            json.dump(protocol_json, output_file, separators=(',', ':')) # compact, like Protocol Designer
+        print('{} ({} bytes) written with definitions in {}'.format(output_path, os.path.getsize(output_path), store.store_dir))
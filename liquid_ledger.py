@@ -0,0 +1,155 @@
+# Script name: liquid_ledger.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Per-well liquid volume ledger for a protocol run.
+# LiquidLedger(protocol) listens to the protocol's command broker, so every aspirate, dispense and blow out the
+# pipettes do (including the ones inside distribute()/transfer()/mix()) is recorded against the well it happened in,
+# both in opentrons_simulate and on the robot. Starting volumes are set with set_volume()/fill() on the labware already
+# loaded in run(); after that volume(well) and height(well) can be asked at any point in the protocol.
+#   ledger = LiquidLedger(protocol)
+#   ledger.fill(source_plate.wells(), 1500)
+#   ...
+#   source_location = ledger.aspirate_location(source_plate['A1'])
+# Multichannel commands are recorded against every well under the tips (the whole column for an 8-channel in a 96-well
+# plate, 8 x the volume for a single reservoir well).
+# Heights are estimated from the labware definition (well diameter or length x width, and depth) as if the well had
+# straight walls. Wells narrow towards the bottom, so the real liquid level is never lower than the estimate.
+
+import math
+
+from opentrons.commands import types as command_types
+
+
+def well_cross_section(well):
+    # Horizontal area of a well in mm^2. Falls back to max_volume / depth if the definition has no well dimensions.
+    diameter = getattr(well, 'diameter', None)
+    length = getattr(well, 'length', None)
+    width = getattr(well, 'width', None)
+    if diameter:
+        return math.pi * (diameter / 2) ** 2
+    if length and width:
+        return length * width
+    return well.max_volume / well.depth
+
+
+class LiquidLedger:
+    def __init__(self, protocol, track_commands=True):
+        self.protocol = protocol
+        self.wells = {} # well key -> Well, for geometry lookups
+        self.volumes = {} # well key -> current volume in uL
+        self.starting_volumes = {} # well key -> volume set with set_volume()/fill(), 0 uL for wells that weren't set
+        self.overdrawn_wells = set() # Wells that were aspirated below 0 uL, i.e. their starting volume was never set
+        self.tip_volumes = {} # id(pipette) -> volume currently in the tip, needed for blow outs
+        self._unsubscribe = None
+        if track_commands:
+            self._unsubscribe = protocol.broker.subscribe(command_types.COMMAND, self._handle_command)
+
+    def close(self):
+        # Stop recording pipette commands
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+
+    @staticmethod
+    def well_key(well):
+        # Wells are keyed by their labware object and well name; plates swapped into the same slot share a key
+        return id(well.parent), well.well_name
+
+    def set_volume(self, well, volume):
+        well_key = self.well_key(well)
+        self.wells[well_key] = well
+        self.volumes[well_key] = float(volume)
+        self.starting_volumes[well_key] = float(volume)
+        self.overdrawn_wells.discard(well_key)
+
+    def fill(self, wells, volume):
+        # Same starting volume for many wells, e.g. ledger.fill(plate.wells(), 1500) or ledger.fill(plate.rows()[0], 50)
+        for well in wells:
+            self.set_volume(well, volume)
+
+    def record_aspirate(self, well, volume):
+        well_key = self.well_key(well)
+        self.wells[well_key] = well
+        self.volumes[well_key] = self.volumes.get(well_key, 0.0) - volume
+        if self.volumes[well_key] < -1e-6:
+            self.overdrawn_wells.add(well_key)
+
+    def record_dispense(self, well, volume):
+        well_key = self.well_key(well)
+        self.wells[well_key] = well
+        self.volumes[well_key] = self.volumes.get(well_key, 0.0) + volume
+
+    def volume(self, well):
+        # Current volume in uL; wells that were never filled or touched hold 0 uL
+        return self.volumes.get(self.well_key(well), 0.0)
+
+    def height(self, well):
+        # Estimated liquid height above the well bottom in mm, capped at the well depth
+        return min(max(self.volume(well), 0.0) / well_cross_section(well), well.depth)
+
+    def aspirate_location(self, well, submerge_depth=1.0, minimum_height=0.5):
+        # Well bottom offset to just under the current liquid surface (never lower than minimum_height)
+        return well.bottom(max(self.height(well) - submerge_depth, minimum_height))
+
+    def report(self, labware=None, changed_only=True):
+        # One line per tracked well (optionally only the wells of one labware) for protocol.comment().
+        # By default wells whose volume is still the starting volume are left out.
+        report_lines = []
+        for well_key, well in self.wells.items():
+            if labware is not None and well.parent is not labware:
+                continue
+            if changed_only and abs(self.volumes[well_key] - self.starting_volumes.get(well_key, 0.0)) < 1e-6:
+                continue
+            report_lines.append('{}: {:.1f} uL, ~{:.1f} mm{}'.format(
+                well, self.volumes[well_key], self.height(well),
+                ' (more aspirated than was ever put in)' if well_key in self.overdrawn_wells else ''))
+        return report_lines
+
+    def _handle_command(self, message):
+        # Record each liquid handling command once it has finished without an error
+        if message['$'] != 'after' or message.get('error') is not None:
+            return
+        payload = message['payload']
+        if message['name'] == command_types.ASPIRATE:
+            self._tip_change(payload['instrument'], payload['volume'])
+            for well, volume in self._channel_wells(payload['instrument'], payload['location'], payload['volume']):
+                self.record_aspirate(well, volume)
+        elif message['name'] == command_types.DISPENSE:
+            self._tip_change(payload['instrument'], -payload['volume'])
+            for well, volume in self._channel_wells(payload['instrument'], payload['location'], payload['volume']):
+                self.record_dispense(well, volume)
+        elif message['name'] == command_types.BLOW_OUT:
+            # Whatever is left in the tip (e.g. a distribute() disposal volume) goes back into the blow out well
+            tip_volume = self.tip_volumes.pop(id(payload['instrument']), 0.0)
+            if tip_volume > 0:
+                for well, volume in self._channel_wells(payload['instrument'], payload['location'], tip_volume):
+                    self.record_dispense(well, volume)
+        elif message['name'] in (command_types.PICK_UP_TIP, command_types.DROP_TIP, command_types.RETURN_TIP):
+            self.tip_volumes.pop(id(payload['instrument']), None)
+
+    def _tip_change(self, instrument, volume):
+        tip_volume = self.tip_volumes.get(id(instrument), 0.0) + volume
+        self.tip_volumes[id(instrument)] = max(tip_volume, 0.0)
+
+    def _channel_wells(self, instrument, location, volume):
+        # (well, volume) for every well the pipette's channels are in; volume is the per-tip volume
+        well = self._location_well(location)
+        if well is None:
+            return []
+        channels = getattr(instrument, 'channels', 1)
+        if channels == 1:
+            return [(well, volume)]
+        column = well.parent.columns_by_name()[well.well_name[1:]]
+        step = max(len(column) // channels, 1) # 8 channels cover every other row of a 384-well column
+        first_row = [column_well.well_name for column_well in column].index(well.well_name)
+        channel_wells = column[first_row::step][:channels]
+        return [(channel_well, volume * channels / len(channel_wells)) for channel_well in channel_wells]
+
+    @staticmethod
+    def _location_well(location):
+        # Commands carry either a Well or a Location; locations that aren't in a well (e.g. the trash) are ignored
+        if location is None:
+            return None
+        if hasattr(location, 'well_name'):
+            return location
+        labware, well = location.labware.get_parent_labware_and_well()
+        return well
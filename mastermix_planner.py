@@ -0,0 +1,84 @@
+# Script name: mastermix_planner.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Plans the 8-channel mastermix multi-dispense for any set of wells on a 384-well qPCR plate.
+# An 8-channel head in a 384 plate covers every other row of one column, so the plate is 48 "shots": 24 columns x 2
+# row parities (tips at row A cover A, C, ... O; tips at row B cover B, D, ... P). Each row parity is fed from its own
+# mastermix source column, same as multidispense_384w_qPCR_setup_v2.py (A1 -> Q1/Q2 rows, A2 -> Q3/Q4 rows).
+# Shots are packed into as few aspirations as the pipette holds once the per-aspiration disposal volume is counted,
+# and the volume each source well needs is worked out from the plan.
+
+import math
+
+import numpy as np
+
+rows_384, columns_384 = 16, 24
+default_source_wells = {0: 'A1', 1: 'A2'} # row parity -> mastermix source column (row A well)
+
+
+def mastermix_shots(well_indexes):
+    # Sorted (column, parity) shots needed to reach every requested 384 well index (labware.wells() order)
+    well_indexes = np.unique(np.asarray(well_indexes, dtype=int))
+    if len(well_indexes) and (well_indexes.min() < 0 or well_indexes.max() >= rows_384 * columns_384):
+        raise ValueError('Mastermix wells must be 384-well plate indexes 0-383')
+    columns = well_indexes // rows_384
+    parities = (well_indexes % rows_384) % 2
+    shots = np.unique(np.column_stack((columns, parities)), axis=0) if len(well_indexes) else np.zeros((0, 2), dtype=int)
+    return [(int(column), int(parity)) for column, parity in shots]
+
+
+def plan_mastermix(well_indexes, rxn_volume, max_volume, disposal_volume, source_wells=None, dead_volume=0.0):
+    # One entry per mastermix source column: its shots split into aspirations, and the volume each of its 8 wells needs.
+    # Shots keep column order, so the head sweeps the plate left to right within each aspiration.
+    if source_wells is None:
+        source_wells = default_source_wells
+    working_volume = max_volume - disposal_volume
+    shots_per_aspiration = int(math.floor(working_volume / rxn_volume + 1e-9))
+    if shots_per_aspiration < 1:
+        raise ValueError('A {} ul reaction plus {} ul disposal does not fit in a {} ul pipette'.format(
+            rxn_volume, disposal_volume, max_volume))
+
+    shots = mastermix_shots(well_indexes)
+    mastermix_plan = []
+    for parity, source_well in sorted(source_wells.items()):
+        destination_indexes = [column * rows_384 + parity for column, shot_parity in shots if shot_parity == parity]
+        if not destination_indexes:
+            continue
+        aspirations = []
+        for first_shot in range(0, len(destination_indexes), shots_per_aspiration):
+            aspiration_indexes = destination_indexes[first_shot:first_shot + shots_per_aspiration]
+            aspirations.append({
+                'Destination Indexes': aspiration_indexes,
+                'Dispense Volume': len(aspiration_indexes) * rxn_volume,
+                'Aspirate Volume': len(aspiration_indexes) * rxn_volume + disposal_volume
+            })
+        mastermix_plan.append({
+            'Source Well': source_well,
+            'Row Parity': parity,
+            'Aspirations': aspirations,
+            # Each tip draws from its own row of the source column; the disposal volume goes back in after every
+            # aspiration, so it is only needed once on top of what is dispensed
+            'Volume Per Source Well': len(destination_indexes) * rxn_volume + disposal_volume + dead_volume
+        })
+    return mastermix_plan
+
+
+def extra_wells(well_indexes, mastermix_plan):
+    # 384 wells that get mastermix only because they share an 8-channel shot with a requested well
+    filled = set()
+    for source in mastermix_plan:
+        for aspiration in source['Aspirations']:
+            for destination_index in aspiration['Destination Indexes']:
+                filled.update(range(destination_index, destination_index + rows_384 - 1, 2))
+    return sorted(filled - set(int(well_index) for well_index in well_indexes))
+
+
+def mastermix_report(mastermix_plan, well_indexes):
+    report_lines = []
+    for source in mastermix_plan:
+        shot_count = sum(len(aspiration['Destination Indexes']) for aspiration in source['Aspirations'])
+        report_lines.append('Mastermix column {}: {} 8-channel dispenses in {} aspiration(s); put at least {:.1f} ul in each of its 8 wells'.format(
+            source['Source Well'][1:], shot_count, len(source['Aspirations']), source['Volume Per Source Well']))
+    extra_well_count = len(extra_wells(well_indexes, mastermix_plan))
+    if extra_well_count:
+        report_lines.append('{} wells outside the layout also get mastermix (they share an 8-channel column with used wells)'.format(extra_well_count))
+    return report_lines
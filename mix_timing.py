@@ -0,0 +1,107 @@
+# Script name: mix_timing.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python mix_timing.py --minutes 10 --columns 2 --volume 100 --flow-rate 20
+# Timed slow mixing ("hula mix" on the deck) for the BLP bead binding steps. The scripts used to guess a mix count from
+# a fixed cycle time (20 s per cycle in part 3, 5 passes of 3 mixes in parts 1 and 2), so the step ran longer or
+# shorter than intended whenever the volume, flow rate or column count changed. timed_mix() takes the target duration
+# instead and works the repetitions out from a timing model: one mix cycle is the mix volume at the pipette's aspirate
+# and dispense flow rates, and every visit to a column also costs a tip pickup, a drop, a blow out and the moves
+# between the column's tip and the column. Those overheads are mock_protocol.py's time model (command_times, gantry
+# speed and travel height moves), the one source of timing numbers in this directory (times measured on the robot go
+# there), applied to the run's real tip-to-column distances. The columns are mixed round-robin, each with its own tip
+# (returned to the rack between visits), in passes short enough that no column sits unmixed longer than
+# revisit_seconds while the others are mixed. A single column keeps its tip for one long visit. The whole step, tip
+# handling included, ends within one mix cycle of the target and never past it.
+
+import argparse
+import math
+
+from mock_protocol import BLOW_OUT, DROP_TIP, PICK_UP_TIP, command_times, gantry_speed, z_travel_time
+
+revisit_seconds = 120 # longest a column may go unmixed while the other columns are mixed (beads start to settle)
+default_travel_mm = 132.5 # tip rack one deck slot over from the plate, for plans made without labware (CLI)
+
+
+def mix_cycle_seconds(volume, aspirate_flow_rate, dispense_flow_rate):
+    return volume / aspirate_flow_rate + volume / dispense_flow_rate
+
+
+def visit_seconds(travel_mm):
+    # Fixed cost of one visit: move to the column's tip and pick it up, move travel_mm to the column, blow out, move
+    # back and drop the tip. The move between tips is shorter than travel_mm, so the estimate errs on the long side.
+    move_seconds = z_travel_time + travel_mm / gantry_speed
+    return command_times[PICK_UP_TIP] + command_times[DROP_TIP] + command_times[BLOW_OUT] + 3 * move_seconds
+
+
+def travel_mm(tip_location, mix_location):
+    # Deck distance between a tip and the location it mixes
+    tip_point = tip_location.top().point
+    return math.hypot(mix_location.point.x - tip_point.x, mix_location.point.y - tip_point.y)
+
+
+def plan_mix(target_seconds, column_count, cycle_seconds, overhead_seconds, revisit_limit=revisit_seconds):
+    # Repetitions per visit, one list per pass with one entry per column. As many passes as it takes to revisit every
+    # column within revisit_limit (as long as each visit still gets a mix); the cycles that fit in the time left after
+    # the visit overheads are spread evenly, so column totals differ by one repetition at most.
+    shortest_pass_seconds = column_count * (overhead_seconds + cycle_seconds)
+    if shortest_pass_seconds > target_seconds:
+        raise ValueError('One mix of each of {} columns takes {:.0f} s, longer than the {:.0f} s target'.format(
+            column_count, shortest_pass_seconds, target_seconds))
+    if column_count == 1:
+        pass_count = 1
+    else:
+        pass_count = min(math.ceil(target_seconds / revisit_limit), int(target_seconds // shortest_pass_seconds))
+    visit_count = pass_count * column_count
+    repetitions = int((target_seconds - visit_count * overhead_seconds) // cycle_seconds)
+    base_repetitions, extra_repetitions = divmod(repetitions, visit_count)
+    return [[base_repetitions + (1 if pass_index * column_count + column < extra_repetitions else 0)
+             for column in range(column_count)] for pass_index in range(pass_count)]
+
+
+def plan_seconds(plan, cycle_seconds, overhead_seconds):
+    return sum(len(pass_repetitions) * overhead_seconds + sum(pass_repetitions) * cycle_seconds for pass_repetitions in plan)
+
+
+def timed_mix(protocol, pipette, mix_locations, tip_locations, volume, minutes, revisit_limit=revisit_seconds):
+    # Mix every location for the given minutes at the pipette's current flow rates. tip_locations holds one tip per
+    # location; each tip goes back to its rack spot after every visit.
+    if len(tip_locations) != len(mix_locations):
+        raise ValueError('{} mix locations need {} tip locations, got {}'.format(len(mix_locations), len(mix_locations), len(tip_locations)))
+    cycle_seconds = mix_cycle_seconds(volume, pipette.flow_rate.aspirate, pipette.flow_rate.dispense)
+    # The farthest tip sets the overhead of every visit, so no pass runs longer than planned
+    overhead_seconds = visit_seconds(max(travel_mm(tip_location, mix_location)
+                                         for tip_location, mix_location in zip(tip_locations, mix_locations)))
+    plan = plan_mix(minutes * 60, len(mix_locations), cycle_seconds, overhead_seconds, revisit_limit)
+    protocol.comment('Timed mix: {} passes over {} columns, {} mixes of {} ul, ~{:.1f} of {} min'.format(
+        len(plan), len(mix_locations), sum(map(sum, plan)), volume, plan_seconds(plan, cycle_seconds, overhead_seconds) / 60, minutes))
+    for pass_repetitions in plan:
+        for mix_location, tip_location, repetitions in zip(mix_locations, tip_locations, pass_repetitions):
+            pipette.pick_up_tip(location=tip_location)
+            pipette.mix(repetitions=repetitions,
+                        volume=volume,
+                        location=mix_location,
+                        rate=1.0)
+            pipette.blow_out()
+            pipette.drop_tip(location=tip_location)
+            tip_location.parent.return_tips(start_well=tip_location, num_channels=pipette.channels)
+    return plan
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plan a timed round-robin mix')
+    parser.add_argument('--minutes', type=float, required=True)
+    parser.add_argument('--columns', type=int, required=True)
+    parser.add_argument('--volume', type=float, required=True, help='mix volume (ul)')
+    parser.add_argument('--flow-rate', type=float, required=True, help='aspirate and dispense flow rate (ul/sec)')
+    parser.add_argument('--travel-mm', type=float, default=default_travel_mm, help='deck distance from tip rack to plate (mm)')
+    parser.add_argument('--revisit-seconds', type=float, default=revisit_seconds)
+    args = parser.parse_args()
+
+    planned_cycle_seconds = mix_cycle_seconds(args.volume, args.flow_rate, args.flow_rate)
+    planned_overhead_seconds = visit_seconds(args.travel_mm)
+    mix_plan = plan_mix(args.minutes * 60, args.columns, planned_cycle_seconds, planned_overhead_seconds, args.revisit_seconds)
+    for pass_number, pass_repetitions in enumerate(mix_plan, 1):
+        print('Pass {}: {}'.format(pass_number, ' '.join(str(repetitions) for repetitions in pass_repetitions)))
+    print('{} mixes of {:.1f} s, {} visits of {:.1f} s overhead: {:.1f} of {} min'.format(
+        sum(map(sum, mix_plan)), planned_cycle_seconds, sum(map(len, mix_plan)), planned_overhead_seconds,
+        plan_seconds(mix_plan, planned_cycle_seconds, planned_overhead_seconds) / 60, args.minutes))
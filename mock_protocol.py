@@ -0,0 +1,1021 @@
+# Script name: mock_protocol.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python mock_protocol.py BLP_part1_vFinal_12132022.py --labware-dir custom_labware --trace BLP_part1_trace.txt
+# Command line = python mock_protocol.py multidispense_384w_qPCR_setup_v2.py --set rna_plate_count=4
+# Hardware-free stand-in for the part of the Opentrons protocol API (apiLevel 2.8) these scripts use, for checking a
+# script or sweeping its settings in milliseconds without opentrons_simulate. run_mock_protocol() imports the script with
+# this module's classes in place of the opentrons package (helper modules such as well_index.py are imported again
+# under the stand-in and put back afterwards), runs it, and returns the ProtocolContext, whose trace holds every
+# command as opentrons_simulate would print it (composite commands nest their atomic commands one level deeper).
+# Commands are published on protocol.broker like the real API, so LiquidLedger and the other listeners work unchanged.
+# Pipette state is checked the way the robot checks it (no tip, aspirating past the tip volume, picking up a second
+# tip, running out of tips), and transfer()/distribute()/consolidate() plan their steps like the apiLevel 2.8 API.
+# Labware comes from --labware-dir definitions, then the opentrons_shared_data definitions if that package is
+# installed (it is only read, never imported); anything else gets a generic definition built from the load name
+# (well count and volume), so well names, volumes and tip tracking are right but coordinates are approximate.
+
+import argparse
+import collections
+import contextlib
+import glob
+import importlib.util
+import json
+import math
+import os
+import re
+import sys
+import time
+from types import ModuleType
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Command names, same strings as opentrons.commands.types
+COMMAND = 'command'
+DELAY, PAUSE, COMMENT, HOME = 'command.DELAY', 'command.PAUSE', 'command.COMMENT', 'command.HOME'
+ASPIRATE, DISPENSE, MIX, BLOW_OUT = 'command.ASPIRATE', 'command.DISPENSE', 'command.MIX', 'command.BLOW_OUT'
+CONSOLIDATE, DISTRIBUTE, TRANSFER = 'command.CONSOLIDATE', 'command.DISTRIBUTE', 'command.TRANSFER'
+PICK_UP_TIP, DROP_TIP, RETURN_TIP = 'command.PICK_UP_TIP', 'command.DROP_TIP', 'command.RETURN_TIP'
+AIR_GAP, TOUCH_TIP, MOVE_TO = 'command.AIR_GAP', 'command.TOUCH_TIP', 'command.MOVE_TO'
+MAGDECK_ENGAGE, MAGDECK_DISENGAGE = 'command.MAGDECK_ENGAGE', 'command.MAGDECK_DISENGAGE'
+TEMPDECK_SET_TEMP, TEMPDECK_AWAIT_TEMP, TEMPDECK_DEACTIVATE = 'command.TEMPDECK_SET_TEMP', 'command.TEMPDECK_AWAIT_TEMP', 'command.TEMPDECK_DEACTIVATE'
+composite_commands = [CONSOLIDATE, DISTRIBUTE, TRANSFER, MIX, AIR_GAP, RETURN_TIP]
+
+# OT-2 deck slot origins (ot2_standard deck definition)
+deck_slots = {'1': (0.0, 0.0), '2': (132.5, 0.0), '3': (265.0, 0.0), '4': (0.0, 90.5), '5': (132.5, 90.5),
+              '6': (265.0, 90.5), '7': (0.0, 181.0), '8': (132.5, 181.0), '9': (265.0, 181.0), '10': (0.0, 271.5),
+              '11': (132.5, 271.5), '12': (265.0, 271.5)}
+
+# GEN2 pipettes: channels, min/max volume, default aspirate/dispense/blow out flow rates (uL/s) from apiLevel 2.6 on
+pipette_specs = {
+    'p20_single_gen2': {'channels': 1, 'min_volume': 1, 'max_volume': 20, 'flow_rates': (7.56, 7.56, 7.56)},
+    'p20_multi_gen2': {'channels': 8, 'min_volume': 1, 'max_volume': 20, 'flow_rates': (7.6, 7.6, 7.6)},
+    'p300_single_gen2': {'channels': 1, 'min_volume': 20, 'max_volume': 300, 'flow_rates': (92.86, 92.86, 92.86)},
+    'p300_multi_gen2': {'channels': 8, 'min_volume': 20, 'max_volume': 300, 'flow_rates': (94.0, 94.0, 94.0)},
+    'p1000_single_gen2': {'channels': 1, 'min_volume': 100, 'max_volume': 1000, 'flow_rates': (274.7, 274.7, 274.7)},
+}
+
+# load_module() names -> (model, display name, labware offset from the slot origin). GEN1 modules use the GEN2 offsets.
+module_types = {
+    'magnetic module': ('magneticModuleV1', 'Magnetic Module GEN1', (-1.175, -0.125, 82.25)),
+    'magdeck': ('magneticModuleV1', 'Magnetic Module GEN1', (-1.175, -0.125, 82.25)),
+    'magnetic module gen2': ('magneticModuleV2', 'Magnetic Module GEN2', (-1.175, -0.125, 82.25)),
+    'temperature module': ('temperatureModuleV1', 'Temperature Module GEN1', (-1.45, -0.15, 80.09)),
+    'tempdeck': ('temperatureModuleV1', 'Temperature Module GEN1', (-1.45, -0.15, 80.09)),
+    'temperature module gen2': ('temperatureModuleV2', 'Temperature Module GEN2', (-1.45, -0.15, 80.09)),
+}
+
+fixed_trash_definition = {
+    'parameters': {'loadName': 'opentrons_1_trash_1100ml_fixed', 'format': 'trash', 'isTiprack': False},
+    'metadata': {'displayName': 'Opentrons Fixed Trash'}, 'namespace': 'opentrons', 'version': 1,
+    'cornerOffsetFromSlot': {'x': 0, 'y': 0, 'z': 0}, 'ordering': [['A1']],
+    'wells': {'A1': {'shape': 'rectangular', 'xDimension': 107.11, 'yDimension': 165.67, 'totalLiquidVolume': 1100000,
+                     'depth': 0, 'x': 82.84, 'y': 80, 'z': 82}}
+}
+
+# Generic grids for load names that have no definition: well count in the name -> (rows, columns)
+# Time model for traces, the same rough numbers as pd_json_protocol.py (seconds, mm/s): gantry travel between wells,
+# plunger time from volume / flow rate and fixed times for tip handling, plus delays. Module ramps and magnet moves are
+# not timed, so it is for comparing variants and versions of a protocol, not for run time planning.
+gantry_speed = 400
+z_travel_time = 1.0 # up to travel height and back down when the head changes wells
+z_move_time = 0.2 # height change within one well
+command_times = {PICK_UP_TIP: 3.0, DROP_TIP: 2.5, BLOW_OUT: 0.5, TOUCH_TIP: 2.0}
+
+generic_formats = {1: (1, 1), 2: (1, 2), 4: (2, 2), 6: (2, 3), 12: (3, 4), 15: (3, 5), 24: (4, 6), 32: (4, 8), 48: (6, 8),
+                   96: (8, 12), 384: (16, 24)}
+
+standard_definitions = {} # load name -> definition read from opentrons_shared_data or built from the name
+
+
+def read_labware_dirs(labware_dirs):
+    # Custom labware definitions (load name -> definition) from .json files, like opentrons_simulate -L
+    extra_labware = {}
+    for labware_dir in labware_dirs or []:
+        for definition_path in sorted(glob.glob(os.path.join(labware_dir, '*.json'))):
+            with open(definition_path, 'r') as definition_file:
+                definition = json.load(definition_file)
+            extra_labware[definition['parameters']['loadName']] = definition
+    return extra_labware
+
+
+def load_script(script_path, parameters=None):
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(script_path))[0], script_path)
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    for name, value in (parameters or {}).items():
+        if not hasattr(script, name):
+            raise ValueError('{} has no module-level setting "{}"'.format(script_path, name))
+        setattr(script, name, value)
+    return script
+
+
+def parse_parameters(settings):
+    # name=value pairs from the command line; values are read as JSON where they parse (numbers, lists, null)
+    parameters = {}
+    for setting in settings or []:
+        name, separator, value = setting.partition('=')
+        if not separator:
+            raise ValueError('"{}" is not name=value'.format(setting))
+        try:
+            parameters[name] = json.loads(value)
+        except ValueError:
+            parameters[name] = value
+    return parameters
+
+
+def shared_data_definition(load_name):
+    # Newest version of a standard definition from an installed opentrons_shared_data, without importing it
+    spec = importlib.util.find_spec('opentrons_shared_data')
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    package_dir = list(spec.submodule_search_locations)[0]
+    for definitions_dir in [os.path.join(package_dir, 'data', 'labware', 'definitions', '2'),
+                            os.path.join(package_dir, 'labware', 'definitions', '2')]:
+        version_paths = glob.glob(os.path.join(definitions_dir, load_name, '*.json'))
+        if version_paths:
+            newest_path = max(version_paths, key=lambda path: int(os.path.splitext(os.path.basename(path))[0]))
+            with open(newest_path, 'r') as definition_file:
+                return json.load(definition_file)
+    return None
+
+
+def generic_definition(load_name):
+    # Definition guessed from a load name such as 'nest_96_wellplate_2ml_deep' (96 wells of 2 mL)
+    well_count = re.search(r'_(\d+)_', '_{}_'.format(load_name))
+    well_count = int(well_count.group(1)) if well_count else 96
+    if well_count not in generic_formats:
+        raise ValueError('No definition for labware "{}" and no well layout for {} wells'.format(load_name, well_count))
+    rows, columns = generic_formats[well_count]
+    if 'reservoir' in load_name and well_count == 12:
+        rows, columns = 1, 12
+    volume = re.search(r'(\d+(?:\.\d+)?)(ul|ml)', load_name.lower())
+    volume = float(volume.group(1)) * (1000 if volume.group(2) == 'ml' else 1) if volume else 200.0
+    is_tiprack = 'tiprack' in load_name
+    depth = 10.0 if volume <= 400 else 40.0
+    x_spacing, y_spacing = 108.0 / columns, 72.0 / rows
+    wells = {}
+    ordering = []
+    for column in range(columns):
+        ordering.append([])
+        for row in range(rows):
+            well_name = '{}{}'.format('ABCDEFGHIJKLMNOP'[row], column + 1)
+            ordering[-1].append(well_name)
+            wells[well_name] = {'shape': 'circular', 'diameter': min(x_spacing, y_spacing) * 0.8, 'depth': depth,
+                                'totalLiquidVolume': volume, 'x': 9.88 + (column + 0.5) * x_spacing,
+                                'y': 78.74 - (row + 0.5) * y_spacing, 'z': 5.0}
+    return {'parameters': {'loadName': load_name, 'format': '384Standard' if well_count == 384 else 'irregular',
+                           'isTiprack': is_tiprack, 'tipLength': 50.0 if is_tiprack else None},
+            'metadata': {'displayName': load_name}, 'namespace': 'custom_beta', 'version': 1,
+            'cornerOffsetFromSlot': {'x': 0, 'y': 0, 'z': 0}, 'ordering': ordering, 'wells': wells}
+
+
+def labware_definition(load_name, extra_labware=None):
+    if extra_labware and load_name in extra_labware:
+        return extra_labware[load_name]
+    if load_name not in standard_definitions:
+        standard_definitions[load_name] = shared_data_definition(load_name) or generic_definition(load_name)
+    return standard_definitions[load_name]
+
+
+class Point(collections.namedtuple('Point', ['x', 'y', 'z'], defaults=(0.0, 0.0, 0.0))):
+    __slots__ = ()
+
+    def __add__(self, other):
+        return Point(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return Point(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, factor):
+        return Point(self.x * factor, self.y * factor, self.z * factor)
+
+
+class LabwareLike:
+    # What a Location is in: a Well, Labware, module or nothing
+    def __init__(self, labware):
+        self.object = labware.object if isinstance(labware, LabwareLike) else labware
+
+    @property
+    def is_well(self):
+        return isinstance(self.object, Well)
+
+    @property
+    def is_labware(self):
+        return isinstance(self.object, Labware)
+
+    @property
+    def is_module(self):
+        return isinstance(self.object, ModuleContext)
+
+    @property
+    def is_empty(self):
+        return self.object is None
+
+    def as_well(self):
+        return self.object if self.is_well else None
+
+    def as_labware(self):
+        if self.is_well:
+            return self.object.parent
+        return self.object if self.is_labware else None
+
+    def get_parent_labware_and_well(self):
+        if self.is_well:
+            return self.object.parent, self.object
+        return (self.object, None) if self.is_labware else (None, None)
+
+    def __repr__(self):
+        return str(self.object)
+
+
+class Location:
+    def __init__(self, point, labware):
+        self.point = point
+        self.labware = LabwareLike(labware)
+
+    def move(self, point):
+        return Location(self.point + point, self.labware)
+
+    def __iter__(self):
+        return iter((self.point, self.labware))
+
+    def __eq__(self, other):
+        return isinstance(other, Location) and self.point == other.point and self.labware.object is other.labware.object
+
+    def __repr__(self):
+        return 'Location(point={!r}, labware={})'.format(self.point, self.labware)
+
+
+class Well:
+    def __init__(self, parent, well_name, well_definition, origin):
+        self.parent = parent
+        self.well_name = well_name
+        self.depth = well_definition['depth']
+        self.max_volume = well_definition['totalLiquidVolume']
+        self.diameter = well_definition.get('diameter')
+        self.length = well_definition.get('xDimension')
+        self.width = well_definition.get('yDimension')
+        self.has_tip = parent.is_tiprack
+        self._x, self._y = origin.x + well_definition['x'], origin.y + well_definition['y']
+        self._z = origin.z + well_definition['z']
+        self._display_name = '{} of {}'.format(well_name, parent)
+
+    def top(self, z=0.0):
+        return Location(Point(self._x, self._y, self._z + self.depth + z), self)
+
+    def bottom(self, z=0.0):
+        return Location(Point(self._x, self._y, self._z + z), self)
+
+    def center(self):
+        return Location(Point(self._x, self._y, self._z + self.depth / 2), self)
+
+    def __repr__(self):
+        return self._display_name
+
+
+class Labware:
+    def __init__(self, definition, parent, origin, label=None):
+        self.parent = parent # deck slot name, or the module the labware sits on
+        self.parameters = definition['parameters']
+        self.load_name = self.name = self.parameters['loadName']
+        self.uri = '{}/{}/{}'.format(definition.get('namespace'), self.load_name, definition.get('version'))
+        self.is_tiprack = self.parameters.get('isTiprack', False)
+        self.tip_length = self.parameters.get('tipLength')
+        self._display_name = '{} on {}'.format(label or definition['metadata']['displayName'], parent)
+        origin = origin + Point(*(definition['cornerOffsetFromSlot'][axis] for axis in 'xyz'))
+        self._wells_by_name = {}
+        self._columns = []
+        for column_names in definition['ordering']:
+            self._columns.append([])
+            for well_name in column_names:
+                well = Well(self, well_name, definition['wells'][well_name], origin)
+                self._wells_by_name[well_name] = well
+                self._columns[-1].append(well)
+        self._wells = [well for column in self._columns for well in column]
+        rows_by_name = {}
+        for well in self._wells:
+            rows_by_name.setdefault(well.well_name.rstrip('0123456789'), []).append(well)
+        self._rows = list(rows_by_name.values())
+
+    def wells(self, *wells):
+        if not wells:
+            return list(self._wells)
+        return [self[well] if isinstance(well, str) else self._wells[well] for well in wells]
+
+    def wells_by_name(self):
+        return dict(self._wells_by_name)
+
+    def rows(self):
+        return [list(row) for row in self._rows]
+
+    def rows_by_name(self):
+        return {row[0].well_name.rstrip('0123456789'): list(row) for row in self._rows}
+
+    def columns(self):
+        return [list(column) for column in self._columns]
+
+    def columns_by_name(self):
+        return {column[0].well_name.lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZ'): list(column) for column in self._columns}
+
+    def well(self, well):
+        return self[well] if isinstance(well, str) else self._wells[well]
+
+    def __getitem__(self, well_name):
+        return self._wells_by_name[well_name]
+
+    def _column_tips(self, start_well, num_channels):
+        column = next(column for column in self._columns if start_well in column)
+        first_row = column.index(start_well)
+        return column[first_row:first_row + num_channels]
+
+    def next_tip(self, num_tips=1, starting_tip=None):
+        # First well from which num_tips consecutive wells down its column all still hold a tip
+        start_index = self._wells.index(starting_tip) if starting_tip is not None else 0
+        for column in self._columns:
+            for row, well in enumerate(column):
+                if self._wells.index(well) < start_index or row + num_tips > len(column):
+                    continue
+                if all(tip.has_tip for tip in column[row:row + num_tips]):
+                    return well
+        return None
+
+    def use_tips(self, start_well, num_channels=1):
+        for tip in self._column_tips(start_well, num_channels):
+            tip.has_tip = False
+
+    def return_tips(self, start_well, num_channels=1):
+        for tip in self._column_tips(start_well, num_channels):
+            tip.has_tip = True
+
+    def reset(self):
+        for well in self._wells:
+            well.has_tip = self.is_tiprack
+
+    def __repr__(self):
+        return self._display_name
+
+
+def next_available_tip(starting_tip, tip_racks, channels):
+    # (tip rack, tip) for the next pick-up, starting from starting_tip's rack; (None, None) when every rack is empty
+    first_rack = tip_racks.index(starting_tip.parent) if starting_tip is not None else 0
+    for tip_rack in tip_racks[first_rack:]:
+        tip = tip_rack.next_tip(channels, starting_tip if starting_tip is not None and starting_tip.parent is tip_rack else None)
+        if tip is not None:
+            return tip_rack, tip
+    return None, None
+
+
+def stringify_location(location):
+    # Location text of a command message; lists are named by their first location
+    while isinstance(location, list):
+        location = location[0] if location else None
+    if isinstance(location, Location):
+        return str(location.point) if location.labware.is_empty else str(location.labware)
+    return str(location)
+
+
+def volume_text(volume):
+    return [float(step_volume) for step_volume in volume] if isinstance(volume, list) else float(volume)
+
+
+class Broker:
+    def __init__(self):
+        self.subscriptions = {} # topic -> handlers
+
+    def subscribe(self, topic, handler):
+        self.subscriptions.setdefault(topic, []).append(handler)
+
+        def unsubscribe():
+            if handler in self.subscriptions.get(topic, []):
+                self.subscriptions[topic].remove(handler)
+        return unsubscribe
+
+    def publish(self, topic, message):
+        for handler in list(self.subscriptions.get(topic, [])):
+            handler(message)
+
+
+class FlowRates:
+    def __init__(self, aspirate, dispense, blow_out):
+        self.aspirate = aspirate
+        self.dispense = dispense
+        self.blow_out = blow_out
+
+
+class Clearances:
+    def __init__(self, aspirate=1.0, dispense=1.0):
+        self.aspirate = aspirate
+        self.dispense = dispense
+
+
+class InstrumentContext:
+    def __init__(self, protocol, name, mount, tip_racks=None):
+        if name not in pipette_specs:
+            raise ValueError('Unknown pipette "{}"; the mock knows {}'.format(name, ', '.join(sorted(pipette_specs))))
+        spec = pipette_specs[name]
+        self.protocol = protocol
+        self.name = name
+        self.mount = mount
+        self.channels = spec['channels']
+        self.min_volume = spec['min_volume']
+        self.max_volume = spec['max_volume']
+        self.flow_rate = FlowRates(*spec['flow_rates'])
+        self.well_bottom_clearance = Clearances()
+        self.tip_racks = list(tip_racks or [])
+        self.starting_tip = None
+        self.trash_container = protocol.fixed_trash
+        self.current_volume = 0.0
+        self.has_tip = False
+        self.working_volume = self.max_volume
+        self._tip = None # tip rack well the attached tip came from
+        self._last_location = None
+
+    def _command(self, name, text, **payload):
+        return self.protocol.command(name, text, instrument=self, **payload)
+
+    def _target(self, location, clearance, action):
+        # Location for a liquid command; a Well means its bottom plus the clearance, None the current location
+        if location is None:
+            if self._last_location is None:
+                raise RuntimeError('{} was called without a location before the pipette moved anywhere'.format(action))
+            return self._last_location
+        if isinstance(location, Well):
+            return location.bottom(clearance)
+        return location
+
+    def _current_well(self, location, action):
+        well = location if isinstance(location, Well) else None
+        if isinstance(location, Location):
+            well = location.labware.as_well()
+        if location is None and self._last_location is not None:
+            well = self._last_location.labware.as_well()
+        if well is None:
+            raise RuntimeError('{} needs the pipette to be in a well'.format(action))
+        return well
+
+    def aspirate(self, volume=None, location=None, rate=1.0):
+        location = self._target(location, self.well_bottom_clearance.aspirate, 'aspirate')
+        volume = volume if volume else self.working_volume - self.current_volume
+        flow_rate = self.flow_rate.aspirate * rate
+        with self._command(ASPIRATE, 'Aspirating {} uL from {} at {} uL/sec'.format(float(volume), stringify_location(location), flow_rate),
+                           volume=volume, location=location, rate=rate, flow_rate=flow_rate):
+            if not self.has_tip:
+                raise RuntimeError('Cannot aspirate without a tip attached ({} pipette)'.format(self.mount))
+            if self.current_volume + volume > self.working_volume + 1e-9:
+                raise RuntimeError('Cannot aspirate {} uL: the {} pipette already holds {} of {} uL'.format(
+                    volume, self.mount, self.current_volume, self.working_volume))
+            self.current_volume += volume
+            self._last_location = location
+        return self
+
+    def dispense(self, volume=None, location=None, rate=1.0):
+        location = self._target(location, self.well_bottom_clearance.dispense, 'dispense')
+        volume = volume if volume else self.current_volume
+        flow_rate = self.flow_rate.dispense * rate
+        with self._command(DISPENSE, 'Dispensing {} uL into {} at {} uL/sec'.format(float(volume), stringify_location(location), flow_rate),
+                           volume=volume, location=location, rate=rate, flow_rate=flow_rate):
+            self.current_volume = max(self.current_volume - volume, 0.0)
+            self._last_location = location
+        return self
+
+    def mix(self, repetitions=1, volume=None, location=None, rate=1.0):
+        if not self.has_tip:
+            raise RuntimeError('Cannot mix without a tip attached ({} pipette)'.format(self.mount))
+        volume = volume if volume else self.working_volume - self.current_volume
+        with self._command(MIX, 'Mixing {} times with a volume of {} ul'.format(repetitions, float(volume)),
+                           location=location, volume=volume, repetitions=repetitions):
+            self.aspirate(volume, location, rate)
+            for _ in range(repetitions - 1):
+                self.dispense(volume, rate=rate)
+                self.aspirate(volume, rate=rate)
+            self.dispense(volume, rate=rate)
+        return self
+
+    def blow_out(self, location=None):
+        location = location.top() if isinstance(location, Well) else self._target(location, 0.0, 'blow_out')
+        with self._command(BLOW_OUT, 'Blowing out at {}'.format(stringify_location(location)), location=location):
+            self.current_volume = 0.0
+            self._last_location = location
+        return self
+
+    def air_gap(self, volume=None, height=None):
+        well = self._current_well(None, 'air_gap')
+        with self._command(AIR_GAP, 'Air gap'):
+            self.move_to(well.top(5.0 if height is None else height), publish=False)
+            self.aspirate(volume)
+        return self
+
+    def touch_tip(self, location=None, radius=1.0, v_offset=-1.0, speed=60.0):
+        well = self._current_well(location, 'touch_tip')
+        with self._command(TOUCH_TIP, 'Touching tip', location=well, radius=radius, v_offset=v_offset, speed=speed):
+            if not self.has_tip:
+                raise RuntimeError('Cannot touch tip without a tip attached ({} pipette)'.format(self.mount))
+            self._last_location = well.top()
+        return self
+
+    def move_to(self, location, force_direct=False, minimum_z_height=None, speed=None, publish=True):
+        if publish:
+            with self._command(MOVE_TO, 'Moving to {}'.format(stringify_location(location)), location=location):
+                self._last_location = location
+        else:
+            self._last_location = location
+        return self
+
+    def pick_up_tip(self, location=None, presses=None, increment=None):
+        if location is None:
+            if not self.tip_racks:
+                raise RuntimeError('The {} pipette has no tip racks to pick up from'.format(self.mount))
+            tip_rack, tip = next_available_tip(self.starting_tip, self.tip_racks, self.channels)
+            if tip is None:
+                raise RuntimeError('Out of tips: the {} pipette has used every tip in its tip racks'.format(self.mount))
+        else:
+            tip = location.labware.as_well() if isinstance(location, Location) else location
+        with self._command(PICK_UP_TIP, 'Picking up tip from {}'.format(stringify_location(tip)), location=tip):
+            if self.has_tip:
+                raise RuntimeError('Cannot pick up a tip with a tip already attached ({} pipette)'.format(self.mount))
+            tip.parent.use_tips(tip, self.channels)
+            self.has_tip = True
+            self.current_volume = 0.0
+            self.working_volume = min(tip.max_volume, self.max_volume)
+            self._tip = tip
+            self._last_location = tip.top()
+        return self
+
+    def drop_tip(self, location=None, home_after=True):
+        if location is None:
+            location = self.trash_container.wells()[0]
+        with self._command(DROP_TIP, 'Dropping tip into {}'.format(stringify_location(location)), location=location):
+            if not self.has_tip:
+                raise RuntimeError('Cannot drop a tip without a tip attached ({} pipette)'.format(self.mount))
+            self.has_tip = False
+            self.current_volume = 0.0
+            self._tip = None
+            self._last_location = location.top() if isinstance(location, Well) else location
+        return self
+
+    def return_tip(self, home_after=True):
+        if self._tip is None:
+            raise RuntimeError('Cannot return a tip without a tip attached ({} pipette)'.format(self.mount))
+        tip = self._tip
+        with self._command(RETURN_TIP, 'Returning tip'):
+            self.drop_tip(tip, home_after)
+            tip.parent.return_tips(tip, self.channels)
+        return self
+
+    def transfer(self, volume, source, dest, trash=True, **kwargs):
+        with self._command(TRANSFER, 'Transferring {} from {} to {}'.format(volume_text(volume), stringify_location(source), stringify_location(dest)),
+                           volume=volume, source=source, dest=dest):
+            for method, args, method_kwargs in self._transfer_steps(volume, source, dest, trash, kwargs):
+                getattr(self, method)(*args, **method_kwargs)
+        return self
+
+    def distribute(self, volume, source, dest, *args, **kwargs):
+        kwargs['mode'] = 'distribute'
+        kwargs['disposal_volume'] = kwargs.get('disposal_volume', self.min_volume)
+        kwargs['mix_after'] = (0, 0)
+        if kwargs.get('blowout_location') == 'destination well':
+            raise ValueError('distribute() cannot blow out into the destination well')
+        with self._command(DISTRIBUTE, 'Distributing {} from {} to {}'.format(volume_text(volume), stringify_location(source), stringify_location(dest)),
+                           volume=volume, source=source, dest=dest):
+            self.transfer(volume, source, dest, **kwargs)
+        return self
+
+    def consolidate(self, volume, source, dest, *args, **kwargs):
+        kwargs['mode'] = 'consolidate'
+        kwargs['mix_before'] = (0, 0)
+        kwargs['disposal_volume'] = 0
+        if kwargs.get('blowout_location') == 'source well':
+            raise ValueError('consolidate() cannot blow out into the source well')
+        with self._command(CONSOLIDATE, 'Consolidating {} from {} to {}'.format(volume_text(volume), stringify_location(source), stringify_location(dest)),
+                           volume=volume, source=source, dest=dest):
+            self.transfer(volume, source, dest, **kwargs)
+        return self
+
+    def _transfer_wells(self, wells, name):
+        # Flat list of sources or destinations; a multichannel only uses wells its first tip can reach (row A, or A/B in a 384)
+        if isinstance(wells, (Well, Location)):
+            wells = [wells]
+        elif wells and isinstance(wells[0], list):
+            wells = [well for well_list in wells for well in well_list]
+        if self.channels == 1:
+            return wells
+        valid_wells = []
+        for well in wells:
+            test_well = well.labware.as_well() if isinstance(well, Location) else well
+            first_rows = test_well.parent.rows()[:2] if test_well.parent.parameters.get('format') == '384Standard' else test_well.parent.rows()[:1]
+            if any(test_well in row for row in first_rows):
+                valid_wells.append(well)
+        if not valid_wells:
+            raise RuntimeError('Invalid {} for multichannel transfer: {}'.format(name, wells))
+        return valid_wells
+
+    def _transfer_steps(self, volume, source, dest, trash, options):
+        # (method, args, kwargs) steps of a transfer/distribute/consolidate, planned like the apiLevel 2.8 TransferPlan.
+        # A generator, so options that depend on the pipette's volume are checked as the steps run.
+        mode = options.get('mode', 'transfer')
+        new_tip = (options.get('new_tip') or 'once').lower()
+        blowout_location = options.get('blowout_location')
+        blow_out_strategy = None
+        if options.get('blow_out'):
+            if blowout_location is None:
+                blow_out_strategy = 'source' if self.current_volume else 'trash'
+            else:
+                blow_out_strategy = {'source well': 'source', 'destination well': 'dest', 'trash': 'trash'}[blowout_location]
+        if new_tip != 'never':
+            tip_rack, tip = next_available_tip(self.starting_tip, self.tip_racks, self.channels)
+            max_volume = min(tip.max_volume, self.max_volume) if tip is not None else self.max_volume
+        else:
+            max_volume = self.working_volume
+        disposal_volume = options.get('disposal_volume') or 0
+        air_gap = options.get('air_gap', 0)
+        if air_gap < 0 or air_gap >= max_volume:
+            raise ValueError("air_gap must be between 0uL and the pipette's expected working volume, {}uL".format(max_volume))
+        touch_tip = bool(options.get('touch_tip'))
+        mix_before = options.get('mix_before') if options.get('mix_before') not in (None, (0, 0)) else None
+        mix_after = options.get('mix_after') if options.get('mix_after') not in (None, (0, 0)) else None
+        drop_method = 'drop_tip' if trash else 'return_tip'
+
+        sources = self._transfer_wells(source, 'source')
+        dests = self._transfer_wells(dest, 'target')
+        transfer_count = max(len(sources), len(dests))
+        if isinstance(volume, (int, float)):
+            volumes = [volume] * transfer_count
+        elif isinstance(volume, tuple):
+            volumes = [volume[0] + (volume[-1] - volume[0]) * index / (transfer_count - 1) for index in range(transfer_count)]
+        elif len(volume) != transfer_count:
+            raise RuntimeError('List of volumes should be equal to number of transfers')
+        else:
+            volumes = volume
+
+        def expand_for_volume(targets, step_max_volume):
+            # Volumes over the limit are split into equal halves (or max volume steps then halves)
+            for step_volume, target in zip(volumes, targets):
+                while step_volume > step_max_volume * 2:
+                    yield step_max_volume, target
+                    step_volume -= step_max_volume
+                if step_volume > step_max_volume:
+                    step_volume /= 2
+                    yield step_volume, target
+                yield step_volume, target
+
+        def aspirate_steps(step_volume, location):
+            if mix_before is not None and self.current_volume == 0:
+                yield 'mix', [], {'repetitions': mix_before[0], 'volume': mix_before[1], 'location': location}
+            yield 'aspirate', [step_volume, location], {}
+            if air_gap:
+                yield 'air_gap', [air_gap], {}
+            if touch_tip:
+                yield 'touch_tip', [], {}
+
+        def dispense_steps(step_volume, step_dest, step_source=None, dispense_next=False):
+            yield 'dispense', [step_volume + air_gap, step_dest], {}
+            if dispense_next:
+                if air_gap:
+                    yield 'air_gap', [air_gap], {}
+                if touch_tip:
+                    yield 'touch_tip', [], {}
+                return
+            if mix_after is not None and self.current_volume == 0:
+                yield 'mix', [], {'repetitions': mix_after[0], 'volume': mix_after[1], 'location': step_dest}
+            if touch_tip:
+                yield 'touch_tip', [], {}
+            if blow_out_strategy == 'source':
+                yield 'blow_out', [step_source], {}
+            elif blow_out_strategy == 'dest':
+                yield 'blow_out', [step_dest], {}
+            elif blow_out_strategy == 'trash' or disposal_volume:
+                yield 'blow_out', [self.trash_container.wells()[0]], {}
+
+        def grouped_steps(plan, extra_volume):
+            # Consecutive steps that fit in one tip together with extra_volume(group); zero volume steps are skipped
+            group = []
+            for step in plan:
+                if group and sum(step_volume for step_volume, target in group) + extra_volume(group) + step[0] > max_volume:
+                    yield group
+                    group = []
+                if step[0] > 0:
+                    group.append(step)
+            if group:
+                yield group
+
+        if new_tip == 'once':
+            yield 'pick_up_tip', [], {}
+        if mode == 'transfer':
+            if len(sources) != len(dests):
+                if max(len(sources), len(dests)) % min(len(sources), len(dests)):
+                    raise ValueError('Source and destination lists must be divisible')
+                sources = [well for well in sources for _ in range(transfer_count // len(sources))]
+                dests = [well for well in dests for _ in range(transfer_count // len(dests))]
+            for step_volume, (step_source, step_dest) in expand_for_volume(list(zip(sources, dests)), self.max_volume - disposal_volume - air_gap):
+                if new_tip == 'always':
+                    yield 'pick_up_tip', [], {}
+                transferred_volume = 0.0
+                while transferred_volume < step_volume:
+                    tip_volume = min(max_volume - disposal_volume - air_gap, step_volume - transferred_volume)
+                    yield from aspirate_steps(tip_volume, step_source)
+                    yield from dispense_steps(tip_volume, step_dest, step_source)
+                    transferred_volume += tip_volume
+                if new_tip == 'always':
+                    yield drop_method, [], {}
+        elif mode == 'distribute':
+            if new_tip == 'always':
+                yield 'pick_up_tip', [], {}
+            for group in grouped_steps(expand_for_volume(dests, self.max_volume - disposal_volume - air_gap),
+                                       lambda group: disposal_volume + air_gap):
+                yield from aspirate_steps(sum(step_volume for step_volume, step_dest in group) + disposal_volume, sources[0])
+                for step_index, (step_volume, step_dest) in enumerate(group):
+                    yield from dispense_steps(step_volume, step_dest, sources[0], step_index < len(group) - 1)
+            if new_tip == 'always':
+                yield drop_method, [], {}
+        else:
+            if new_tip == 'always':
+                yield 'pick_up_tip', [], {}
+            for group in grouped_steps(expand_for_volume(sources, self.max_volume), lambda group: air_gap * len(group)):
+                for step_volume, step_source in group:
+                    yield from aspirate_steps(step_volume, step_source)
+                yield from dispense_steps(sum(step_volume + air_gap for step_volume, step_source in group) - air_gap, dests[0])
+            if new_tip == 'always':
+                yield drop_method, [], {}
+        if new_tip == 'once':
+            yield drop_method, [], {}
+
+    def __repr__(self):
+        return '{} on {} mount'.format(self.name, self.mount)
+
+
+class ModuleContext:
+    def __init__(self, protocol, model, display_name, slot, labware_offset):
+        self.protocol = protocol
+        self.model = model
+        self.display_name = display_name
+        self.slot = slot
+        self.labware = None
+        self.labware_origin = Point(*deck_slots[slot], 0.0) + Point(*labware_offset)
+
+    def load_labware(self, name, label=None, namespace=None, version=None):
+        if self.labware is not None:
+            raise ValueError('{} already holds {}'.format(self, self.labware))
+        self.labware = Labware(labware_definition(name, self.protocol.extra_labware), self, self.labware_origin, label)
+        return self.labware
+
+    def __repr__(self):
+        return '{} on {}'.format(self.display_name, self.slot)
+
+
+class MagneticModuleContext(ModuleContext):
+    status = 'disengaged'
+    current_height = None
+
+    def engage(self, height=None, offset=None, height_from_base=None):
+        with self.protocol.command(MAGDECK_ENGAGE, 'Engaging Magnetic Module', module=self, height=height, offset=offset,
+                                   height_from_base=height_from_base):
+            self.status = 'engaged'
+            self.current_height = height if height is not None else height_from_base
+
+    def disengage(self):
+        with self.protocol.command(MAGDECK_DISENGAGE, 'Disengaging Magnetic Module', module=self):
+            self.status = 'disengaged'
+            self.current_height = None
+
+
+class TemperatureModuleContext(ModuleContext):
+    status = 'idle'
+    target = None
+    temperature = 23.0
+
+    def start_set_temperature(self, celsius):
+        with self.protocol.command(TEMPDECK_SET_TEMP, 'Setting Temperature Module temperature to {} °C (rounded off to nearest integer)'.format(
+                round(float(celsius), 0)), module=self, celsius=celsius, blocking=False):
+            self.target = celsius
+            self.status = 'holding at target'
+
+    def await_temperature(self, celsius):
+        with self.protocol.command(TEMPDECK_AWAIT_TEMP, 'Waiting for Temperature Module to reach temperature {} °C (rounded off to nearest integer)'.format(
+                round(float(celsius), 0)), module=self, celsius=celsius):
+            self.temperature = celsius
+
+    def set_temperature(self, celsius):
+        # Published as one command, like the real set_temperature(); blocking tells it apart from start_set_temperature()
+        with self.protocol.command(TEMPDECK_SET_TEMP, 'Setting Temperature Module temperature to {} °C (rounded off to nearest integer)'.format(
+                round(float(celsius), 0)), module=self, celsius=celsius, blocking=True):
+            self.target = self.temperature = celsius
+            self.status = 'holding at target'
+
+    def deactivate(self):
+        with self.protocol.command(TEMPDECK_DEACTIVATE, 'Deactivating Temperature Module', module=self):
+            self.target = None
+            self.status = 'idle'
+
+
+class ProtocolContext:
+    def __init__(self, extra_labware=None, api_level='2.8'):
+        self.api_version = api_level
+        self.extra_labware = extra_labware or {}
+        self.broker = Broker()
+        self.trace = [] # {'name', 'text', 'depth', 'payload'} per command, in the order they started
+        self.deck = {} # slot name -> labware or module
+        self.instruments = {} # mount -> InstrumentContext
+        self.modules = []
+        self._depth = 0
+        self.fixed_trash = Labware(fixed_trash_definition, '12', Point(*deck_slots['12'], 0.0))
+        self.deck['12'] = self.fixed_trash
+
+    @contextlib.contextmanager
+    def command(self, name, text, **payload):
+        # Records the command and publishes the before/after broker messages around it
+        payload['text'] = text
+        self.trace.append({'name': name, 'text': text, 'depth': self._depth, 'payload': payload})
+        self.broker.publish(COMMAND, {'$': 'before', 'name': name, 'payload': payload})
+        self._depth += 1
+        try:
+            yield
+        except Exception as error:
+            self.broker.publish(COMMAND, {'$': 'after', 'name': name, 'payload': payload, 'error': error})
+            raise
+        finally:
+            self._depth -= 1
+        self.broker.publish(COMMAND, {'$': 'after', 'name': name, 'payload': payload, 'error': None})
+
+    def is_simulating(self):
+        return True
+
+    def _free_slot(self, location):
+        slot = str(location)
+        if slot not in deck_slots:
+            raise ValueError('"{}" is not an OT-2 deck slot'.format(location))
+        if slot in self.deck:
+            raise ValueError('Slot {} already holds {}'.format(slot, self.deck[slot]))
+        return slot
+
+    def load_labware(self, load_name, location, label=None, namespace=None, version=None):
+        slot = self._free_slot(location)
+        labware = Labware(labware_definition(load_name, self.extra_labware), slot, Point(*deck_slots[slot], 0.0), label)
+        self.deck[slot] = labware
+        return labware
+
+    def load_module(self, module_name, location=None, configuration=None):
+        if module_name.lower() not in module_types:
+            raise ValueError('Unknown module "{}"; the mock knows {}'.format(module_name, ', '.join(sorted(module_types))))
+        model, display_name, labware_offset = module_types[module_name.lower()]
+        slot = self._free_slot(location)
+        module_class = MagneticModuleContext if model.startswith('magnetic') else TemperatureModuleContext
+        module = module_class(self, model, display_name, slot, labware_offset)
+        self.deck[slot] = module
+        self.modules.append(module)
+        return module
+
+    def load_instrument(self, instrument_name, mount, tip_racks=None, replace=False):
+        if mount not in ('left', 'right'):
+            raise ValueError('Mount must be "left" or "right", not "{}"'.format(mount))
+        if mount in self.instruments and not replace:
+            raise RuntimeError('The {} mount already has a {}'.format(mount, self.instruments[mount].name))
+        self.instruments[mount] = InstrumentContext(self, instrument_name, mount, tip_racks)
+        return self.instruments[mount]
+
+    def comment(self, msg):
+        with self.command(COMMENT, msg):
+            pass
+
+    def delay(self, seconds=0, minutes=0, msg=None):
+        delay_minutes, delay_seconds = divmod(minutes * 60 + seconds, 60)
+        text = 'Delaying for {} minutes and {} seconds'.format(int(delay_minutes), round(delay_seconds, 3))
+        with self.command(DELAY, '{}. {}'.format(text, msg) if msg else text, minutes=delay_minutes, seconds=delay_seconds):
+            pass
+
+    def pause(self, msg=None):
+        with self.command(PAUSE, 'Pausing robot operation: {}'.format(msg) if msg else 'Pausing robot operation', userMessage=msg):
+            pass
+
+    def home(self):
+        with self.command(HOME, 'Homing pipette plunger on mount left'):
+            pass
+
+
+def opentrons_modules():
+    # Stand-in opentrons package: protocol_api, types and commands.types backed by this module
+    opentrons = ModuleType('opentrons')
+    opentrons.__version__ = 'mock'
+    protocol_api = ModuleType('opentrons.protocol_api')
+    for name in ['ProtocolContext', 'InstrumentContext', 'Labware', 'Well', 'ModuleContext', 'MagneticModuleContext', 'TemperatureModuleContext']:
+        setattr(protocol_api, name, globals()[name])
+    opentrons_types = ModuleType('opentrons.types')
+    opentrons_types.Point, opentrons_types.Location = Point, Location
+    commands = ModuleType('opentrons.commands')
+    command_types = ModuleType('opentrons.commands.types')
+    for name, value in globals().items():
+        if isinstance(value, str) and (value == COMMAND or value.startswith(COMMAND + '.')) and name.isupper():
+            setattr(command_types, name, value)
+    opentrons.protocol_api, opentrons.types, opentrons.commands, commands.types = protocol_api, opentrons_types, commands, command_types
+    return {'opentrons': opentrons, 'opentrons.protocol_api': protocol_api, 'opentrons.types': opentrons_types,
+            'opentrons.commands': commands, 'opentrons.commands.types': command_types}
+
+
+def swapped_module(name, module, helper_dir):
+    # Modules imported again under the stand-in: opentrons itself and the helper modules next to the scripts
+    if name == 'opentrons' or name.startswith('opentrons.'):
+        return True
+    module_path = getattr(module, '__file__', None)
+    return (module_path is not None and name != __name__ and name != '__main__'
+            and os.path.dirname(os.path.abspath(module_path)) == helper_dir)
+
+
+@contextlib.contextmanager
+def mock_opentrons(helper_dir=None):
+    helper_dir = os.path.abspath(helper_dir or script_dir)
+    saved_modules = {name: module for name, module in sys.modules.items() if swapped_module(name, module, helper_dir)}
+    for name in saved_modules:
+        del sys.modules[name]
+    sys.modules.update(opentrons_modules())
+    try:
+        yield
+    finally:
+        for name, module in list(sys.modules.items()):
+            if swapped_module(name, module, helper_dir):
+                del sys.modules[name]
+        sys.modules.update(saved_modules)
+
+
+def run_mock_protocol(script_path, parameters=None, extra_labware=None):
+    # Runs the script's run(protocol) on a mock ProtocolContext and returns the context (its trace holds the run)
+    with mock_opentrons(os.path.dirname(os.path.abspath(script_path))):
+        if os.path.dirname(os.path.abspath(script_path)) not in sys.path:
+            sys.path.insert(0, os.path.dirname(os.path.abspath(script_path)))
+        script = load_script(script_path, parameters)
+        protocol = ProtocolContext(extra_labware, getattr(script, 'metadata', {}).get('apiLevel', '2.8'))
+        script.run(protocol)
+    return protocol
+
+
+def trace_lines(trace):
+    # The run as opentrons_simulate prints it
+    return ['\t' * command['depth'] + command['text'] for command in trace]
+
+
+def trace_duration(trace):
+    # Estimated run time in seconds (see the time model above)
+    seconds = 0.0
+    positions = {} # mount -> (well or None, point)
+    for command in trace:
+        payload = command['payload']
+        if command['name'] == DELAY:
+            seconds += payload['minutes'] * 60 + payload['seconds']
+            continue
+        seconds += command_times.get(command['name'], 0.0)
+        if command['name'] in (ASPIRATE, DISPENSE):
+            seconds += payload['volume'] / payload['flow_rate']
+        location = payload.get('location')
+        if command['name'] in composite_commands or payload.get('instrument') is None or location is None:
+            continue
+        if isinstance(location, Well):
+            location = location.top()
+        well = location.labware.as_well()
+        mount = payload['instrument'].mount
+        position = positions.get(mount)
+        if position is None or position[0] is not well or (well is None and position[1][:2] != location.point[:2]):
+            if position is not None:
+                seconds += math.hypot(location.point.x - position[1].x, location.point.y - position[1].y) / gantry_speed
+            seconds += z_travel_time
+        elif position[1].z != location.point.z:
+            seconds += z_move_time
+        positions[mount] = (well, location.point)
+    return seconds
+
+
+def trace_metrics(trace):
+    # Summary numbers of a mock run; aspirated volume counts every channel of a multichannel
+    atomic_commands = [command for command in trace if command['name'] not in composite_commands]
+    return {'Commands': len(atomic_commands),
+            'Tips': sum(command['payload']['instrument'].channels for command in atomic_commands if command['name'] == PICK_UP_TIP),
+            'Aspirated uL': sum(command['payload']['volume'] * command['payload']['instrument'].channels
+                                for command in atomic_commands if command['name'] == ASPIRATE),
+            'Delay min': sum(command['payload']['minutes'] * 60 + command['payload']['seconds'] for command in atomic_commands
+                             if command['name'] == DELAY) / 60,
+            'Estimated min': trace_duration(trace) / 60}
+
+
+def trace_report(trace):
+    atomic_commands = [command for command in trace if command['name'] not in composite_commands]
+    name_counts = collections.Counter(command['name'][len(COMMAND) + 1:].lower() for command in atomic_commands)
+    metrics = trace_metrics(trace)
+    return ['{} atomic commands: {}'.format(len(atomic_commands), ', '.join('{} {}'.format(count, name) for name, count in sorted(name_counts.items()))),
+            '{} tips, {:.1f} uL aspirated, {:.1f} min of delays, ~{:.1f} min estimated run time'.format(
+                metrics['Tips'], metrics['Aspirated uL'], metrics['Delay min'], metrics['Estimated min'])]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a protocol on a mock ProtocolContext, without the Opentrons stack')
+    parser.add_argument('script_path')
+    parser.add_argument('--set', nargs='*', default=[], metavar='NAME=VALUE', help='module-level settings of the script')
+    parser.add_argument('--labware-dir', nargs='*', default=[], help='custom labware definition folders')
+    parser.add_argument('--trace', help='write the command trace to this file')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    mock_protocol = run_mock_protocol(args.script_path, parse_parameters(args.set), read_labware_dirs(args.labware_dir))
+    run_seconds = time.perf_counter() - start_time
+    if args.trace:
+        with open(args.trace, 'w', encoding='utf-8') as trace_file:
+            trace_file.write('\n'.join(trace_lines(mock_protocol.trace)) + '\n')
+    for report_line in trace_report(mock_protocol.trace):
+        print(report_line)
+    print('{} ran in {:.1f} ms'.format(args.script_path, run_seconds * 1000))
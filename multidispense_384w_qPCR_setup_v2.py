@@ -6,6 +6,10 @@
 # UPDATES: simplified/condensed all codelines, cleaned up unused variables
 
 from opentrons import protocol_api
+from mastermix_planner import mastermix_report, plan_mastermix
+from qpcr_layout import compile_layout, layout_report, read_sample_sheet
+from quadrant_mapping import default_quadrant_assignment, mapped_well_indexes, quadrant_map
+from well_index import well_index
 
 metadata = {
     'apiLevel': '2.8',
@@ -14,54 +18,105 @@ metadata = {
     'author': 'Max Benjamin'
     }
 
+# Number of RNA source plates (1-4). Plates 1-4 go in slots 4, 5, 1 and 2; extra 20 ul tip racks go in slots 10 and 11.
+rna_plate_count = 2
+# Quadrants of the 384-well plate for each RNA plate, e.g. {1: [1, 3], 2: [2, 4]}; a plate with more than one quadrant
+# is plated in replicate. Leave as None for the default layout for rna_plate_count (see quadrant_mapping.py).
+rna_quadrant_assignment = None
+
+# qPCR sample sheet (.csv, see qpcr_layout.py). When set, the plate layout comes from the sheet instead of the quadrant
+# settings above: every sample gets default_replicates wells (or its own Replicates) for every assay.
+sample_sheet_path = None
+qpcr_assays = ['Assay 1'] # one mastermix per assay: assay 1 in mastermix columns 1-2, assay 2 in columns 3-4, ...
+default_replicates = 2
+
+rxn_volume = 15 # ul of mastermix per 384 well
+
 def run(protocol: protocol_api.ProtocolContext):
 
+    # Declare liquid handling variables for RNA transfers #
+    transfer_volume = 5 # ul
+    rna_pipette_max_volume = 20 # p20 multi GEN2
+
+    # RNA layout, planned before loading so the deck matches it. Either way the result is one p20 aspiration per RNA
+    # column (split only if the p20 can't hold all of its dispenses) and the 384 wells that need each mastermix.
+    if sample_sheet_path is not None:
+        qpcr_layout = compile_layout(read_sample_sheet(sample_sheet_path), qpcr_assays, default_replicates, transfer_volume, rna_pipette_max_volume)
+        rna_aspirations = qpcr_layout['RNA Aspirations']
+        mastermix_wells = qpcr_layout['Mastermix Wells']
+        run_rna_plate_count = max(aspiration['Source Plate'] for aspiration in rna_aspirations)
+        for report_line in layout_report(qpcr_layout):
+            protocol.comment(report_line)
+    else:
+        # Every RNA plate column goes to the same column of each of its quadrants (checked for collisions up front)
+        if rna_quadrant_assignment is not None:
+            quadrant_assignment = rna_quadrant_assignment
+        else:
+            quadrant_assignment = default_quadrant_assignment(rna_plate_count)
+        rna_quadrant_maps = quadrant_map(quadrant_assignment, channels = 8)
+        rna_aspirations = []
+        for plate_number, source_indexes, destination_indexes in rna_quadrant_maps:
+            if transfer_volume * destination_indexes.shape[1] > rna_pipette_max_volume:
+                raise ValueError('RNA plate {} needs {} ul per aspiration for {} replicates, more than the p20 holds'.format(
+                    plate_number, transfer_volume * destination_indexes.shape[1], destination_indexes.shape[1]))
+            for source_index, replicate_indexes in zip(source_indexes, destination_indexes):
+                rna_aspirations.append({'Source Plate': plate_number, 'Source Index': int(source_index),
+                                        'Destination Indexes': [int(destination_index) for destination_index in replicate_indexes]})
+        mastermix_wells = {qpcr_assays[0]: mapped_well_indexes(rna_quadrant_maps, channels = 8)}
+        run_rna_plate_count = rna_plate_count
+    if len(mastermix_wells) > 6:
+        raise ValueError('The mastermix plate has room for 6 assays (2 columns each), got {}'.format(len(mastermix_wells)))
+
     # Set tip box locations #
+    p20x8_tip_rack_count = max(2, -(-len(rna_aspirations) // 12)) # one 8-channel tip column per RNA aspiration
+    if p20x8_tip_rack_count > 4:
+        raise ValueError('The RNA transfers need {} racks of 20 ul tips; there is room for 4'.format(p20x8_tip_rack_count))
     p20x8_tips1 = protocol.load_labware('opentrons_96_tiprack_20ul',7)
     p20x8_tips2 = protocol.load_labware('opentrons_96_tiprack_20ul',8)
+    p20x8_extra_tips = [protocol.load_labware('opentrons_96_tiprack_20ul',slot) for slot in [10, 11][:p20x8_tip_rack_count - 2]]
     p300x8_tips1 = protocol.load_labware('opentrons_96_tiprack_300ul',9)
 
     # Set source and destination plate labware locations #
     mastermix_source_plate = protocol.load_labware('nest_96_wellplate_2ml_deep',3)
-    rna_source_plate1 = protocol.load_labware('nest_96_wellplate_200ul_on_basepiece',4)
-    rna_source_plate2 = protocol.load_labware('nest_96_wellplate_200ul_on_basepiece',5)
+    rna_source_plates = [protocol.load_labware('nest_96_wellplate_200ul_on_basepiece',slot) for slot in [4, 5, 1, 2][:run_rna_plate_count]]
     qPCR_destination_plate = protocol.load_labware('corning_384_wellplate_112ul_flat',6)
 
+    # Precomputed well coordinates (built once per labware) for the pipetting loops below #
+    rna_source_plates_wells = [well_index(rna_source_plate) for rna_source_plate in rna_source_plates]
+    qPCR_destination_plate_wells = well_index(qPCR_destination_plate)
+
     # Set mounted pipette types #
-    p20x8 = protocol.load_instrument('p20_multi_gen2', 'left', tip_racks = [p20x8_tips1, p20x8_tips2])
+    p20x8 = protocol.load_instrument('p20_multi_gen2', 'left', tip_racks = [p20x8_tips1, p20x8_tips2] + p20x8_extra_tips)
     p300x8 = protocol.load_instrument('p300_multi_gen2', 'right', tip_racks = [p300x8_tips1])
 
     # Declare liquid handling variables for mastermix dispensing #
-    rxn_volume = 15 # ul
     dispense_volume = rxn_volume # change this value as needed for volume adjustment
+    mastermix_disposal_volume = 15 # ul extra per aspiration, blown back into the source well
+    mastermix_dead_volume = 50 # ul left behind in each mastermix source well, only used to size the mastermix
 
-    # Liquid handling commands for mastermix multidispense #
-    source = mastermix_source_plate.wells_by_name()['A1']
-    dest = [qPCR_destination_plate.rows()[row] for row in list(range(0, 16))][0]
-    p300x8.distribute(dispense_volume, source, dest, trash = True, touch_tip = False, blow_out = True, blowout_location = 'source well', disposal_volume = 15)
+    # Mastermix goes to every well in the layout, packed into as few 8-channel aspirations as the p300 holds
+    mastermix_plan = []
+    for assay_number, (assay, assay_wells) in enumerate(mastermix_wells.items()):
+        assay_source_wells = {0: 'A{}'.format(2 * assay_number + 1), 1: 'A{}'.format(2 * assay_number + 2)}
+        assay_plan = plan_mastermix(assay_wells, dispense_volume, p300x8.max_volume, mastermix_disposal_volume, assay_source_wells, mastermix_dead_volume)
+        for report_line in mastermix_report(assay_plan, assay_wells):
+            protocol.comment('{}: {}'.format(assay, report_line) if len(mastermix_wells) > 1 else report_line)
+        mastermix_plan.extend(assay_plan)
 
-    source = mastermix_source_plate.wells_by_name()['A2']
-    dest = [qPCR_destination_plate.rows()[row] for row in list(range(0, 16))][1]
-    p300x8.distribute(dispense_volume, source, dest, trash = True, touch_tip = False, blow_out = True, blowout_location = 'source well', disposal_volume = 15)
+    # Liquid handling commands for mastermix multidispense #
+    for mastermix_source in mastermix_plan:
+        source = mastermix_source_plate.wells_by_name()[mastermix_source['Source Well']]
+        p300x8.pick_up_tip() # one tip per mastermix column
+        for aspiration in mastermix_source['Aspirations']:
+            dest = [qPCR_destination_plate_wells.well(destination_index) for destination_index in aspiration['Destination Indexes']]
+            p300x8.distribute(dispense_volume, source, dest, new_tip = 'never', trash = True, touch_tip = False, blow_out = True, blowout_location = 'source well', disposal_volume = mastermix_disposal_volume)
+        p300x8.drop_tip()
 
     # Liquid handling commands for RNA multidispense #
-    transfer_volume = 5
-    for column in list(range(0, 12)):
-        source_well = rna_source_plate1.wells()[column * 8] # use multichannel to pull from columns starting at row A, RNA plate 1
-        dest_well_q1 = qPCR_destination_plate.wells()[column * 32] # destination well indices for quadrant 1
-        dest_well_q3 = qPCR_destination_plate.wells()[1 + column * 32] # destination well indices for quadrant 3
+    for aspiration in rna_aspirations:
+        source_well = rna_source_plates_wells[aspiration['Source Plate'] - 1].well(aspiration['Source Index']) # use multichannel to pull from columns starting at row A
         p20x8.pick_up_tip()
-        p20x8.aspirate(transfer_volume*2, source_well, rate = 1.0)
-        p20x8.dispense(transfer_volume, dest_well_q1.top(-4.5), rate = 1.0)
-        p20x8.dispense(transfer_volume, dest_well_q3.top(-4.5), rate = 1.0)
+        p20x8.aspirate(transfer_volume*len(aspiration['Destination Indexes']), source_well, rate = 1.0)
+        for destination_index in aspiration['Destination Indexes']:
+            p20x8.dispense(transfer_volume, qPCR_destination_plate_wells.top(destination_index, -4.5), rate = 1.0) # destination well for each replicate
         p20x8.drop_tip()
-
-    for column in list(range(0, 12)):
-        source_well = rna_source_plate2.wells()[column * 8] # use multichannel to pull from columns starting at row A, RNA plate 2
-        dest_well_q2 = qPCR_destination_plate.wells()[16 + column * 32] # destination well indices for quadrant 2
-        dest_well_q4 = qPCR_destination_plate.wells()[17 + column * 32] # destination well indices for quadrant 4
-        p20x8.pick_up_tip()
-        p20x8.aspirate(transfer_volume*2, source_well, rate = 1.0)
-        p20x8.dispense(transfer_volume, dest_well_q2.top(-4.5), rate = 1.0)
-        p20x8.dispense(transfer_volume, dest_well_q4.top(-4.5), rate = 1.0)
-        p20x8.drop_tip()
\ No newline at end of file
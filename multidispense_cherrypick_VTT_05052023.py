@@ -2,9 +2,17 @@
 # Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
 # Command line simulation = opentrons_simulate.exe multidispense_cherrypick_VTT_04292023.py -e
 
-import csv
 import math
 from opentrons import protocol_api
+from aspiration_planner import aspiration_plan_report, plan_aspirations
+from cherrypick_checkpoint import CherrypickCheckpoint, next_tip, run_key
+from cherrypick_dual_mount import interleave_plans, split_groups_by_volume, split_report
+from cherrypick_multichannel import classification_report, classify_transfers
+from cherrypick_route import optimize_routes, plate_well_positions, route_report_lines
+from cherrypick_worklist import consolidate_transfers, consolidation_report, parse_worklist_text, read_worklist
+from deck_map import DeckMap, load_deck_config
+from liquid_ledger import LiquidLedger
+from worklist_validator import WorklistValidator
 
 metadata = {
     'protocolName': 'Multidispense Cherrypick:[Volume Validation Test - Lambda DNA]',
@@ -13,6 +21,42 @@ metadata = {
     'apiLevel': '2.8'
 }
 
+# Path to a .csv or .tsv worklist (gzip-compressed .csv.gz/.tsv.gz also works). Leave as None to use csv_raw below.
+worklist_path = None
+
+# Worklist plate name -> deck slot, labware type and label. Add as many plates as needed; plates listed with the same
+# slot (and labware type) are swapped by hand when the run pauses for them.
+deck_config = {
+    'Source 1': {'slot': '1', 'labware': 'thermoscientificnunc_96_wellplate_2000ul', 'label': 'Source Plate 1'},
+    'Source 2': {'slot': '4', 'labware': 'thermoscientificnunc_96_wellplate_2000ul', 'label': 'Source Plate 2'},
+    'Source 3': {'slot': '7', 'labware': 'thermoscientificnunc_96_wellplate_2000ul', 'label': 'Source Plate 3'},
+    'Source 4': {'slot': '10', 'labware': 'thermoscientificnunc_96_wellplate_2000ul', 'label': 'Source Plate 4'},
+    'Destination 1': {'slot': '2', 'labware': 'corning_96_wellplate_360ul_flat', 'label': 'Destination Plate 1'},
+    'Destination 2': {'slot': '5', 'labware': 'corning_96_wellplate_360ul_flat', 'label': 'Destination Plate 2'},
+    'Destination 3': {'slot': '8', 'labware': 'corning_96_wellplate_360ul_flat', 'label': 'Destination Plate 3'},
+    'Destination 4': {'slot': '11', 'labware': 'corning_96_wellplate_360ul_flat', 'label': 'Destination Plate 4'}
+}
+
+# Path to a JSON deck config with the same layout as deck_config above. Leave as None to use deck_config.
+deck_config_path = None
+
+# Reorder the destinations of each aspiration to cut gantry travel between destination plates. Off by default, so
+# destinations are dispensed in worklist order unless this is turned on.
+optimize_destination_order = False
+
+# Send column-aligned transfers (rows A-H of one column to rows A-H of another) to an 8-channel head on the right mount.
+# Off by default; when it is on, the 8-channel head is only loaded if the worklist has column batches.
+multichannel_batching = False
+
+# Load a p20 single-channel on the right mount and send dispenses below low_volume_cutoff (uL) to it; the p300 keeps the
+# rest and the two pipettes take turns at each source well. Needs the right mount, so turn off multichannel_batching.
+dual_mount_mode = False
+low_volume_cutoff = 20 # p300 GEN2 minimum volume
+
+# Checkpoint file for resuming an aborted run, e.g. '/data/user_storage/cherrypick_checkpoint.jsonl' on the robot. Run
+# the protocol again unchanged to pick up where it stopped. Leave as None to run without a checkpoint.
+checkpoint_path = None
+
 csv_raw = '''
 Source Plate,Source Well,Destination Plate,Destination Well,Volume
 Source 1,A1,Destination 1,A1,50
@@ -113,128 +157,206 @@ Source 1,H1,Destination 1,H11,50
 Source 1,H1,Destination 1,H12,50
 '''
 
-csv_data = csv_raw.splitlines()[1:] # Discard the blank first line.
-csv_reader = csv.DictReader(csv_data)
-transfer_info = []
-for row in csv_reader:
-    transfer_info.append(row)
-
-# The following block creates a list of dictionaries, where each dictionary reps a unique Source Plate:Source Well combo, based on the csv_raw input above.
-# Output transfer_info_consolidated list is used as a reference to iterate through transfers in liquid handling command block.
-transfer_info_consolidated = []
-for transfer in transfer_info:
-    # Get the unique identifier for each transfer
-    transfer_key = (transfer['Source Plate'], transfer['Source Well'])
-
-    # Check if the transfer_key already exists in transfer_info_consolidated
-    transfer_exists = False
-    for consolidated_transfer in transfer_info_consolidated:
-        if (consolidated_transfer['Source Plate'], consolidated_transfer['Source Well']) == transfer_key:
-            # If transfer already exists in transfer_info_consolidated, update the lists
-            consolidated_transfer['Destination Wells'].append(transfer['Destination Well'])
-            consolidated_transfer['Volumes'].append(float(transfer['Volume']))
-            consolidated_transfer['Destination Plates'].append(transfer['Destination Plate'])
-            consolidated_transfer['Total Volume'] += float(transfer['Volume'])
-            consolidated_transfer['Dispense Count'] = len(consolidated_transfer['Destination Wells'])
-            transfer_exists = True
-            break
-
-    if not transfer_exists:
-        # If transfer does not exist in transfer_info_consolidated, create a new dictionary
-        dest_well_list = [transfer['Destination Well']]
-        volumes_list = [float(transfer['Volume'])]
-        dest_plate_list = [transfer['Destination Plate']]
-        total_volume = float(transfer['Volume'])
-        dispense_count = 1
-        transfer_info_consolidated.append({
-            'Source Plate': transfer['Source Plate'],
-            'Source Well': transfer['Source Well'],
-            'Destination Plates': dest_plate_list,
-            'Destination Wells': dest_well_list,
-            'Volumes': volumes_list,
-            'Total Volume': total_volume,
-            'Dispense Count': dispense_count
-        })
-
 def run(protocol: protocol_api.ProtocolContext):
 
-    # Load labware to the Worktable
-    tiprack_1 = protocol.load_labware('opentrons_96_tiprack_300ul', '3', 'Tip Rack 1')
-    tiprack_2 = protocol.load_labware('opentrons_96_tiprack_300ul', '6', 'Tip Rack 2')
-    tiprack_3 = protocol.load_labware('opentrons_96_tiprack_300ul', '9', 'Tip Rack 3')
+    # Liquid handling settings, shared by the pre-flight worklist check and the distribute() calls below
+    disposal_volume = 50
+    low_volume_disposal_volume = 2 # p20 disposal volume in dual_mount_mode
+    mix_before = (3, 300)
+    if dual_mount_mode:
+        pipette_min_volume = 1 # p20 GEN2 minimum volume
+    else:
+        pipette_min_volume = 20 # p300 GEN2 single and 8-channel minimum volume
+    if dual_mount_mode and multichannel_batching:
+        raise ValueError('dual_mount_mode and multichannel_batching both need the right mount; turn one of them off')
+
+    if deck_config_path is not None:
+        run_deck_config = load_deck_config(deck_config_path)
+    else:
+        run_deck_config = deck_config
 
-    source_plate_labware_type = 'thermoscientificnunc_96_wellplate_2000ul'
-    source_plate_1 = protocol.load_labware(source_plate_labware_type, '1', 'Source Plate 1')
-    source_plate_2 = protocol.load_labware(source_plate_labware_type, '4', 'Source Plate 2')
-    source_plate_3 = protocol.load_labware(source_plate_labware_type, '7', 'Source Plate 3')
-    source_plate_4 = protocol.load_labware(source_plate_labware_type, '10', 'Source Plate 4')
+    # Source and destination plates are loaded from the deck config; worklist plate names resolve through the deck map
+    deck_map = DeckMap(protocol, run_deck_config)
 
-    destination_plate_labware_type = 'corning_96_wellplate_360ul_flat'
-    destination_plate_1 = protocol.load_labware(destination_plate_labware_type, '2', 'Destination Plate 1')
-    destination_plate_2 = protocol.load_labware(destination_plate_labware_type, '5', 'Destination Plate 2')
-    destination_plate_3 = protocol.load_labware(destination_plate_labware_type, '8', 'Destination Plate 3')
-    destination_plate_4 = protocol.load_labware(destination_plate_labware_type, '11', 'Destination Plate 4')
+    # Pre-flight check of the whole worklist on the streaming pass below, against the loaded labware: bad
+    # wells/volumes, overfilled destination wells and source wells that would run dry are all listed in one error
+    # once the last row is read. Every transfer is planned before the first one runs, so that is before anything moves.
+    validator = WorklistValidator({plate_name: deck_map.labware_by_slot[slot] for plate_name, slot in deck_map.plate_slots.items()},
+                                  run_deck_config, pipette_min_volume, disposal_volume=disposal_volume, mix_volume=mix_before[1])
 
+    # Stream the worklist. When multichannel batching is on, column-aligned A-H -> A-H rows are pulled out for the
+    # 8-channel head and only the leftovers stream on to the single-channel pipette (the worklist is read twice for it).
+    if worklist_path is not None:
+        open_transfers = lambda: read_worklist(worklist_path, row_check=validator.check_rows)
+    else:
+        open_transfers = lambda: parse_worklist_text(csv_raw, row_check=validator.check_rows)
+    transfer_info = open_transfers()
+    if multichannel_batching:
+        multichannel_transfer_info, transfer_info, single_channel_count = classify_transfers(open_transfers)
+    else:
+        multichannel_transfer_info = []
+    # In dual_mount_mode the rows are consolidated as they stream and each source well's group is split by volume
+    # between the pipettes
+    if dual_mount_mode:
+        transfer_groups, low_volume_transfer_groups = split_groups_by_volume(consolidate_transfers(transfer_info), low_volume_cutoff)
+    else:
+        low_volume_transfer_groups = []
+
+    # Load labware to the Worktable. Tip Rack 3 holds 20 uL tips when the p20 has transfers to run.
+    tiprack_1 = protocol.load_labware('opentrons_96_tiprack_300ul', '3', 'Tip Rack 1')
+    tiprack_2 = protocol.load_labware('opentrons_96_tiprack_300ul', '6', 'Tip Rack 2')
+    if low_volume_transfer_groups:
+        tiprack_3 = protocol.load_labware('opentrons_96_tiprack_20ul', '9', 'Tip Rack 3')
+    else:
+        tiprack_3 = protocol.load_labware('opentrons_96_tiprack_300ul', '9', 'Tip Rack 3')
+
+    # Tip Rack 3 moves to the 8-channel head (or the p20) when there are transfers for the right mount
     pipette_head_type = 'p300_single_gen2'
-    pipette = protocol.load_instrument(pipette_head_type, mount='left', tip_racks=[tiprack_1,tiprack_2,tiprack_3])
+    multichannel_head_type = 'p300_multi_gen2'
+    low_volume_head_type = 'p20_single_gen2'
+    multichannel_pipette = None
+    low_volume_pipette = None
+    if multichannel_transfer_info:
+        pipette = protocol.load_instrument(pipette_head_type, mount='left', tip_racks=[tiprack_1,tiprack_2])
+        multichannel_pipette = protocol.load_instrument(multichannel_head_type, mount='right', tip_racks=[tiprack_3])
+    elif low_volume_transfer_groups:
+        pipette = protocol.load_instrument(pipette_head_type, mount='left', tip_racks=[tiprack_1,tiprack_2])
+        low_volume_pipette = protocol.load_instrument(low_volume_head_type, mount='right', tip_racks=[tiprack_3])
+    else:
+        pipette = protocol.load_instrument(pipette_head_type, mount='left', tip_racks=[tiprack_1,tiprack_2,tiprack_3])
+
+    # 50% of the default dispense flow rate for each pipette
+    dispense_flow_rates = {pipette_head_type: 92.86 * 0.5, multichannel_head_type: 92.86 * 0.5, low_volume_head_type: 7.56 * 0.5}
 
     # Time for pipetting commands! Liquid handling commands live in this codeblock.
-    if pipette_head_type == 'p20_single_gen2':
-        max_pipette_volume = 20
-    if pipette_head_type == 'p300_single_gen2':
-        max_pipette_volume = 300
-    if pipette_head_type == 'p1000_single_gen2':
-        max_pipette_volume = 1000
-
-    # Iterate through each transfer group, moving through 1 source plate/source well combination at a time.
-    for dictionary in transfer_info_consolidated:
+    def plan_transfers(transfer_info_consolidated, pipette, disposal_volume):
+        # Take the consolidated groups (one dictionary per unique Source Plate:Source Well combo), split every group
+        # into aspirations that fit the pipette once the disposal volume is counted, then optionally reorder each
+        # aspiration's destinations (nearest-neighbour + 2-opt over the well positions of the loaded labware).
+        for report_line in consolidation_report(transfer_info_consolidated):
+            protocol.comment(report_line)
+        aspiration_plan = plan_aspirations(transfer_info_consolidated, pipette.max_volume, disposal_volume)
+        if optimize_destination_order:
+            aspiration_plan, route_report = optimize_routes(aspiration_plan, plate_well_positions(
+                {plate_name: deck_map.labware_by_slot[slot] for plate_name, slot in deck_map.plate_slots.items()}))
+            for report_line in route_report_lines(route_report):
+                protocol.comment(report_line)
+        # Run groups that need the same swapped plates together so each manual swap happens once
+        aspiration_plan.sort(key=lambda dictionary: deck_map.swap_key([dictionary['Source Plate']] + dictionary['Destination Plates']))
+        for report_line in aspiration_plan_report(aspiration_plan, pipette.max_volume, disposal_volume):
+            protocol.comment(report_line)
+        return aspiration_plan
+
+    def run_group(group_index, dictionary, pipette, disposal_volume, mix_before):
+        # Run 1 source plate/source well combination.
         # Set source location for aspirate command.
         source_plate = dictionary['Source Plate']
         source_well = dictionary['Source Well']
 
         # Set source location for each aspirate.
-        if source_plate == "Source 1":
-            source_location = source_plate_1.wells_by_name()[source_well].bottom(0.5)
-        if source_plate == "Source 2":
-            source_location = source_plate_2.wells_by_name()[source_well].bottom(0.5)
-        if source_plate == "Source 3":
-            source_location = source_plate_3.wells_by_name()[source_well].bottom(0.5)
-        if source_plate == "Source 4":
-            source_location = source_plate_4.wells_by_name()[source_well].bottom(0.5)
-
-        # Set destination location to be the correct variable based on string name.
-        destination_plates_list = dictionary['Destination Plates']
-        renamed_destination_plates_list = []
-        for n in range(0,len(destination_plates_list)):
-            if destination_plates_list[n] == "Destination 1":
-                renamed_destination_plate = destination_plate_1
-                renamed_destination_plates_list.append(renamed_destination_plate)
-            if destination_plates_list[n] == "Destination 2":
-                renamed_destination_plate = destination_plate_2
-                renamed_destination_plates_list.append(renamed_destination_plate)
-            if destination_plates_list[n] == "Destination 3":
-                renamed_destination_plate = destination_plate_3
-                renamed_destination_plates_list.append(renamed_destination_plate)
-            if destination_plates_list[n] == "Destination 4":
-                renamed_destination_plate = destination_plate_4
-                renamed_destination_plates_list.append(renamed_destination_plate)
-
-        destination_wells_list = dictionary['Destination Wells']
-
-        distribute_compatible_dest_wells_list = [plate.wells_by_name()[well_name] for plate, well_name in zip(renamed_destination_plates_list, destination_wells_list)]
-        destination_volumes_list = dictionary['Volumes']
-        total_volume = dictionary['Total Volume']
-        dispense_count = dictionary['Dispense Count']
-
-        # Liquid handling commands go here.
-        pipette.flow_rate.dispense = 92.86 * 0.5 # 50% flow rate on dispense
-        pipette.distribute(volume=destination_volumes_list,
-                            source=source_location,
-                            dest=distribute_compatible_dest_wells_list,
-                            new_tip='once',
-                            touch_tip=True,
-                            blow_out=True,
-                            blowout_location='source well',
-                            mix_before=(3,300),
-                            disposal_volume=50)
-        
\ No newline at end of file
+        source_location = deck_map.bottom(source_plate, source_well, 0.5)
+
+        # Aspirations still to do (all of them, unless this group was cut off in a run being resumed)
+        aspirations = [(aspiration_index, aspiration) for aspiration_index, aspiration in enumerate(dictionary['Aspirations'])
+                       if not checkpoint.aspiration_done(group_index, aspiration_index)]
+        if not aspirations:
+            checkpoint.finish_group(group_index, pipette, dictionary['Total Volume'])
+            return
+
+        # One tip per source well, shared by all of its planned aspirations
+        pipette.pick_up_tip()
+        checkpoint.record_tip(pipette)
+        pipette.flow_rate.dispense = dispense_flow_rates[pipette.name] # 50% flow rate on dispense
+
+        for aspiration_index, aspiration in aspirations:
+            # Resolve destination wells through the deck map; every plate for one aspiration must be on the deck together
+            deck_map.check_no_swap_within([source_plate] + aspiration['Destination Plates'])
+            distribute_compatible_dest_wells_list = [deck_map.well(plate_name, well_name) for plate_name, well_name in zip(aspiration['Destination Plates'], aspiration['Destination Wells'])]
+            destination_volumes_list = aspiration['Volumes']
+
+            # Liquid handling commands go here. Each planned aspiration already fits the pipette, so distribute() runs it as a single aspirate.
+            checkpoint.start_aspiration(group_index, aspiration_index)
+            pipette.distribute(volume=destination_volumes_list,
+                                source=source_location,
+                                dest=distribute_compatible_dest_wells_list,
+                                new_tip='never',
+                                touch_tip=True,
+                                blow_out=True,
+                                blowout_location='source well',
+                                mix_before=mix_before,
+                                disposal_volume=disposal_volume)
+            checkpoint.finish_aspiration(group_index, aspiration_index, aspiration['Dispense Volume'])
+
+        pipette.drop_tip()
+        checkpoint.finish_group(group_index, pipette, dictionary['Total Volume'])
+
+    # Column batches on the 8-channel head first, then the leftover single-well transfers
+    if multichannel_batching:
+        for report_line in classification_report(multichannel_transfer_info, single_channel_count):
+            protocol.comment(report_line)
+    if dual_mount_mode:
+        for report_line in split_report(transfer_groups, low_volume_transfer_groups, low_volume_cutoff):
+            protocol.comment(report_line)
+
+    # Everything the run will do, in order: (pipette, transfer group, disposal volume, mix_before)
+    run_order = []
+    if multichannel_pipette is not None:
+        for dictionary in plan_transfers(consolidate_transfers(multichannel_transfer_info), multichannel_pipette, disposal_volume):
+            run_order.append((multichannel_pipette, dictionary, disposal_volume, mix_before))
+    if low_volume_pipette is not None:
+        # p300 and p20 groups interleaved by source well; only the first pipette into a source well mixes it
+        aspiration_plans = [(pipette, plan_transfers(transfer_groups, pipette, disposal_volume)),
+                            (low_volume_pipette, plan_transfers(low_volume_transfer_groups, low_volume_pipette, low_volume_disposal_volume))]
+        for group_pipette, dictionary, first_visit in interleave_plans(aspiration_plans, deck_map.swap_key):
+            if group_pipette is low_volume_pipette:
+                group_disposal_volume = low_volume_disposal_volume
+            else:
+                group_disposal_volume = disposal_volume
+            if first_visit:
+                group_mix_before = (mix_before[0], min(mix_before[1], group_pipette.max_volume))
+            else:
+                group_mix_before = (0, 0)
+            run_order.append((group_pipette, dictionary, group_disposal_volume, group_mix_before))
+    elif dual_mount_mode:
+        # Nothing below low_volume_cutoff, so the p300 runs every group
+        for dictionary in plan_transfers(transfer_groups, pipette, disposal_volume):
+            run_order.append((pipette, dictionary, disposal_volume, mix_before))
+    elif transfer_info:
+        for dictionary in plan_transfers(consolidate_transfers(transfer_info), pipette, disposal_volume):
+            run_order.append((pipette, dictionary, disposal_volume, mix_before))
+
+    # Record every aspirate/dispense per well. Source plates start at their deck config 'fill_volume' (full if not
+    # given, same as the pre-flight check); destination plates start empty.
+    ledger = LiquidLedger(protocol)
+    source_labware = []
+    for plate_name in validator.source_plates:
+        labware = deck_map.labware_by_slot[deck_map.plate_slots[plate_name]]
+        if labware not in source_labware:
+            source_labware.append(labware)
+            ledger.fill(labware.wells(), run_deck_config[plate_name].get('fill_volume', labware.wells()[0].max_volume))
+
+    # Checkpoint every tip, aspiration and group so an aborted run can be resumed; nothing is written while simulating
+    checkpoint = CherrypickCheckpoint(checkpoint_path,
+                                      run_key([[group_pipette.mount, dictionary, group_disposal_volume, group_mix_before]
+                                               for group_pipette, dictionary, group_disposal_volume, group_mix_before in run_order]),
+                                      write=not protocol.is_simulating())
+    for report_line in checkpoint.resume_report(len(run_order)):
+        protocol.comment(report_line)
+    for group_index, aspiration_index in checkpoint.interrupted_aspirations():
+        aspiration = run_order[group_index][1]['Aspirations'][aspiration_index]
+        protocol.comment('Group {} was stopped during an aspiration and it will not be repeated; check these wells by hand: {}'.format(
+            group_index + 1, ', '.join(dict.fromkeys('{} {}'.format(plate_name, well_name) for plate_name, well_name in
+                                                     zip(aspiration['Destination Plates'], aspiration['Destination Wells'])))))
+    for group_pipette in [pipette, multichannel_pipette, low_volume_pipette]:
+        if group_pipette is not None and checkpoint.tips_used.get(group_pipette.mount):
+            group_pipette.starting_tip = next_tip(group_pipette, checkpoint.tips_used[group_pipette.mount])
+
+    for group_index, (group_pipette, dictionary, group_disposal_volume, group_mix_before) in enumerate(run_order):
+        if not checkpoint.group_done(group_index):
+            run_group(group_index, dictionary, group_pipette, group_disposal_volume, group_mix_before)
+    checkpoint.complete()
+
+    # Volume left in every source well the run drew from
+    for labware in source_labware:
+        for report_line in ledger.report(labware):
+            protocol.comment(report_line)
@@ -0,0 +1,461 @@
+# Script name: pd_json_protocol.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python pd_json_protocol.py "Test qPCR setup script_v1.json" --output "Test qPCR setup script_v1_optimized.json"
+# Loads a schema-3 Protocol Designer JSON export into a flat command stream, runs peephole optimization passes over it
+# and runs the result against a ProtocolContext (run_pd_protocol), or writes it back out as a schema-3 JSON file that the
+# Opentrons app can run as-is.
+# Passes (in order; repeat_mixes only runs when asked for):
+#   tip_changes:    drops a dropTip/pickUpTip pair when the new tip would pick up the same liquid the old tip held and
+#                   the old tip only touched that liquid
+#   multi_dispense: merges consecutive aspirate/dispense transfers from one source well with one tip into a single
+#                   aspiration and a run of dispenses (as much as the pipette holds). Moves between source and
+#                   destinations are only cut here, where transfers merge; there is no separate move pass. A transfer
+#                   that mixes the source before its own draw is never merged into the one before (its mix would be
+#                   lost), and transfers that blow out after their dispense only merge with a disposal volume, which
+#                   is blown back into the source in place of the blow outs after the merged dispenses.
+#   repeat_mixes:   drops a mix in the source well when the same tip already mixed that well and nothing has been
+#                   dispensed into it since. Off by default: it also removes mixes set in Protocol Designer to pre-wet
+#                   the tip before each aspiration.
+# Every pass returns notes for the report next to its commands: what it changed and why it left the rest, e.g. that no
+# two transfers of the qPCR file fit in one p20 tip (15 uL each), so nothing merges there.
+# The time model is a rough estimate from the labware definitions in the file: gantry travel between wells, plunger
+# time from volume / flow rate and fixed times for tip handling. It is for comparing passes, not for run time planning.
+# Protocols packed with labware_store.py (labwareDefinitionRefs instead of labwareDefinitions) load the same way.
+# Files compiled from Python protocols by protocol_compiler.py may carry a few optional params schema 3 has no field for
+# (xOffsetMm/yOffsetMm on well commands, speed on moveToSlot, radius/speed on touchTip); they are honoured here.
+# A delay with wait 0 and a message is a comment.
+
+import argparse
+import collections
+import copy
+import json
+import math
+
+from opentrons import types
+
+from labware_store import LabwareStore, unpack_protocol
+
+schema_version = 3
+liquid_commands = ['aspirate', 'dispense', 'airGap', 'blowout', 'touchTip']
+module_commands = ['magneticModule/engageMagnet', 'magneticModule/disengageMagnet', 'temperatureModule/setTargetTemperature',
+                   'temperatureModule/awaitTemperature', 'temperatureModule/deactivate']
+supported_commands = liquid_commands + module_commands + ['pickUpTip', 'dropTip', 'moveToSlot', 'delay']
+default_passes = ['tip_changes', 'multi_dispense']
+
+# Time model (seconds, mm/s); OT-2 slot origins are 132.5 mm apart in x and 90.5 mm in y
+gantry_speed = 400
+z_travel_time = 1.0 # up to travel height and back down when the head changes wells
+z_move_time = 0.2 # height change within one well
+command_times = {'pickUpTip': 3.0, 'dropTip': 2.5, 'blowout': 0.5, 'touchTip': 2.0, 'moveToSlot': 0.0}
+slot_pitch = (132.5, 90.5)
+
+
+def load_pd_protocol(pd_json_path, labware_store=None):
+    with open(pd_json_path, 'r') as pd_json_file:
+        pd_protocol = json.load(pd_json_file)
+    if 'labwareDefinitionRefs' in pd_protocol:
+        pd_protocol = unpack_protocol(pd_protocol, labware_store if labware_store is not None else LabwareStore())
+    if pd_protocol.get('schemaVersion') != schema_version:
+        raise ValueError('{} is schema version {}; only Protocol Designer schema {} files are supported'.format(
+            pd_json_path, pd_protocol.get('schemaVersion'), schema_version))
+    for command_number, command in enumerate(pd_protocol['commands'], start=1):
+        if command['command'] not in supported_commands:
+            raise ValueError('Command {} ({}) is not supported'.format(command_number, command['command']))
+    return pd_protocol
+
+
+def write_pd_protocol(pd_protocol, commands, pd_json_path):
+    # Same file with the optimized command stream, so the app shows it next to the original
+    optimized_protocol = copy.deepcopy(pd_protocol)
+    optimized_protocol['metadata']['protocolName'] = '{} (optimized)'.format(pd_protocol['metadata']['protocolName'])
+    optimized_protocol['commands'] = commands
+    with open(pd_json_path, 'w') as pd_json_file:
+        json.dump(optimized_protocol, pd_json_file, separators=(',', ':'))
+
+
+def pipette_max_volumes(pd_protocol):
+    # Pipette id -> max volume from the pipette name (p20_multi_gen2 -> 20)
+    return {pipette_id: float(pipette['name'].split('_')[0][1:]) for pipette_id, pipette in pd_protocol['pipettes'].items()}
+
+
+def well_key(command):
+    return (command['params'].get('labware'), command['params'].get('well'))
+
+
+def is_mix_pair(commands, index):
+    # Aspirate immediately dispensed back into the same well with the same volume by the same pipette
+    if index + 1 >= len(commands):
+        return False
+    aspirate, dispense = commands[index], commands[index + 1]
+    return (aspirate['command'] == 'aspirate' and dispense['command'] == 'dispense'
+            and aspirate['params']['pipette'] == dispense['params']['pipette']
+            and well_key(aspirate) == well_key(dispense) and aspirate['params']['volume'] == dispense['params']['volume'])
+
+
+def mix_group_end(commands, index):
+    # Index after a run of mix pairs in one well starting at index (index itself if there is no mix there)
+    end = index
+    while is_mix_pair(commands, end) and (end == index or well_key(commands[end]) == well_key(commands[index])):
+        end += 2
+    return end
+
+
+def count_notes(message, reason_counts):
+    # 'message: reason (count), ...' for a Counter of reasons, or nothing when it is empty
+    if not reason_counts:
+        return []
+    return ['{}: {}'.format(message, ', '.join('{} ({})'.format(reason, count) for reason, count in reason_counts.most_common()))]
+
+
+def drop_redundant_tip_changes(pd_protocol, commands, max_volumes=None, disposal_volume=0.0):
+    # Liquid identity is tracked as the set of wells it came from; wells nobody dispensed into hold their own liquid
+    contents = {}
+    tip_liquids = {}
+    optimized_commands = []
+    dropped_count = 0
+    kept_reasons = collections.Counter()
+    index = 0
+    while index < len(commands):
+        command = commands[index]
+        params = command['params']
+        if command['command'] == 'dropTip' and index + 1 < len(commands) and commands[index + 1]['command'] == 'pickUpTip' \
+                and commands[index + 1]['params']['pipette'] == params['pipette']:
+            next_aspirate = next((next_command for next_command in commands[index + 2:] if next_command['params'].get('pipette') == params['pipette']
+                                  and next_command['command'] in ['aspirate', 'dispense', 'dropTip']), None)
+            tip_liquid = tip_liquids.get(params['pipette'])
+            if next_aspirate is None or next_aspirate['command'] != 'aspirate' or not tip_liquid:
+                kept_reasons['the new tip does not aspirate first, or the old tip held nothing'] += 1
+            else:
+                next_liquid = contents.get(well_key(next_aspirate), frozenset([well_key(next_aspirate)]))
+                if tip_liquid == next_liquid:
+                    dropped_count += 1
+                    index += 2 # keep the tip
+                    continue
+                kept_reasons['the new tip aspirates another liquid' if tip_liquid.isdisjoint(next_liquid)
+                             else 'the old tip also touched another liquid'] += 1
+        if command['command'] == 'pickUpTip':
+            tip_liquids[params['pipette']] = frozenset()
+        elif command['command'] in ['aspirate', 'airGap']:
+            tip_liquids[params['pipette']] = tip_liquids.get(params['pipette'], frozenset()) | contents.get(well_key(command), frozenset([well_key(command)]))
+        elif command['command'] in ['dispense', 'blowout', 'touchTip']:
+            # The tip touches whatever is already in the well, and leaves its own liquid there
+            tip_liquid = tip_liquids.get(params['pipette'], frozenset()) | contents.get(well_key(command), frozenset())
+            tip_liquids[params['pipette']] = tip_liquid
+            if command['command'] != 'touchTip':
+                contents[well_key(command)] = contents.get(well_key(command), frozenset()) | tip_liquid
+        optimized_commands.append(command)
+        index += 1
+    notes = ['dropped {} tip changes'.format(dropped_count)] if dropped_count else []
+    return optimized_commands, notes + count_notes('kept {} tip changes'.format(sum(kept_reasons.values())), kept_reasons)
+
+
+def parse_transfer(commands, index):
+    # (mix commands, aspirate, dispense, blow out or None, next index) for a simple transfer starting at index, else None
+    mix_end = mix_group_end(commands, index)
+    if mix_end + 1 >= len(commands):
+        return None
+    aspirate, dispense = commands[mix_end], commands[mix_end + 1]
+    if aspirate['command'] != 'aspirate' or dispense['command'] != 'dispense' \
+            or aspirate['params']['pipette'] != dispense['params']['pipette'] \
+            or aspirate['params']['volume'] != dispense['params']['volume'] or well_key(aspirate) == well_key(dispense):
+        return None
+    if mix_end > index and well_key(commands[index]) != well_key(aspirate):
+        return None # mixed somewhere else first
+    next_index = mix_end + 2
+    blowout = None
+    if next_index < len(commands) and commands[next_index]['command'] == 'blowout' \
+            and commands[next_index]['params']['pipette'] == aspirate['params']['pipette']:
+        blowout = commands[next_index]
+        next_index += 1
+    return commands[index:mix_end], aspirate, dispense, blowout, next_index
+
+
+def merge_blockers(transfer, next_transfer, chain_volume, max_volume, disposal_volume):
+    # Reasons next_transfer (same pipette and source well) can't join the chain started by transfer; empty if it can
+    next_aspirate = next_transfer[1]
+    blockers = []
+    merged_disposal = disposal_volume if transfer[3] is not None else 0.0
+    if chain_volume + next_aspirate['params']['volume'] + merged_disposal > max_volume + 1e-9:
+        blockers.append('the draws together would overfill the {:g} uL tip'.format(max_volume))
+    if next_transfer[0]:
+        blockers.append('it mixes the source before its own draw')
+    if (next_transfer[3] is None) != (transfer[3] is None):
+        blockers.append('only one of the transfers blows out')
+    elif transfer[3] is not None and not disposal_volume:
+        blockers.append('it blows out after its dispense and there is no disposal volume')
+    if next_aspirate['params'].get('offsetFromBottomMm') != transfer[1]['params'].get('offsetFromBottomMm') \
+            or next_aspirate['params'].get('flowRate') != transfer[1]['params'].get('flowRate'):
+        blockers.append('it aspirates at another height or flow rate')
+    return blockers
+
+
+def merge_multi_dispenses(pd_protocol, commands, max_volumes=None, disposal_volume=0.0):
+    # disposal_volume is added to merged aspirations that end in a blow out and blown back into the source well; it
+    # stands in for the blow outs after the merged dispenses, so transfers with blow outs only merge when it is set
+    if max_volumes is None:
+        max_volumes = pipette_max_volumes(pd_protocol)
+    optimized_commands = []
+    merged_counts = [0, 0] # transfers merged, multi-dispenses made
+    replaced_blowouts = 0
+    unmerged_count = 0
+    unmerged_reasons = collections.Counter()
+    index = 0
+    while index < len(commands):
+        transfer = parse_transfer(commands, index)
+        if transfer is None:
+            optimized_commands.append(commands[index])
+            index += 1
+            continue
+        chain = [transfer]
+        aspirate = transfer[1]
+        max_volume = max_volumes[aspirate['params']['pipette']]
+        chain_volume = aspirate['params']['volume']
+        index = transfer[4]
+        while index < len(commands):
+            next_transfer = parse_transfer(commands, index)
+            if next_transfer is None:
+                break
+            next_aspirate = next_transfer[1]
+            if next_aspirate['params']['pipette'] != aspirate['params']['pipette'] or well_key(next_aspirate) != well_key(aspirate):
+                break
+            blockers = merge_blockers(transfer, next_transfer, chain_volume, max_volume, disposal_volume)
+            if blockers:
+                unmerged_count += 1
+                unmerged_reasons.update(blockers)
+                break
+            chain.append(next_transfer)
+            chain_volume += next_aspirate['params']['volume']
+            index = next_transfer[4]
+
+        if len(chain) == 1:
+            mix_commands, aspirate, dispense, blowout, next_index = transfer
+            optimized_commands.extend(mix_commands + [aspirate, dispense] + ([blowout] if blowout is not None else []))
+            continue
+        merged_disposal = disposal_volume if transfer[3] is not None else 0.0
+        merged_aspirate = copy.deepcopy(aspirate)
+        merged_aspirate['params']['volume'] = chain_volume + merged_disposal
+        optimized_commands.extend(transfer[0] + [merged_aspirate] + [chain_transfer[2] for chain_transfer in chain])
+        merged_counts[0] += len(chain)
+        merged_counts[1] += 1
+        if transfer[3] is not None:
+            blowout = copy.deepcopy(chain[-1][3])
+            blowout['params']['labware'], blowout['params']['well'] = well_key(aspirate)
+            optimized_commands.append(blowout)
+            replaced_blowouts += len(chain)
+    notes = []
+    if merged_counts[1]:
+        notes.append('merged {} transfers into {} multi-dispenses'.format(*merged_counts))
+    if replaced_blowouts:
+        notes.append('replaced {} blow outs after merged dispenses with a {:g} uL disposal volume blown out in the source'.format(
+            replaced_blowouts, disposal_volume))
+    return optimized_commands, notes + count_notes('{} transfers from the same source as the one before left unmerged'.format(
+        unmerged_count), unmerged_reasons)
+
+
+def drop_repeat_mixes(pd_protocol, commands, max_volumes=None, disposal_volume=0.0):
+    last_mixes = {} # pipette -> well its current tip last mixed
+    optimized_commands = []
+    dropped_mixes = 0
+    index = 0
+    while index < len(commands):
+        command = commands[index]
+        pipette = command['params'].get('pipette')
+        mix_end = mix_group_end(commands, index)
+        if mix_end > index:
+            if last_mixes.get(pipette) != well_key(command):
+                optimized_commands.extend(commands[index:mix_end])
+                last_mixes[pipette] = well_key(command)
+            else:
+                dropped_mixes += 1
+            index = mix_end
+            continue
+        if command['command'] in ['pickUpTip', 'dropTip']:
+            last_mixes.pop(pipette, None)
+        elif command['command'] in ['dispense', 'blowout']:
+            # Something new in the well: the next mix there is needed again, whichever pipette does it
+            for mixed_pipette, mixed_well in list(last_mixes.items()):
+                if mixed_well == well_key(command):
+                    del last_mixes[mixed_pipette]
+        optimized_commands.append(command)
+        index += 1
+    notes = ['dropped {} mixes in wells the tip had already mixed, pre-wetting mixes included'.format(dropped_mixes)] if dropped_mixes else []
+    return optimized_commands, notes
+
+
+optimization_passes = {
+    'tip_changes': drop_redundant_tip_changes,
+    'multi_dispense': merge_multi_dispenses,
+    'repeat_mixes': drop_repeat_mixes
+}
+
+
+def optimize_commands(pd_protocol, passes=None, max_volumes=None, disposal_volume=0.0):
+    # Returns the optimized commands and a list of (pass name, commands after the pass, pass notes) for reporting
+    if passes is None:
+        passes = default_passes
+    commands = pd_protocol['commands']
+    pass_results = [('original', commands, [])]
+    for pass_name in passes:
+        if pass_name not in optimization_passes:
+            raise ValueError('Unknown optimization pass "{}"; passes are {}'.format(pass_name, ', '.join(optimization_passes)))
+        commands, notes = optimization_passes[pass_name](pd_protocol, commands, max_volumes, disposal_volume)
+        pass_results.append((pass_name, commands, notes))
+    return commands, pass_results
+
+
+def well_position(pd_protocol, labware_id, well_name):
+    # Deck x, y of a well from the slot and the labware definition in the file
+    labware = pd_protocol['labware'][labware_id]
+    slot = int(labware['slot'])
+    well = pd_protocol['labwareDefinitions'][labware['definitionId']]['wells'][well_name]
+    return ((slot - 1) % 3 * slot_pitch[0] + well['x'], (slot - 1) // 3 * slot_pitch[1] + well['y'])
+
+
+def estimate_time(pd_protocol, commands):
+    # (estimated seconds, number of moves between wells) for a command stream
+    seconds = 0.0
+    moves = 0
+    positions = {} # pipette -> (labware, well, x, y, height)
+    for command in commands:
+        params = command['params']
+        if command['command'] == 'delay':
+            seconds += params['wait'] if params['wait'] is not True else 0.0
+            continue
+        if command['command'] == 'moveToSlot':
+            positions.pop(params['pipette'], None)
+            continue
+        if command['command'] in module_commands:
+            continue
+        seconds += command_times.get(command['command'], 0.0)
+        if command['command'] in ['aspirate', 'dispense', 'airGap']:
+            seconds += params['volume'] / params['flowRate']
+        x, y = well_position(pd_protocol, params['labware'], params['well'])
+        position = positions.get(params['pipette'])
+        if position is None or position[:2] != (params['labware'], params['well']):
+            if position is not None:
+                seconds += math.hypot(x - position[2], y - position[3]) / gantry_speed
+            seconds += z_travel_time
+            moves += 1
+        elif position[4] != params.get('offsetFromBottomMm'):
+            seconds += z_move_time
+        positions[params['pipette']] = (params['labware'], params['well'], x, y, params.get('offsetFromBottomMm'))
+    return seconds, moves
+
+
+def optimization_report(pd_protocol, pass_results):
+    report_lines = []
+    original_seconds, original_moves = estimate_time(pd_protocol, pass_results[0][1])
+    for pass_name, commands, notes in pass_results:
+        seconds, moves = estimate_time(pd_protocol, commands)
+        report_lines.append('{:>15}: {:5d} commands, {:5d} moves, ~{:5.1f} min'.format(pass_name, len(commands), moves, seconds / 60))
+        if pass_name != 'original' and not notes:
+            notes = ['nothing to change']
+        report_lines.extend('{:>15}  {}'.format('', note) for note in notes)
+    final_commands = pass_results[-1][1]
+    final_seconds, final_moves = estimate_time(pd_protocol, final_commands)
+    report_lines.append('Saved {} of {} commands ({:.0%}), {} moves and ~{:.1f} min ({:.0%})'.format(
+        len(pass_results[0][1]) - len(final_commands), len(pass_results[0][1]),
+        1 - len(final_commands) / max(len(pass_results[0][1]), 1), original_moves - final_moves,
+        (original_seconds - final_seconds) / 60, 1 - final_seconds / max(original_seconds, 1e-9)))
+    return report_lines
+
+
+def load_pd_deck(protocol, pd_protocol):
+    # Loads the file's modules, labware and pipettes; returns (labware id -> wells_by_name, pipette id -> pipette,
+    # module id -> module)
+    modules = {module_id: protocol.load_module(module['model'], module['slot']) for module_id, module in pd_protocol.get('modules', {}).items()}
+    labware_wells = {}
+    for labware_id, labware in pd_protocol['labware'].items():
+        definition = pd_protocol['labwareDefinitions'][labware['definitionId']]
+        if definition['parameters']['loadName'] == 'opentrons_1_trash_1100ml_fixed':
+            labware_wells[labware_id] = protocol.fixed_trash.wells_by_name()
+        elif labware['slot'] in modules:
+            labware_wells[labware_id] = modules[labware['slot']].load_labware_from_definition(definition, label = labware.get('displayName')).wells_by_name()
+        else:
+            labware_wells[labware_id] = protocol.load_labware_from_definition(definition, labware['slot'], label = labware.get('displayName')).wells_by_name()
+    pipettes = {pipette_id: protocol.load_instrument(pipette['name'], pipette['mount']) for pipette_id, pipette in pd_protocol['pipettes'].items()}
+    return labware_wells, pipettes, modules
+
+
+def well_location(well, params):
+    # Location of a well command: height above the well bottom, plus the optional x/y offset from the well center
+    return well.bottom(params['offsetFromBottomMm']).move(types.Point(params.get('xOffsetMm', 0), params.get('yOffsetMm', 0), 0))
+
+
+def run_pd_commands(protocol, pd_protocol, commands, labware_wells, pipettes, modules=None):
+    for command in commands:
+        params = command['params']
+        if command['command'] == 'delay':
+            if params['wait'] is True:
+                protocol.pause(params.get('message', ''))
+            elif params['wait'] == 0 and params.get('message'):
+                protocol.comment(params['message'])
+            else:
+                protocol.delay(seconds = params['wait'], msg = params.get('message'))
+            continue
+        if command['command'] in module_commands:
+            module = modules[params['module']]
+            if command['command'] == 'magneticModule/engageMagnet':
+                module.engage(height = params['engageHeight'])
+            elif command['command'] == 'magneticModule/disengageMagnet':
+                module.disengage()
+            elif command['command'] == 'temperatureModule/setTargetTemperature':
+                module.start_set_temperature(params['temperature'])
+            elif command['command'] == 'temperatureModule/awaitTemperature':
+                module.await_temperature(params['temperature'])
+            else:
+                module.deactivate()
+            continue
+        pipette = pipettes[params['pipette']]
+        if command['command'] == 'moveToSlot':
+            offset = params.get('offset', {})
+            pipette.move_to(protocol.deck.position_for(params['slot']).move(types.Point(offset.get('x', 0), offset.get('y', 0), offset.get('z', 0))),
+                            force_direct = params.get('forceDirect', False), minimum_z_height = params.get('minimumZHeight'), speed = params.get('speed'))
+            continue
+        well = labware_wells[params['labware']][params['well']]
+        if command['command'] == 'pickUpTip':
+            pipette.pick_up_tip(well)
+        elif command['command'] == 'dropTip':
+            pipette.drop_tip(well)
+        elif command['command'] in ['aspirate', 'airGap']:
+            pipette.flow_rate.aspirate = params['flowRate']
+            pipette.aspirate(params['volume'], well_location(well, params))
+        elif command['command'] == 'dispense':
+            pipette.flow_rate.dispense = params['flowRate']
+            pipette.dispense(params['volume'], well_location(well, params))
+        elif command['command'] == 'blowout':
+            pipette.flow_rate.blow_out = params['flowRate']
+            pipette.blow_out(well_location(well, params))
+        elif command['command'] == 'touchTip':
+            well_depth = well.top().point.z - well.bottom().point.z
+            pipette.touch_tip(well, radius = params.get('radius', 1.0), v_offset = params['offsetFromBottomMm'] - well_depth, speed = params.get('speed', 60.0))
+
+
+def run_pd_protocol(protocol, pd_json_path, passes=None, disposal_volume=0.0, labware_store=None):
+    # For use inside run(protocol): load, optimize, comment the report and run. passes=[] replays the file as it is.
+    pd_protocol = load_pd_protocol(pd_json_path, labware_store)
+    commands, pass_results = optimize_commands(pd_protocol, passes, disposal_volume = disposal_volume)
+    if len(pass_results) > 1:
+        for report_line in optimization_report(pd_protocol, pass_results):
+            protocol.comment(report_line)
+    labware_wells, pipettes, modules = load_pd_deck(protocol, pd_protocol)
+    run_pd_commands(protocol, pd_protocol, commands, labware_wells, pipettes, modules)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Optimize a Protocol Designer (schema 3) JSON protocol')
+    parser.add_argument('pd_json_path')
+    parser.add_argument('--passes', nargs='+', default=default_passes, choices=list(optimization_passes),
+                        help='passes to run in order (default: tip_changes multi_dispense; repeat_mixes also drops pre-wetting mixes)')
+    parser.add_argument('--disposal-volume', type=float, default=0.0)
+    parser.add_argument('--output', help='write the optimized protocol as a schema-3 JSON file')
+    parser.add_argument('--store', help='labware store directory for packed protocols (default: labware_store next to this script)')
+    args = parser.parse_args()
+
+    loaded_protocol = load_pd_protocol(args.pd_json_path, LabwareStore(args.store) if args.store else None)
+    optimized_commands, optimization_results = optimize_commands(loaded_protocol, args.passes, disposal_volume = args.disposal_volume)
+    for report_line in optimization_report(loaded_protocol, optimization_results):
+        print(report_line)
+    if args.output:
+        write_pd_protocol(loaded_protocol, optimized_commands, args.output)
+        print('Optimized protocol written to {}'.format(args.output))
@@ -0,0 +1,412 @@
+# Script name: protocol_compiler.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python protocol_compiler.py compile multidispense_384w_qPCR_setup_v2.py --set rna_plate_count=4 --labware-dir custom_labware
+# Command line = python protocol_compiler.py diff compiled_protocols\first.json compiled_protocols\second.json
+# Compiles a Python protocol into a Protocol Designer schema-3 JSON protocol with a flat command list, by running it once
+# in the Opentrons simulator and recording every atomic command (aspirate, dispense, blow out, tips, moves, delays,
+# module commands). Composite commands (transfer, distribute, mix, ...) are recorded as the atomic commands they run.
+# Compiled files are cached in compiled_protocols (labware definitions packed into the labware store, see
+# labware_store.py) under a key made from the script, every helper module it imports from this folder, the parameters,
+# the contents of every file a setting names (worklist_path, deck_config_path, ...) and the Opentrons version, so a
+# stored run is only compiled again when one of those changes, including a worklist edited in place. Replay a compiled run with
+# pd_json_protocol.run_pd_protocol(protocol, path, passes = []), and diff two runs command by command with "diff".
+# Parameters are module-level settings of the script (e.g. rna_plate_count, worklist_path), set before run() is called.
+# Schema 3 has no field for x/y offsets inside a well, move speeds or touch tip radius/speed; those are written as the
+# optional params pd_json_protocol.py reads (xOffsetMm, yOffsetMm, speed, radius), which the Opentrons app ignores.
+
+import argparse
+import ast
+import difflib
+import hashlib
+import json
+import os
+import time
+
+import opentrons
+from opentrons import simulate
+from opentrons.commands import types as command_types
+
+from labware_store import LabwareStore, pack_protocol
+from mock_protocol import load_script, parse_parameters, read_labware_dirs
+from pd_json_protocol import load_pd_protocol
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_cache_dir = os.path.join(script_dir, 'compiled_protocols')
+module_models = {'magneticModuleV1': 'magneticModule', 'magneticModuleV2': 'magneticModule',
+                 'temperatureModuleV1': 'temperatureModule', 'temperatureModuleV2': 'temperatureModule'}
+
+
+def local_imports(script_path, seen=None):
+    # Helper modules from this folder that a script imports, directly or through another helper (sorted paths)
+    if seen is None:
+        seen = set()
+    with open(script_path, 'r', encoding='utf-8') as script_file:
+        tree = ast.parse(script_file.read(), script_path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            module_names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            module_names = [node.module]
+        else:
+            continue
+        for module_name in module_names:
+            module_path = os.path.join(os.path.dirname(os.path.abspath(script_path)), module_name.split('.')[0] + '.py')
+            if os.path.exists(module_path) and module_path not in seen:
+                seen.add(module_path)
+                local_imports(module_path, seen)
+    return sorted(seen)
+
+
+def script_settings(script_path):
+    # Module-level settings of a script that have a literal value (the defaults parameters override)
+    with open(script_path, 'r', encoding='utf-8') as script_file:
+        tree = ast.parse(script_file.read(), script_path)
+    settings = {}
+    for node in tree.body:
+        if not isinstance(node, ast.Assign):
+            continue
+        try:
+            value = ast.literal_eval(node.value)
+        except (ValueError, TypeError, SyntaxError):
+            continue
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                settings[target.id] = value
+    return settings
+
+
+def input_files(script_path, parameters=None):
+    # Existing files named by a setting once the parameters are applied, e.g. a worklist or sample sheet (sorted paths)
+    settings = script_settings(script_path)
+    settings.update(parameters or {})
+    return sorted({os.path.abspath(value) for value in settings.values() if isinstance(value, str) and os.path.isfile(value)})
+
+
+def compile_key(script_path, parameters=None, extra_labware=None):
+    key_hash = hashlib.sha256()
+    for source_path in [script_path] + local_imports(script_path):
+        with open(source_path, 'rb') as source_file:
+            key_hash.update(os.path.basename(source_path).encode('utf-8') + b'\0' + source_file.read() + b'\0')
+    key_hash.update(json.dumps(parameters or {}, sort_keys=True, default=str).encode('utf-8'))
+    for input_path in input_files(script_path, parameters):
+        key_hash.update(input_path.encode('utf-8') + b'\0')
+        with open(input_path, 'rb') as input_file:
+            for block in iter(lambda: input_file.read(1 << 20), b''):
+                key_hash.update(block)
+        key_hash.update(b'\0')
+    key_hash.update(json.dumps(extra_labware or {}, sort_keys=True).encode('utf-8'))
+    key_hash.update(opentrons.__version__.encode('utf-8'))
+    return key_hash.hexdigest()[:16]
+
+
+class CommandRecorder:
+    # Records a simulated run as schema-3 commands. Atomic liquid handling commands come from the protocol's command
+    # broker; move_to, touch_tip and module calls are recorded by wrapping them, since their broker messages don't
+    # carry the arguments schema 3 needs.
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.commands = []
+        self.labware = {} # labware id -> labware
+        self.labware_ids = {} # id(labware) -> labware id
+        self.pipette_ids = {} # id(instrument) -> pipette id
+        self.pipettes = {}
+        self.modules = {} # module id -> module
+        self.module_ids = {} # id(module) -> module id
+        self.labware_modules = {} # id(labware) -> module id
+        self.wrap_protocol()
+        self.unsubscribe = protocol.broker.subscribe('command', self.record_message)
+
+    def wrap_protocol(self):
+        load_instrument = self.protocol.load_instrument
+        load_module = self.protocol.load_module
+
+        def recorded_load_instrument(*args, **kwargs):
+            instrument = load_instrument(*args, **kwargs)
+            self.add_pipette(instrument)
+            return instrument
+
+        def recorded_load_module(*args, **kwargs):
+            module = load_module(*args, **kwargs)
+            self.add_module(module)
+            return module
+
+        self.protocol.load_instrument = recorded_load_instrument
+        self.protocol.load_module = recorded_load_module
+
+    def add_pipette(self, instrument):
+        pipette_id = '{}:{}'.format(instrument.mount, instrument.name)
+        self.pipette_ids[id(instrument)] = pipette_id
+        self.pipettes[pipette_id] = instrument
+        move_to, touch_tip = instrument.move_to, instrument.touch_tip
+
+        def recorded_move_to(location, force_direct=False, minimum_z_height=None, speed=None, publish=True):
+            result = move_to(location, force_direct=force_direct, minimum_z_height=minimum_z_height, speed=speed, publish=publish)
+            slot = self.location_slot(location)
+            offset = location.point - self.protocol.deck.position_for(slot).point
+            params = {'pipette': pipette_id, 'slot': slot, 'offset': {'x': round(offset.x, 3), 'y': round(offset.y, 3), 'z': round(offset.z, 3)}}
+            if force_direct:
+                params['forceDirect'] = True
+            if minimum_z_height is not None:
+                params['minimumZHeight'] = minimum_z_height
+            if speed is not None:
+                params['speed'] = speed
+            self.commands.append({'command': 'moveToSlot', 'params': params})
+            return result
+
+        def recorded_touch_tip(location=None, radius=1.0, v_offset=-1.0, speed=60.0):
+            result = touch_tip(location, radius=radius, v_offset=v_offset, speed=speed)
+            well = location if location is not None else self.protocol.location_cache.labware.as_well()
+            params = self.well_params(pipette_id, well, well.top(v_offset))
+            params.update({'radius': radius, 'speed': speed})
+            self.commands.append({'command': 'touchTip', 'params': params})
+            return result
+
+        instrument.move_to, instrument.touch_tip = recorded_move_to, recorded_touch_tip
+
+    def add_module(self, module):
+        model = module.model.value if hasattr(module.model, 'value') else str(module.model)
+        if model not in module_models:
+            raise ValueError('{} modules can not be compiled to schema 3'.format(model))
+        module_id = '{}:{}'.format(module.parent, model)
+        self.modules[module_id] = module
+        self.module_ids[id(module)] = module_id
+        for load_name in ['load_labware', 'load_labware_from_definition']:
+            self.wrap_module_loader(module, module_id, load_name)
+
+        def record(command, **params):
+            params['module'] = module_id
+            self.commands.append({'command': command, 'params': params})
+
+        if module_models[model] == 'magneticModule':
+            engage, disengage = module.engage, module.disengage
+
+            def recorded_engage(height=None, offset=None, height_from_base=None):
+                if height is None:
+                    raise ValueError('Only magnetic module engage(height) can be compiled to schema 3')
+                engage(height=height)
+                record('magneticModule/engageMagnet', engageHeight=height)
+
+            def recorded_disengage():
+                disengage()
+                record('magneticModule/disengageMagnet')
+
+            module.engage, module.disengage = recorded_engage, recorded_disengage
+        else:
+            set_temperature, start_set_temperature = module.set_temperature, module.start_set_temperature
+            await_temperature, deactivate = module.await_temperature, module.deactivate
+
+            def recorded_set_temperature(celsius):
+                set_temperature(celsius)
+                record('temperatureModule/setTargetTemperature', temperature=celsius)
+                record('temperatureModule/awaitTemperature', temperature=celsius)
+
+            def recorded_start_set_temperature(celsius):
+                start_set_temperature(celsius)
+                record('temperatureModule/setTargetTemperature', temperature=celsius)
+
+            def recorded_await_temperature(celsius):
+                await_temperature(celsius)
+                record('temperatureModule/awaitTemperature', temperature=celsius)
+
+            def recorded_deactivate():
+                deactivate()
+                record('temperatureModule/deactivate')
+
+            module.set_temperature, module.start_set_temperature = recorded_set_temperature, recorded_start_set_temperature
+            module.await_temperature, module.deactivate = recorded_await_temperature, recorded_deactivate
+
+    def wrap_module_loader(self, module, module_id, load_name):
+        loader = getattr(module, load_name)
+
+        def recorded_loader(*args, **kwargs):
+            labware = loader(*args, **kwargs)
+            self.labware_modules[id(labware)] = module_id
+            return labware
+
+        setattr(module, load_name, recorded_loader)
+
+    def labware_id(self, labware):
+        if id(labware) not in self.labware_ids:
+            if labware.load_name == 'opentrons_1_trash_1100ml_fixed':
+                labware_id = 'trashId'
+            else:
+                labware_id = '{}:{}'.format(self.labware_modules.get(id(labware), labware.parent), labware.uri)
+            self.labware_ids[id(labware)] = labware_id
+            self.labware[labware_id] = labware
+        return self.labware_ids[id(labware)]
+
+    def location_slot(self, location):
+        # Deck slot a location is measured from: its labware's slot (or its module's), else slot 1
+        labware = location.labware
+        if labware.is_well:
+            labware = labware.as_well().parent
+        elif labware.is_labware:
+            labware = labware.as_labware()
+        else:
+            return '1'
+        module_id = self.labware_modules.get(id(labware))
+        return str(self.modules[module_id].parent if module_id is not None else labware.parent)
+
+    def well_params(self, pipette_id, well, location=None):
+        params = {'pipette': pipette_id, 'labware': self.labware_id(well.parent), 'well': well.well_name}
+        if location is not None:
+            offset = location.point - well.bottom().point
+            center = well.center().point
+            params['offsetFromBottomMm'] = round(offset.z, 3)
+            if abs(location.point.x - center.x) > 1e-6:
+                params['xOffsetMm'] = round(location.point.x - center.x, 3)
+            if abs(location.point.y - center.y) > 1e-6:
+                params['yOffsetMm'] = round(location.point.y - center.y, 3)
+        return params
+
+    def location_well(self, location, command_name):
+        if hasattr(location, 'well_name'):
+            return location, None
+        if location is None or not location.labware.is_well:
+            raise ValueError('Can not compile {} at {}: schema 3 commands need a well'.format(command_name, location))
+        return location.labware.as_well(), location
+
+    def record_message(self, message):
+        if message['$'] != 'after':
+            return
+        name, payload = message['name'], message['payload']
+        if name == command_types.COMMENT:
+            self.commands.append({'command': 'delay', 'params': {'wait': 0, 'message': payload['text']}})
+        elif name == command_types.DELAY:
+            self.commands.append({'command': 'delay', 'params': {'wait': round(payload['minutes'] * 60 + payload['seconds'], 3),
+                                                                 'message': payload['text'].partition('seconds. ')[2]}})
+        elif name == command_types.PAUSE:
+            self.commands.append({'command': 'delay', 'params': {'wait': True, 'message': payload.get('userMessage') or ''}})
+        elif name in [command_types.ASPIRATE, command_types.DISPENSE, command_types.BLOW_OUT,
+                      command_types.PICK_UP_TIP, command_types.DROP_TIP]:
+            instrument = payload['instrument']
+            pipette_id = self.pipette_ids.get(id(instrument))
+            if pipette_id is None:
+                self.add_pipette(instrument)
+                pipette_id = self.pipette_ids[id(instrument)]
+            well, location = self.location_well(payload['location'], name)
+            if name in [command_types.PICK_UP_TIP, command_types.DROP_TIP]:
+                command = 'pickUpTip' if name == command_types.PICK_UP_TIP else 'dropTip'
+                self.commands.append({'command': command, 'params': self.well_params(pipette_id, well)})
+                return
+            params = self.well_params(pipette_id, well, location)
+            if name == command_types.BLOW_OUT:
+                command = 'blowout'
+                params['flowRate'] = instrument.flow_rate.blow_out
+            else:
+                command = 'aspirate' if name == command_types.ASPIRATE else 'dispense'
+                params['volume'] = payload['volume']
+                flow_rate = instrument.flow_rate.aspirate if command == 'aspirate' else instrument.flow_rate.dispense
+                params['flowRate'] = round(flow_rate * payload.get('rate', 1.0), 3)
+            self.commands.append({'command': command, 'params': params})
+
+    def pd_protocol(self, script_path, metadata, parameters, key):
+        self.unsubscribe()
+        for labware in list(self.protocol.loaded_labwares.values()) + [module.labware for module in self.modules.values() if module.labware]:
+            self.labware_id(labware)
+        labware = {}
+        labware_definitions = {}
+        for labware_id, loaded_labware in self.labware.items():
+            slot = self.labware_modules.get(id(loaded_labware), str(loaded_labware.parent))
+            definition = loaded_labware._core.get_definition()
+            # name is the label, or the load name if there is no label; the Opentrons log shows the display name then
+            display_name = loaded_labware.name if loaded_labware.name != loaded_labware.load_name else definition['metadata']['displayName']
+            labware[labware_id] = {'slot': slot, 'displayName': display_name, 'definitionId': loaded_labware.uri}
+            labware_definitions[loaded_labware.uri] = definition
+        return {
+            'metadata': {'protocolName': metadata.get('protocolName', os.path.basename(script_path)),
+                         'author': metadata.get('author', ''), 'description': metadata.get('description', ''),
+                         'created': int(time.time() * 1000), 'lastModified': None, 'category': None, 'subcategory': None, 'tags': []},
+            'designerApplication': {'name': 'protocol_compiler', 'version': '1',
+                                    'data': {'script': os.path.basename(script_path), 'parameters': parameters, 'key': key}},
+            'robot': {'model': 'OT-2 Standard'},
+            'pipettes': {pipette_id: {'mount': pipette.mount, 'name': pipette.name} for pipette_id, pipette in self.pipettes.items()},
+            'modules': {module_id: {'slot': str(module.parent), 'model': module_id.split(':')[1]} for module_id, module in self.modules.items()},
+            'labware': labware,
+            'labwareDefinitions': labware_definitions,
+            'schemaVersion': 3,
+            'commands': self.commands
+        }
+
+
+def compile_protocol(script_path, parameters=None, labware_dirs=None):
+    # Runs the script once in the simulator; returns the schema-3 protocol (labware definitions embedded)
+    parameters = parameters or {}
+    extra_labware = read_labware_dirs(labware_dirs)
+    script = load_script(script_path, parameters)
+    metadata = getattr(script, 'metadata', {})
+    protocol = simulate.get_protocol_api(metadata.get('apiLevel', '2.8'), extra_labware = extra_labware)
+    recorder = CommandRecorder(protocol)
+    script.run(protocol)
+    return recorder.pd_protocol(script_path, metadata, parameters, compile_key(script_path, parameters, extra_labware))
+
+
+def compiled_protocol(script_path, parameters=None, labware_dirs=None, cache_dir=None, labware_store=None):
+    # Path of the cached compiled run for this script, parameters and labware, compiling it first if needed.
+    # Returns (path, True if it came from the cache)
+    if cache_dir is None:
+        cache_dir = default_cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    key = compile_key(script_path, parameters, read_labware_dirs(labware_dirs))
+    compiled_path = os.path.join(cache_dir, '{}_{}.json'.format(os.path.splitext(os.path.basename(script_path))[0], key))
+    if os.path.exists(compiled_path):
+        return compiled_path, True
+    packed_protocol = pack_protocol(compile_protocol(script_path, parameters, labware_dirs), labware_store if labware_store is not None else LabwareStore())
+    temporary_path = '{}.{}.tmp'.format(compiled_path, os.getpid())
+    with open(temporary_path, 'w') as compiled_file:
+        json.dump(packed_protocol, compiled_file, separators=(',', ':'))
+    os.replace(temporary_path, compiled_path)
+    return compiled_path, False
+
+
+def command_line(command, pd_protocol):
+    # One readable line per command for diffs (labware by slot, pipette by mount)
+    params = command['params']
+    fields = [command['command']]
+    if 'pipette' in params:
+        fields.append(pd_protocol['pipettes'][params['pipette']]['mount'])
+    if 'module' in params:
+        fields.append(params['module'])
+    if 'volume' in params:
+        fields.append('{:g} uL'.format(params['volume']))
+    if 'labware' in params:
+        fields.append('{} {}'.format(pd_protocol['labware'][params['labware']]['slot'], params['well']))
+    for name in ['offsetFromBottomMm', 'xOffsetMm', 'yOffsetMm', 'flowRate', 'slot', 'offset', 'forceDirect', 'minimumZHeight', 'speed',
+                 'radius', 'engageHeight', 'temperature', 'wait', 'message']:
+        if name in params:
+            fields.append('{}={}'.format(name, params[name]))
+    return ' '.join(str(field) for field in fields)
+
+
+def diff_protocols(first_protocol, second_protocol, first_name='first', second_name='second'):
+    return list(difflib.unified_diff([command_line(command, first_protocol) for command in first_protocol['commands']],
+                                     [command_line(command, second_protocol) for command in second_protocol['commands']],
+                                     first_name, second_name, lineterm=''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile Python protocols to schema-3 JSON command streams')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    compile_parser = subparsers.add_parser('compile')
+    compile_parser.add_argument('script_path')
+    compile_parser.add_argument('--set', nargs='*', default=[], metavar='NAME=VALUE', help='module-level settings of the script')
+    compile_parser.add_argument('--labware-dir', nargs='*', default=[], help='custom labware definition folders')
+    compile_parser.add_argument('--cache', default=default_cache_dir)
+    diff_parser = subparsers.add_parser('diff')
+    diff_parser.add_argument('first_path')
+    diff_parser.add_argument('second_path')
+    args = parser.parse_args()
+
+    if args.action == 'compile':
+        start_time = time.perf_counter()
+        compiled_path, from_cache = compiled_protocol(args.script_path, parse_parameters(args.set), args.labware_dir, args.cache)
+        compiled_commands = load_pd_protocol(compiled_path)['commands']
+        print('{} ({} commands, {} in {:.2f} s)'.format(compiled_path, len(compiled_commands),
+                                                        'cached' if from_cache else 'compiled', time.perf_counter() - start_time))
+    else:
+        diff_lines = diff_protocols(load_pd_protocol(args.first_path), load_pd_protocol(args.second_path), args.first_path, args.second_path)
+        for diff_line in diff_lines:
+            print(diff_line)
+        if not diff_lines:
+            print('No differences in {} commands'.format(len(load_pd_protocol(args.first_path)['commands'])))
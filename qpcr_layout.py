@@ -0,0 +1,154 @@
+# Script name: qpcr_layout.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python qpcr_layout.py sample_sheet.csv --assays "Assay 1" "Assay 2" --replicates 2 --output plate_layout.csv
+# Compiles a qPCR sample sheet into a 384-well plate layout and the 8-channel RNA commands that build it.
+# Sample sheet columns (CSV): Sample, Type (Sample, Standard or NTC), Source Plate (RNA plate 1-4), Source Well, and an
+# optional Replicates column that overrides the default replicate count for that sample.
+# The p20 8-channel moves a whole RNA plate column at a time, so the layout is built from 8-channel "shots" (one 384
+# column, tips on the A or B rows). Every used RNA column gets assays x replicates shots, allocated in order of RNA
+# column, then RNA plate, then assay, then replicate, filling each 384 column's A-rows shot before its B-rows shot.
+# With 2 RNA plates, 1 assay and 2 replicates this is the Q1/Q3 (plate 1) and Q2/Q4 (plate 2) layout of
+# multidispense_384w_qPCR_setup_v2.py. Each RNA column is then aspirated once for as many of its shots as the p20 holds.
+
+import argparse
+import csv
+import math
+
+rows_96, columns_96 = 8, 12
+rows_384, columns_384 = 16, 24
+sample_types = ['Sample', 'Standard', 'NTC']
+
+
+def well_index_96(well_name):
+    # labware.wells() index of a 96-well plate well name ('A1' -> 0, 'B1' -> 1, 'A2' -> 8)
+    row = well_name[0].upper()
+    if row not in 'ABCDEFGH' or not well_name[1:].isdigit() or not 1 <= int(well_name[1:]) <= columns_96:
+        raise ValueError('"{}" is not a 96-well plate well'.format(well_name))
+    return (int(well_name[1:]) - 1) * rows_96 + 'ABCDEFGH'.index(row)
+
+
+def well_name_384(well_index):
+    return '{}{}'.format('ABCDEFGHIJKLMNOP'[well_index % rows_384], well_index // rows_384 + 1)
+
+
+def read_sample_sheet(sample_sheet_path):
+    # Validated sample sheet rows; raises a ValueError naming the sheet line for the first bad row
+    samples = []
+    used_source_wells = set()
+    with open(sample_sheet_path, 'r', newline='') as sample_sheet_file:
+        for line_number, row in enumerate(csv.DictReader(sample_sheet_file), start=2):
+            try:
+                sample_type = row.get('Type', '').strip() or 'Sample'
+                if sample_type not in sample_types:
+                    raise ValueError('Type must be one of {}'.format(', '.join(sample_types)))
+                source_plate = int(row['Source Plate'])
+                if not 1 <= source_plate <= 4:
+                    raise ValueError('Source Plate must be 1-4')
+                source_index = well_index_96(row['Source Well'].strip())
+                replicates = row.get('Replicates', '').strip()
+                replicates = int(replicates) if replicates else None
+                if replicates is not None and replicates < 1:
+                    raise ValueError('Replicates must be at least 1')
+            except (KeyError, TypeError, ValueError) as error:
+                raise ValueError('Sample sheet line {}: {}'.format(line_number, error))
+            if (source_plate, source_index) in used_source_wells:
+                raise ValueError('Sample sheet line {}: plate {} well {} is listed twice'.format(
+                    line_number, source_plate, row['Source Well'].strip()))
+            used_source_wells.add((source_plate, source_index))
+            samples.append({'Sample': row['Sample'].strip(), 'Type': sample_type, 'Source Plate': source_plate,
+                            'Source Index': source_index, 'Replicates': replicates})
+    return samples
+
+
+def compile_layout(samples, assays, default_replicates, transfer_volume, max_volume):
+    # Returns {'Wells': [...], 'RNA Aspirations': [...], 'Mastermix Wells': {assay: [384 indexes]}, ...}.
+    # Wells: one dictionary per filled 384 well (for the qPCR instrument plate map).
+    # RNA Aspirations: one dictionary per p20 aspiration: RNA plate, row A index of the RNA column, and the row A/B
+    # 384 index of every shot it dispenses to.
+    if not assays:
+        raise ValueError('At least one assay is needed')
+    dispenses_per_aspiration = int(math.floor(max_volume / transfer_volume + 1e-9))
+    if dispenses_per_aspiration < 1:
+        raise ValueError('A {} ul RNA transfer does not fit in a {} ul pipette'.format(transfer_volume, max_volume))
+
+    # Samples grouped by RNA column; a column runs as many replicates as its most replicated sample
+    samples_by_column = {}
+    for sample in samples:
+        column_key = (sample['Source Index'] // rows_96, sample['Source Plate'])
+        samples_by_column.setdefault(column_key, []).append(sample)
+
+    shot_count = sum(len(assays) * max(sample['Replicates'] or default_replicates for sample in column_samples)
+                     for column_samples in samples_by_column.values())
+    if shot_count > 2 * columns_384:
+        raise ValueError('The layout needs {} 8-channel columns but a 384-well plate only has {}'.format(shot_count, 2 * columns_384))
+
+    wells = []
+    rna_aspirations = []
+    mastermix_wells = {assay: [] for assay in assays}
+    next_shot = 0
+    for source_column, source_plate in sorted(samples_by_column):
+        column_samples = samples_by_column[(source_column, source_plate)]
+        replicates = max(sample['Replicates'] or default_replicates for sample in column_samples)
+        column_shots = []
+        for assay in assays:
+            for replicate in range(1, replicates + 1):
+                shot_index = (next_shot // 2) * rows_384 + next_shot % 2 # Row A/B well of the shot's 384 column
+                next_shot += 1
+                column_shots.append(shot_index)
+                mastermix_wells[assay].extend(range(shot_index, shot_index + rows_384 - 1, 2))
+                for sample in column_samples:
+                    sample_replicates = sample['Replicates'] or default_replicates
+                    if replicate > sample_replicates:
+                        continue # This sample has fewer replicates than its column; the well gets RNA but isn't reported
+                    well_index = shot_index + 2 * (sample['Source Index'] % rows_96)
+                    wells.append({'Well': well_name_384(well_index), 'Well Index': well_index, 'Sample': sample['Sample'],
+                                  'Type': sample['Type'], 'Assay': assay, 'Replicate': replicate,
+                                  'Source Plate': source_plate, 'Source Index': sample['Source Index']})
+
+        # One aspiration per column for all of its shots, split only when the p20 can't hold them
+        for first_shot in range(0, len(column_shots), dispenses_per_aspiration):
+            rna_aspirations.append({'Source Plate': source_plate, 'Source Index': source_column * rows_96,
+                                    'Destination Indexes': column_shots[first_shot:first_shot + dispenses_per_aspiration]})
+
+    wells.sort(key=lambda well: well['Well Index'])
+    return {'Wells': wells, 'RNA Aspirations': rna_aspirations, 'Mastermix Wells': mastermix_wells,
+            'Assays': list(assays), 'Shots': next_shot}
+
+
+def layout_report(layout):
+    sample_counts = {sample_type: len(set((well['Source Plate'], well['Source Index']) for well in layout['Wells']
+                                          if well['Type'] == sample_type)) for sample_type in sample_types}
+    shot_dispenses = sum(len(aspiration['Destination Indexes']) for aspiration in layout['RNA Aspirations'])
+    return ['qPCR layout: {} samples, {} standards, {} NTCs x {} assay(s) -> {} wells in {} of 48 8-channel columns'.format(
+                sample_counts['Sample'], sample_counts['Standard'], sample_counts['NTC'], len(layout['Assays']),
+                len(layout['Wells']), layout['Shots']),
+            'RNA: {} tips for {} dispenses ({} saved by multi-dispensing replicates)'.format(
+                len(layout['RNA Aspirations']), shot_dispenses, shot_dispenses - len(layout['RNA Aspirations']))]
+
+
+def write_layout(layout, layout_path):
+    # Plate map CSV for the qPCR instrument software
+    with open(layout_path, 'w', newline='') as layout_file:
+        csv_writer = csv.writer(layout_file)
+        csv_writer.writerow(['Well', 'Sample', 'Type', 'Assay', 'Replicate', 'Source Plate', 'Source Well'])
+        for well in layout['Wells']:
+            csv_writer.writerow([well['Well'], well['Sample'], well['Type'], well['Assay'], well['Replicate'],
+                                 well['Source Plate'], '{}{}'.format('ABCDEFGH'[well['Source Index'] % rows_96],
+                                                                     well['Source Index'] // rows_96 + 1)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile a qPCR sample sheet into a 384-well plate layout')
+    parser.add_argument('sample_sheet_path')
+    parser.add_argument('--assays', nargs='+', default=['Assay 1'])
+    parser.add_argument('--replicates', type=int, default=2)
+    parser.add_argument('--transfer-volume', type=float, default=5)
+    parser.add_argument('--max-volume', type=float, default=20)
+    parser.add_argument('--output', default='plate_layout.csv')
+    args = parser.parse_args()
+
+    compiled_layout = compile_layout(read_sample_sheet(args.sample_sheet_path), args.assays, args.replicates,
+                                     args.transfer_volume, args.max_volume)
+    write_layout(compiled_layout, args.output)
+    for report_line in layout_report(compiled_layout):
+        print(report_line)
@@ -0,0 +1,88 @@
+# Script name: quadrant_mapping.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# 96 -> 384 well quadrant maps for qPCR setups with 1-4 source plates.
+# A 384-well plate is 4 interleaved 96-well grids (quadrants), numbered the same way as the qPCR scripts:
+#   Q1 = A1, C1, ... (row offset 0, column offset 0)    Q2 = A2, C2, ... (row offset 0, column offset 1)
+#   Q3 = B1, D1, ... (row offset 1, column offset 0)    Q4 = B2, D2, ... (row offset 1, column offset 1)
+# Each source plate is assigned one or more quadrants (more than one = replicates). The maps are NumPy arrays of well
+# indexes in labware.wells() order (column by column: 8 per column on a 96-well plate, 16 on a 384-well plate), so they
+# plug straight into well_index() lookups. With an 8-channel head, a source column starts at row A and the 8 tips land
+# on every other row of a 384 column, starting at row A (Q1/Q2) or row B (Q3/Q4).
+
+import numpy as np
+
+quadrant_offsets = {1: (0, 0), 2: (0, 1), 3: (1, 0), 4: (1, 1)} # quadrant -> (row offset, column offset)
+rows_96, columns_96 = 8, 12
+rows_384, columns_384 = 16, 24
+
+# Default quadrants per source plate for each plate count; 1 or 2 plates fill the 384 plate with replicates
+default_quadrant_assignments = {
+    1: {1: [1, 2, 3, 4]},
+    2: {1: [1, 3], 2: [2, 4]}, # RNA plate 1 -> Q1/Q3, RNA plate 2 -> Q2/Q4, same as multidispense_384w_qPCR_setup_v2.py
+    3: {1: [1], 2: [2], 3: [3]},
+    4: {1: [1], 2: [2], 3: [3], 4: [4]}
+}
+
+
+def default_quadrant_assignment(plate_count):
+    if plate_count not in default_quadrant_assignments:
+        raise ValueError('A 384-well plate takes 1-4 source 96-well plates, got {}'.format(plate_count))
+    return default_quadrant_assignments[plate_count]
+
+
+def quadrant_indexes(quadrant, source_indexes):
+    # 384-well indexes for 96-well source indexes placed in one quadrant
+    row_offset, column_offset = quadrant_offsets[quadrant]
+    source_rows = source_indexes % rows_96
+    source_columns = source_indexes // rows_96
+    return (2 * source_columns + column_offset) * rows_384 + 2 * source_rows + row_offset
+
+
+def quadrant_map(quadrant_assignment, channels=1):
+    # List of (plate number, source indexes, destination indexes) per source plate.
+    # source indexes: every well (single channel) or the row A well of every column (8-channel) of the 96-well plate.
+    # destination indexes: array of shape (sources, replicates) - one column per quadrant, in assignment order.
+    if channels == 1:
+        source_indexes = np.arange(rows_96 * columns_96)
+    elif channels == 8:
+        source_indexes = np.arange(columns_96) * rows_96
+    else:
+        raise ValueError('Quadrant maps are for single- or 8-channel heads, got {} channels'.format(channels))
+
+    plate_maps = []
+    for plate_number, quadrants in quadrant_assignment.items():
+        for quadrant in quadrants:
+            if quadrant not in quadrant_offsets:
+                raise ValueError('Plate {} is assigned to quadrant {}; quadrants are 1-4'.format(plate_number, quadrant))
+        destination_indexes = np.column_stack([quadrant_indexes(quadrant, source_indexes) for quadrant in quadrants])
+        plate_maps.append((plate_number, source_indexes, destination_indexes))
+    check_collisions(plate_maps, channels)
+    return plate_maps
+
+
+def channel_indexes(destination_indexes, channels):
+    # Every 384 well the tips touch: an 8-channel at row A/B of a 384 column covers every other row below it
+    if channels == 1:
+        return destination_indexes.ravel()
+    return (destination_indexes.reshape(-1, 1) + 2 * np.arange(channels)).ravel()
+
+
+def mapped_well_indexes(plate_maps, channels=1):
+    # Sorted 384 well indexes that get a sample from any plate in the map
+    return np.unique(np.concatenate([channel_indexes(indexes, channels) for plate_number, source_indexes, indexes in plate_maps]))
+
+
+def check_collisions(plate_maps, channels=1):
+    # Raise a ValueError if any 384 well would get more than one sample
+    destination_indexes = np.concatenate([channel_indexes(indexes, channels) for plate_number, source_indexes, indexes in plate_maps])
+    well_indexes, counts = np.unique(destination_indexes, return_counts=True)
+    if (well_indexes < 0).any() or (well_indexes >= rows_384 * columns_384).any():
+        raise ValueError('Quadrant map runs off the 384-well plate')
+    collisions = well_indexes[counts > 1]
+    if len(collisions):
+        raise ValueError('Quadrant map puts more than one sample in {} well(s), e.g. {}'.format(
+            len(collisions), ', '.join(well_name_384(index) for index in collisions[:8])))
+
+
+def well_name_384(well_index):
+    return '{}{}'.format('ABCDEFGHIJKLMNOP'[int(well_index) % rows_384], int(well_index) // rows_384 + 1)
@@ -0,0 +1,137 @@
+# Script name: simulation_farm.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python simulation_farm.py BLP_part1_vFinal_12132022.py --sweep "starting_sample_volume=[20,30,40,48,60]" --output sweep.csv
+# Command line = python simulation_farm.py multidispense_cherrypick_VTT_05082023.py --sweep "worklist_path=worklists/*.csv"
+# Command line = python simulation_farm.py multidispense_384w_qPCR_setup_v2.py --sweep "rxn_volume=[10,12.5,15,20]" "rna_plate_count=[1,2,3,4]"
+# Runs many variants of one or more protocols on the mock ProtocolContext (mock_protocol.py) in parallel, one variant per
+# task on a pool of worker processes, and collects one row per variant: tips, atomic commands, aspirated volume,
+# delays, estimated run time (mock_protocol's time model) and the error that stopped the run, if any. Errors are the
+# script's own checks (e.g. a worklist or layout that doesn't fit) and the mock's pipette checks (no tip, more than the
+# tip holds, out of tips).
+# Sweeps are module-level settings of the scripts; every combination of the --sweep values is run. Sweep values are a
+# JSON list, a glob pattern (*, ? or [ in it, e.g. a folder of worklists) or comma-separated values read like --set.
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import glob
+import io
+import itertools
+import json
+import os
+import time
+
+from mock_protocol import parse_parameters, read_labware_dirs, run_mock_protocol, trace_metrics
+
+metric_columns = ['Tips', 'Commands', 'Aspirated uL', 'Delay min', 'Estimated min']
+worker_labware = {} # custom labware definitions of this worker process, set once by the pool initializer
+
+
+def sweep_values(sweep):
+    # 'name=values' -> (name, [values])
+    name, separator, values = sweep.partition('=')
+    if not separator:
+        raise ValueError('"{}" is not name=values'.format(sweep))
+    if values.startswith('['):
+        return name, json.loads(values)
+    if any(character in values for character in '*?['):
+        matched_paths = sorted(glob.glob(values))
+        if not matched_paths:
+            raise ValueError('No files match {} for {}'.format(values, name))
+        return name, matched_paths
+    return name, [parse_parameters(['{}={}'.format(name, value)])[name] for value in values.split(',')]
+
+
+def sweep_variants(sweeps, fixed_parameters=None):
+    # One parameter dictionary per combination of sweep values, on top of the fixed parameters
+    names = [name for name, values in sweeps]
+    variants = []
+    for combination in itertools.product(*[values for name, values in sweeps]):
+        parameters = dict(fixed_parameters or {})
+        parameters.update(zip(names, combination))
+        variants.append(parameters)
+    return variants
+
+
+def set_worker_labware(extra_labware):
+    worker_labware.clear()
+    worker_labware.update(extra_labware)
+
+
+def simulate_variant(variant):
+    # (script path, parameters) -> result row; runs in a worker process
+    script_path, parameters = variant
+    result = {'Script': os.path.basename(script_path), 'Parameters': parameters, 'Error': ''}
+    start_time = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()): # the scripts print their plans
+            mock_protocol = run_mock_protocol(script_path, parameters, worker_labware)
+        result.update(trace_metrics(mock_protocol.trace))
+    except Exception as error:
+        result['Error'] = '{}: {}'.format(type(error).__name__, ' / '.join(str(error).splitlines()))
+    result['Run ms'] = (time.perf_counter() - start_time) * 1000
+    return result
+
+
+def run_farm(variants, extra_labware=None, processes=None):
+    # Result rows in the order of variants. processes=1 runs everything in this process.
+    if processes == 1:
+        set_worker_labware(extra_labware or {})
+        return [simulate_variant(variant) for variant in variants]
+    worker_count = processes or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=worker_count, initializer=set_worker_labware,
+                                                initargs=(extra_labware or {},)) as executor:
+        # A few chunks per worker: fewer round trips than one variant per task, still balanced when run times differ
+        return list(executor.map(simulate_variant, variants, chunksize=max(1, len(variants) // (worker_count * 4))))
+
+
+def parameter_text(parameters):
+    return ' '.join('{}={}'.format(name, value) for name, value in parameters.items())
+
+
+def farm_report(results):
+    report_lines = ['{:<42} {:<40} {:>6} {:>8} {:>12} {:>9} {:>9}  {}'.format(
+        'Script', 'Parameters', 'Tips', 'Commands', 'Aspirated uL', 'Delay min', 'Est. min', 'Error')]
+    for result in results:
+        if result['Error']:
+            report_lines.append('{:<42} {:<40} {:>6} {:>8} {:>12} {:>9} {:>9}  {}'.format(
+                result['Script'], parameter_text(result['Parameters']), '-', '-', '-', '-', '-', result['Error']))
+        else:
+            report_lines.append('{:<42} {:<40} {:>6} {:>8} {:>12.1f} {:>9.1f} {:>9.1f}'.format(
+                result['Script'], parameter_text(result['Parameters']), result['Tips'], result['Commands'],
+                result['Aspirated uL'], result['Delay min'], result['Estimated min']))
+    failed_count = sum(1 for result in results if result['Error'])
+    report_lines.append('{} variants: {} ran, {} failed'.format(len(results), len(results) - failed_count, failed_count))
+    return report_lines
+
+
+def write_results(results, results_path):
+    with open(results_path, 'w', newline='') as results_file:
+        csv_writer = csv.writer(results_file)
+        csv_writer.writerow(['Script', 'Parameters'] + metric_columns + ['Error', 'Run ms'])
+        for result in results:
+            csv_writer.writerow([result['Script'], json.dumps(result['Parameters'])] +
+                                [round(result[column], 3) if column in result else '' for column in metric_columns] +
+                                [result['Error'], round(result['Run ms'], 1)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate many variants of protocols in parallel on the mock ProtocolContext')
+    parser.add_argument('script_paths', nargs='+')
+    parser.add_argument('--sweep', nargs='*', default=[], metavar='NAME=VALUES', help='module-level setting and the values to run it with')
+    parser.add_argument('--set', nargs='*', default=[], metavar='NAME=VALUE', help='module-level settings for every variant')
+    parser.add_argument('--labware-dir', nargs='*', default=[], help='custom labware definition folders')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: one per CPU core)')
+    parser.add_argument('--output', help='write the results table to this CSV file')
+    args = parser.parse_args()
+
+    parameter_variants = sweep_variants([sweep_values(sweep) for sweep in args.sweep], parse_parameters(args.set))
+    farm_variants = [(script_path, parameters) for script_path in args.script_paths for parameters in parameter_variants]
+    start_time = time.perf_counter()
+    farm_results = run_farm(farm_variants, read_labware_dirs(args.labware_dir), args.processes)
+    for report_line in farm_report(farm_results):
+        print(report_line)
+    print('Simulated in {:.2f} s ({:.0f} ms of runs)'.format(time.perf_counter() - start_time, sum(result['Run ms'] for result in farm_results)))
+    if args.output:
+        write_results(farm_results, args.output)
@@ -0,0 +1,222 @@
+# Script name: temperature_program.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python temperature_program.py BLP_part1_vFinal_12132022.py BLP_part2_vFinal_12132022.py BLP_part3_vFinal_12132022.py
+# Command line (refit the ramp model) = python temperature_program.py BLP_part1_vFinal_12132022.py --fit tempdeck_readings.csv
+# Non-blocking temperature programs for the Temperature Module GEN2.
+# set_temperature() blocks the whole run until the block reaches the setpoint. TemperatureProgram starts a ramp with
+# start_set_temperature() and only waits (await_temperature()) where a step needs the setpoint, so the ramp runs
+# while the pipettes work. hold() waits for the setpoint and then starts the hold's delay, so a hold timer always
+# starts when the block is actually at temperature, however early its ramp was started.
+# Run as a script, it runs protocols on the mock ProtocolContext (mock_protocol.py) and replays their temperature
+# commands against the ramp model below: how long each ramp takes, how much of it was hidden behind other work, how
+# much the run waited for it and how much was still going when the run ended.
+
+import argparse
+import csv
+
+ambient_temperature = 23.0
+
+# Ramp model: (low, high, heating, cooling) in °C and °C/min. Approximate GEN2 rates with the 96-well aluminum block;
+# cooling slows down below ambient, where the Peltier works against the room. Refit on your module with --fit.
+ramp_rate_table = [
+    (4.0, 15.0, 3.0, 1.0),
+    (15.0, 25.0, 4.0, 2.0),
+    (25.0, 50.0, 6.0, 3.5),
+    (50.0, 95.0, 5.0, 4.5)
+]
+fit_margin = 1.0 # °C from the setpoint where the module slows down to settle; readings closer than this aren't fitted
+
+TEMPDECK_SET_TEMP, TEMPDECK_AWAIT_TEMP, TEMPDECK_DEACTIVATE = 'command.TEMPDECK_SET_TEMP', 'command.TEMPDECK_AWAIT_TEMP', 'command.TEMPDECK_DEACTIVATE'
+
+
+def check_setpoint(celsius, rate_table):
+    if not rate_table[0][0] <= celsius <= rate_table[-1][1]:
+        raise ValueError('{} °C is outside the {}-{} °C range of the ramp model'.format(celsius, rate_table[0][0], rate_table[-1][1]))
+
+
+def ramp_seconds(start_celsius, target_celsius, rate_table=None):
+    # Modeled time for the block to go from start_celsius to target_celsius
+    rate_table = rate_table or ramp_rate_table
+    check_setpoint(target_celsius, rate_table)
+    low_celsius, high_celsius = sorted([start_celsius, target_celsius])
+    seconds = 0.0
+    for band_low, band_high, heating_rate, cooling_rate in rate_table:
+        overlap = min(high_celsius, band_high) - max(low_celsius, band_low)
+        if overlap > 0:
+            seconds += overlap / (heating_rate if target_celsius > start_celsius else cooling_rate) * 60
+    return seconds
+
+
+def ramp_temperature(start_celsius, target_celsius, seconds, rate_table=None):
+    # Modeled block temperature the given seconds into a ramp
+    rate_table = rate_table or ramp_rate_table
+    heating = target_celsius > start_celsius
+    bands = rate_table if heating else list(reversed(rate_table))
+    celsius = start_celsius
+    for band_low, band_high, heating_rate, cooling_rate in bands:
+        if heating and band_high > celsius:
+            band_end = min(band_high, target_celsius)
+        elif not heating and band_low < celsius:
+            band_end = max(band_low, target_celsius)
+        else:
+            continue
+        band_seconds = abs(band_end - celsius) / (heating_rate if heating else cooling_rate) * 60
+        if seconds < band_seconds:
+            return celsius + (band_end - celsius) * seconds / band_seconds
+        seconds -= band_seconds
+        celsius = band_end
+        if celsius == target_celsius:
+            break
+    return target_celsius
+
+
+def read_readings(readings_path):
+    # Logged module readings, a CSV with seconds, temperature and target columns
+    with open(readings_path, 'r', newline='') as readings_file:
+        return [(float(row['seconds']), float(row['temperature']), float(row['target'])) for row in csv.DictReader(readings_file)]
+
+
+def fit_ramp_rates(readings, rate_table=None):
+    # Ramp rate table refitted from (seconds, temperature, target) readings: the average rate in each band, heating and
+    # cooling apart. Bands the readings don't cover keep their current rates.
+    rate_table = rate_table or ramp_rate_table
+    degrees = {}
+    minutes = {}
+    for (start_seconds, start_celsius, target), (end_seconds, end_celsius, end_target) in zip(readings, readings[1:]):
+        if end_target != target or end_seconds <= start_seconds or abs(target - end_celsius) < fit_margin:
+            continue
+        if (end_celsius - start_celsius) * (target - start_celsius) <= 0:
+            continue # not moving toward the setpoint
+        middle_celsius = (start_celsius + end_celsius) / 2
+        for band_index, (band_low, band_high, heating_rate, cooling_rate) in enumerate(rate_table):
+            if band_low <= middle_celsius <= band_high:
+                band_key = (band_index, end_celsius > start_celsius)
+                degrees[band_key] = degrees.get(band_key, 0.0) + abs(end_celsius - start_celsius)
+                minutes[band_key] = minutes.get(band_key, 0.0) + (end_seconds - start_seconds) / 60
+                break
+    fitted_table = []
+    for band_index, (band_low, band_high, heating_rate, cooling_rate) in enumerate(rate_table):
+        if (band_index, True) in degrees:
+            heating_rate = round(degrees[(band_index, True)] / minutes[(band_index, True)], 2)
+        if (band_index, False) in degrees:
+            cooling_rate = round(degrees[(band_index, False)] / minutes[(band_index, False)], 2)
+        fitted_table.append((band_low, band_high, heating_rate, cooling_rate))
+    return fitted_table
+
+
+class TemperatureProgram:
+    def __init__(self, protocol, temperature_module):
+        self.protocol = protocol
+        self.temperature_module = temperature_module
+        self.target = None
+
+    def start(self, celsius):
+        # Start ramping to celsius and carry on; nothing waits for it until await_setpoint() or hold()
+        if celsius != self.target:
+            self.temperature_module.start_set_temperature(celsius)
+            self.target = celsius
+
+    def await_setpoint(self):
+        if self.target is None:
+            raise ValueError('No temperature has been set yet')
+        self.temperature_module.await_temperature(self.target)
+
+    def hold(self, celsius, minutes=0, seconds=0, msg=''):
+        # Hold at celsius for the given time, counted from when the block reaches celsius
+        self.start(celsius)
+        self.await_setpoint()
+        self.protocol.delay(seconds=seconds, minutes=minutes, msg=msg)
+
+
+def ramp_timeline(trace, segment_seconds, rate_table=None):
+    # Replays a mock run's temperature commands on the ramp model. segment_seconds(commands) estimates how long a
+    # stretch of other commands takes (mock_protocol.trace_duration). Returns (run seconds, one dict per ramp).
+    rate_table = rate_table or ramp_rate_table
+    run_seconds = 0.0
+    block_celsius = ambient_temperature
+    open_ramp = None
+    ramps = []
+    segment = []
+
+    def block_temperature():
+        if open_ramp is None:
+            return block_celsius
+        return ramp_temperature(open_ramp['from'], open_ramp['to'], run_seconds - open_ramp['start'], rate_table)
+
+    def close_ramp(hidden_seconds):
+        open_ramp['hidden'] = hidden_seconds
+        ramps.append(open_ramp)
+
+    def replace_ramp():
+        # A new setpoint cuts the open ramp short; the time it ran was hidden behind the work in between
+        close_ramp(min(open_ramp['ramp'], run_seconds - open_ramp['start']))
+
+    for command in trace:
+        if command['name'] not in (TEMPDECK_SET_TEMP, TEMPDECK_AWAIT_TEMP, TEMPDECK_DEACTIVATE):
+            segment.append(command)
+            continue
+        run_seconds += segment_seconds(segment)
+        segment = []
+        if command['name'] == TEMPDECK_SET_TEMP:
+            start_celsius = block_temperature()
+            if open_ramp is not None:
+                replace_ramp()
+            target_celsius = command['payload']['celsius']
+            open_ramp = {'from': start_celsius, 'to': target_celsius, 'start': run_seconds,
+                         'ramp': ramp_seconds(start_celsius, target_celsius, rate_table), 'waited': 0.0, 'after_run': 0.0}
+            if command['payload'].get('blocking'):
+                open_ramp['waited'] = open_ramp['ramp']
+                run_seconds += open_ramp['ramp']
+                close_ramp(0.0)
+                block_celsius = target_celsius
+                open_ramp = None
+        elif command['name'] == TEMPDECK_AWAIT_TEMP and open_ramp is not None:
+            open_ramp['waited'] = max(0.0, open_ramp['start'] + open_ramp['ramp'] - run_seconds)
+            run_seconds += open_ramp['waited']
+            close_ramp(open_ramp['ramp'] - open_ramp['waited'])
+            block_celsius = open_ramp['to']
+            open_ramp = None
+        elif command['name'] == TEMPDECK_DEACTIVATE:
+            block_celsius = block_temperature()
+            if open_ramp is not None:
+                replace_ramp()
+            open_ramp = None
+    run_seconds += segment_seconds(segment)
+    if open_ramp is not None:
+        # Still ramping when the run ends; the module keeps going to its setpoint
+        replace_ramp()
+        open_ramp['after_run'] = open_ramp['ramp'] - open_ramp['hidden']
+    return run_seconds, ramps
+
+
+def ramp_report(script_path, run_seconds, ramps):
+    report_lines = [script_path]
+    for ramp in ramps:
+        report_lines.append('  {:>5.1f} -> {:>5.1f} °C at {:>5.1f} min: {:>5.1f} min ramp, {:>5.1f} hidden, {:>5.1f} waited, {:>5.1f} after the run'.format(
+            ramp['from'], ramp['to'], ramp['start'] / 60, ramp['ramp'] / 60, ramp['hidden'] / 60, ramp['waited'] / 60,
+            ramp['after_run'] / 60))
+    report_lines.append('  {:.1f} min of ramps: {:.1f} min hidden behind other work, {:.1f} min waited, {:.1f} min after the run; run ~{:.1f} min'.format(
+        sum(ramp['ramp'] for ramp in ramps) / 60, sum(ramp['hidden'] for ramp in ramps) / 60,
+        sum(ramp['waited'] for ramp in ramps) / 60, sum(ramp['after_run'] for ramp in ramps) / 60, run_seconds / 60))
+    return report_lines
+
+
+if __name__ == '__main__':
+    from mock_protocol import read_labware_dirs, run_mock_protocol, trace_duration
+
+    parser = argparse.ArgumentParser(description='Replay the temperature ramps of protocols on the GEN2 ramp model')
+    parser.add_argument('script_paths', nargs='+')
+    parser.add_argument('--labware-dir', nargs='*', default=[], help='custom labware definition folders')
+    parser.add_argument('--fit', help='refit the ramp model from a CSV of module readings (seconds, temperature, target)')
+    args = parser.parse_args()
+
+    model_table = ramp_rate_table
+    if args.fit:
+        model_table = fit_ramp_rates(read_readings(args.fit))
+        for fitted_band in model_table:
+            print('{:>5.1f}-{:>5.1f} °C: heating {:.2f} °C/min, cooling {:.2f} °C/min'.format(*fitted_band))
+    extra_definitions = read_labware_dirs(args.labware_dir)
+    for protocol_path in args.script_paths:
+        mock_run = run_mock_protocol(protocol_path, extra_labware=extra_definitions)
+        for report_line in ramp_report(protocol_path, *ramp_timeline(mock_run.trace, trace_duration, model_table)):
+            print(report_line)
@@ -0,0 +1,175 @@
+# Script name: trace_regression.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python trace_regression.py record BLP_part1_vFinal_12132022.py multidispense_cherrypick_VTT_05082023.py
+# Command line = python trace_regression.py check BLP_part1_vFinal_12132022.py
+# Command line = python trace_regression.py compare barcoded_library_prep_part1_v2.3.py BLP_part1_vFinal_12132022.py
+# Command-trace regression checks between protocol revisions, on the mock ProtocolContext (mock_protocol.py).
+# "record" runs each script and saves a golden file: the parameters, the normalized command trace, the count of each
+# command and the run metrics (commands, tips, aspirated volume, delays, estimated minutes). Goldens are
+# trace_goldens/<script>.json, or <script>__<settings>__<hash>.json when --set is given, so every parameter set keeps its own.
+# "check" runs each script again with the parameters stored in its golden files (every golden of the script, or the one
+# for the --set values) and compares; "compare" compares any two scripts or golden files, e.g. two revisions of a
+# protocol. Both print the metric changes and a diff of the traces, and exit with 1 when commands, tips or estimated
+# time went up by more than --tolerance percent (volume changes are usually intended).
+# Traces are normalized so float noise doesn't show up as a change: numbers are rounded to 2 decimals.
+
+import argparse
+import collections
+import difflib
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+
+from mock_protocol import composite_commands, parse_parameters, read_labware_dirs, run_mock_protocol, trace_lines, trace_metrics
+
+default_golden_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trace_goldens')
+regression_metrics = ['Commands', 'Tips', 'Estimated min'] # a rise in any of these fails a check; volume changes are reported only
+float_pattern = re.compile(r'-?\d+\.\d+')
+
+
+def normalize_line(line):
+    return float_pattern.sub(lambda match: '{:.2f}'.format(float(match.group())), line.rstrip())
+
+
+def record_trace(script_path, parameters=None, extra_labware=None):
+    # Golden record of one mock run
+    mock_protocol = run_mock_protocol(script_path, parameters, extra_labware)
+    command_counts = collections.Counter(command['name'] for command in mock_protocol.trace if command['name'] not in composite_commands)
+    return {'script': os.path.basename(script_path),
+            'parameters': parameters or {},
+            'metrics': trace_metrics(mock_protocol.trace),
+            'command_counts': dict(sorted(command_counts.items())),
+            'trace': [normalize_line(line) for line in trace_lines(mock_protocol.trace)]}
+
+
+def golden_path(script_path, golden_dir, parameters=None):
+    # trace_goldens/<script>.json, or <script>__<name=value,...>__<hash>.json for a run with parameters. The hash keeps
+    # parameter sets apart whose readable part comes out the same (long values are cut short).
+    script_name = os.path.splitext(os.path.basename(script_path))[0]
+    if not parameters:
+        return os.path.join(golden_dir, script_name + '.json')
+    parameters_json = json.dumps(parameters, sort_keys=True)
+    settings_name = re.sub(r'[^A-Za-z0-9_.=,-]+', '-', ','.join('{}={}'.format(name, json.dumps(value)) for name, value in sorted(parameters.items())))
+    return os.path.join(golden_dir, '{}__{}__{}.json'.format(
+        script_name, settings_name.strip('-')[:60], hashlib.sha256(parameters_json.encode('utf-8')).hexdigest()[:8]))
+
+
+def script_golden_paths(script_path, golden_dir):
+    # Every golden file recorded for a script, whatever its parameters
+    script_name = os.path.splitext(os.path.basename(script_path))[0]
+    return sorted(glob.glob(os.path.join(glob.escape(golden_dir), glob.escape(script_name) + '.json')) +
+                  glob.glob(os.path.join(glob.escape(golden_dir), glob.escape(script_name) + '__*.json')))
+
+
+def save_golden(record, golden_file_path):
+    os.makedirs(os.path.dirname(os.path.abspath(golden_file_path)), exist_ok=True)
+    with open(golden_file_path, 'w', encoding='utf-8') as golden_file:
+        json.dump(record, golden_file, indent=1)
+
+
+def load_golden(golden_file_path):
+    if not os.path.exists(golden_file_path):
+        raise ValueError('No golden trace at {} (run "record" first)'.format(golden_file_path))
+    with open(golden_file_path, 'r', encoding='utf-8') as golden_file:
+        return json.load(golden_file)
+
+
+def load_record(path, parameters=None, extra_labware=None):
+    # A golden .json file as is, or a fresh record of a .py script
+    if path.endswith('.json'):
+        return load_golden(path)
+    return record_trace(path, parameters, extra_labware)
+
+
+def metric_changes(old_record, new_record):
+    # [(metric, old value, new value, percent change or None)]
+    changes = []
+    for metric in new_record['metrics']:
+        old_value = old_record['metrics'].get(metric, 0)
+        new_value = new_record['metrics'][metric]
+        changes.append((metric, old_value, new_value, (new_value - old_value) / old_value * 100 if old_value else None))
+    return changes
+
+
+def regressions(old_record, new_record, tolerance=1.0):
+    # Metrics that went up by more than tolerance percent (any rise from zero counts)
+    return [metric for metric, old_value, new_value, percent in metric_changes(old_record, new_record)
+            if metric in regression_metrics and new_value > old_value and (percent is None or percent > tolerance)]
+
+
+def comparison_report(old_record, new_record, context_lines=2, max_diff_lines=200):
+    report_lines = ['{} -> {}'.format(old_record['script'], new_record['script']),
+                    '{:<15} {:>12} {:>12} {:>12} {:>9}'.format('Metric', 'Old', 'New', 'Change', '%')]
+    for metric, old_value, new_value, percent in metric_changes(old_record, new_record):
+        report_lines.append('{:<15} {:>12.1f} {:>12.1f} {:>+12.1f} {:>9}'.format(
+            metric, old_value, new_value, new_value - old_value, '-' if percent is None else '{:+.1f}'.format(percent)))
+    command_names = sorted(set(old_record['command_counts']) | set(new_record['command_counts']))
+    for command_name in command_names:
+        old_count = old_record['command_counts'].get(command_name, 0)
+        new_count = new_record['command_counts'].get(command_name, 0)
+        if old_count != new_count:
+            report_lines.append('  {:<25} {:>6} -> {:<6} ({:+d})'.format(command_name, old_count, new_count, new_count - old_count))
+    diff_lines = list(difflib.unified_diff(old_record['trace'], new_record['trace'], old_record['script'],
+                                           new_record['script'], n=context_lines, lineterm=''))
+    if not diff_lines:
+        report_lines.append('Traces are identical ({} lines)'.format(len(new_record['trace'])))
+    else:
+        changed_count = sum(1 for line in diff_lines[2:] if line[:1] in '+-')
+        report_lines.append('Traces differ: {} lines added or removed'.format(changed_count))
+        report_lines.extend(diff_lines[:max_diff_lines])
+        if len(diff_lines) > max_diff_lines:
+            report_lines.append('... {} more diff lines'.format(len(diff_lines) - max_diff_lines))
+    return report_lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record, check and compare command traces of protocol revisions')
+    parser.add_argument('action', choices=['record', 'check', 'compare'])
+    parser.add_argument('paths', nargs='+', help='scripts (record/check), or old and new script or golden .json (compare)')
+    parser.add_argument('--set', nargs='*', default=[], metavar='NAME=VALUE', help='module-level settings of the scripts')
+    parser.add_argument('--labware-dir', nargs='*', default=[], help='custom labware definition folders')
+    parser.add_argument('--golden-dir', default=default_golden_dir)
+    parser.add_argument('--tolerance', type=float, default=1.0, help='percent rise allowed before a metric counts as a regression')
+    parser.add_argument('--context', type=int, default=2, help='unchanged trace lines around each change')
+    parser.add_argument('--max-diff-lines', type=int, default=200)
+    args = parser.parse_args()
+
+    script_parameters = parse_parameters(args.set)
+    extra_definitions = read_labware_dirs(args.labware_dir)
+    failed_paths = []
+    if args.action == 'compare':
+        if len(args.paths) != 2:
+            parser.error('compare takes an old and a new script or golden file')
+        comparisons = [(args.paths[1], load_record(args.paths[0], script_parameters, extra_definitions),
+                        load_record(args.paths[1], script_parameters, extra_definitions))]
+    else:
+        comparisons = []
+        for script_path in args.paths:
+            if args.action == 'record':
+                new_trace = record_trace(script_path, script_parameters, extra_definitions)
+                save_golden(new_trace, golden_path(script_path, args.golden_dir, script_parameters))
+                print('{}: {} trace lines, {} commands, {} tips -> {}'.format(
+                    script_path, len(new_trace['trace']), new_trace['metrics']['Commands'], new_trace['metrics']['Tips'],
+                    golden_path(script_path, args.golden_dir, script_parameters)))
+                continue
+            # Rerun with the parameters each golden was recorded with, not the ones on this command line
+            if args.set:
+                golden_file_paths = [golden_path(script_path, args.golden_dir, script_parameters)]
+            else:
+                golden_file_paths = script_golden_paths(script_path, args.golden_dir) or [golden_path(script_path, args.golden_dir)]
+            for golden_file_path in golden_file_paths:
+                old_trace = load_golden(golden_file_path)
+                comparisons.append(('{} ({})'.format(script_path, os.path.basename(golden_file_path)), old_trace,
+                                    record_trace(script_path, old_trace['parameters'], extra_definitions)))
+    for compared_path, old_trace, new_trace in comparisons:
+        for report_line in comparison_report(old_trace, new_trace, args.context, args.max_diff_lines):
+            print(report_line)
+        regressed_metrics = regressions(old_trace, new_trace, args.tolerance)
+        if regressed_metrics:
+            print('REGRESSION in {}: {}'.format(compared_path, ', '.join(regressed_metrics)))
+            failed_paths.append(compared_path)
+    if failed_paths:
+        sys.exit(1)
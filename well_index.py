@@ -0,0 +1,79 @@
+# Script name: well_index.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Precomputed well coordinates shared by all protocols.
+# labware.wells() and labware.wells_by_name() rebuild a list/dict on every call, and every .top()/.bottom()/.move()
+# builds new Location objects. well_index(labware) reads each labware's well geometry once into flat NumPy arrays
+# (x, y, z-bottom, z-top, looked up by index or by well name) and caches every offset location it hands out, so hot
+# pipetting loops only do a dictionary lookup.
+
+import numpy as np
+from opentrons import types
+
+
+def well_index(labware):
+    # One WellIndex per loaded labware, shared by every caller in the protocol. The index is kept on the labware
+    # itself, so it goes away with the labware when the run ends (a module-level cache would keep every labware of
+    # every run alive, since the index holds the labware's wells).
+    index = getattr(labware, '_well_index', None)
+    if index is None:
+        index = WellIndex(labware)
+        labware._well_index = index
+    return index
+
+
+class WellIndex:
+    def __init__(self, labware):
+        self.labware = labware
+        self.wells = labware.wells() # Well order matches labware.wells(), i.e. column by column from A1
+        self.index_by_name = {well.well_name: index for index, well in enumerate(self.wells)}
+
+        bottom_points = [well.bottom().point for well in self.wells]
+        top_points = [well.top().point for well in self.wells]
+        self.x = np.array([point.x for point in bottom_points], dtype=float)
+        self.y = np.array([point.y for point in bottom_points], dtype=float)
+        self.z_bottom = np.array([point.z for point in bottom_points], dtype=float)
+        self.z_top = np.array([point.z for point in top_points], dtype=float)
+
+        self._location_cache = {}
+
+    def index(self, well):
+        # Accepts a well index or a well name ('A1')
+        if isinstance(well, str):
+            return self.index_by_name[well]
+        return well
+
+    def well(self, well):
+        return self.wells[self.index(well)]
+
+    def _location(self, well, anchor, z, x, y):
+        index = self.index(well)
+        cache_key = (index, anchor, z, x, y)
+        location = self._location_cache.get(cache_key)
+        if location is None:
+            if anchor == 'top':
+                anchor_z = self.z_top[index]
+            elif anchor == 'bottom':
+                anchor_z = self.z_bottom[index]
+            else:
+                anchor_z = (self.z_top[index] + self.z_bottom[index]) / 2
+            point = types.Point(x=float(self.x[index] + x), y=float(self.y[index] + y), z=float(anchor_z + z))
+            location = types.Location(point, self.wells[index])
+            self._location_cache[cache_key] = location
+        return location
+
+    def top(self, well, z=0.0, x=0.0, y=0.0):
+        # Same as well.top(z).move(types.Point(x=x, y=y, z=0))
+        return self._location(well, 'top', z, x, y)
+
+    def bottom(self, well, z=0.0, x=0.0, y=0.0):
+        # Same as well.bottom(z).move(types.Point(x=x, y=y, z=0))
+        return self._location(well, 'bottom', z, x, y)
+
+    def center(self, well, x=0.0, y=0.0):
+        # Same as well.center().move(types.Point(x=x, y=y, z=0))
+        return self._location(well, 'center', 0.0, x, y)
+
+    def positions(self, wells):
+        # (n, 2) array of XY well-bottom positions for a list of well indexes/names, e.g. for travel estimates
+        indexes = np.array([self.index(well) for well in wells], dtype=int)
+        return np.column_stack((self.x[indexes], self.y[indexes]))
@@ -0,0 +1,291 @@
+# Script name: worklist_validator.py
+# Directory path: cd C:\Users\Max\PycharmProjects\pythonProject\ot2_scripting
+# Command line = python worklist_validator.py worklist.csv deck_config.json --min-volume 20 --disposal-volume 50 --mix-volume 300
+# Pre-flight check for a whole cherrypick worklist, done on the same streaming pass that feeds the planner.
+# WorklistValidator.check_rows() sits between the csv reader and read_worklist()'s row checks: rows are gathered into
+# chunks of chunk_rows, every check runs on NumPy arrays of the chunk, and only the rows that pass go on. Every problem
+# is collected (not just the first one) and raised together once the last row is through. The cherrypick scripts plan
+# the whole worklist before the first transfer, so that is still before anything moves, and memory stays at one chunk
+# plus one running total per well however long the worklist is:
+#   - empty fields and plate names that aren't in the deck config
+#   - malformed well names, or wells that don't exist on that plate's labware
+#   - volumes that aren't numbers or are outside the pipette range
+#   - destination wells whose summed volume is more than the well holds (e.g. 2000 uL for the Nunc plate)
+#   - source wells that would run dry: Total Volume + disposal_volume + mix_before volume must be in the well
+# Well layouts and capacities come from the loaded labware definitions, the same max_volume liquid_ledger.py uses.
+
+import argparse
+import csv
+import re
+import time
+
+import numpy as np
+
+from cherrypick_worklist import SOURCE_PLATE, SOURCE_WELL, DESTINATION_PLATE, DESTINATION_WELL, VOLUME, WORKLIST_COLUMNS
+from cherrypick_worklist import numbered_rows, open_worklist, worklist_delimiter
+
+chunk_rows = 10000 # Rows checked together; bigger chunks are faster, smaller ones use less memory
+max_errors_per_check = 10 # Longer lists are cut short with a count, so the run log stays readable
+well_name_pattern = re.compile(r'^([A-Z])([0-9]{1,2})$')
+
+
+def labware_well_grid(labware):
+    # (rows, columns) of a loaded labware, e.g. (8, 12) for a 96 well plate
+    return len(labware.rows()), len(labware.columns())
+
+
+def labware_well_capacity(labware):
+    # Well capacity in uL from the labware definition (totalLiquidVolume of its wells)
+    return float(labware.wells()[0].max_volume)
+
+
+def chunk_columns(chunk):
+    # Each column of a chunk of (line number, csv.DictReader row) is stored as (distinct values, per-row code into
+    # them). Worklists reuse a few hundred plate/well/volume values across any number of rows, so every check below
+    # parses the distinct values once and then works on integer code arrays only.
+    columns = {}
+    for column in WORKLIST_COLUMNS:
+        value_codes = {}
+        codes = [value_codes.setdefault((row[column] or '').strip(), len(value_codes)) for _, row in chunk]
+        columns[column] = (list(value_codes), np.array(codes, dtype=np.int64))
+    columns['Line'] = np.array([line_number for line_number, _ in chunk], dtype=np.int64)
+    return columns
+
+
+def parse_volume(volume_text):
+    try:
+        return float(volume_text)
+    except ValueError:
+        return np.nan
+
+
+def parse_well_name(well_name):
+    # (row index, column index) for well names like 'A1'/'P24'; (-1, -1) when the name is malformed
+    match = well_name_pattern.match(well_name.upper())
+    if match is None or int(match.group(2)) == 0:
+        return -1, -1
+    return ord(match.group(1)) - ord('A'), int(match.group(2)) - 1
+
+
+def per_row(column, value_function, dtype=float):
+    # Apply value_function to each distinct value of a column, then spread the results over the rows
+    values, codes = column
+    return np.array([value_function(value) for value in values], dtype=dtype)[codes] if values else np.zeros(0, dtype=dtype)
+
+
+def describe_rows(message, line_numbers, line_count):
+    # One error line naming the worklist lines a check failed on (the first few of line_count)
+    shown_lines = ', '.join(str(int(line_number)) for line_number in line_numbers[:max_errors_per_check])
+    if line_count > max_errors_per_check:
+        shown_lines += ' and {} more'.format(line_count - max_errors_per_check)
+    return '{} (worklist line{} {})'.format(message, 's' if line_count > 1 else '', shown_lines)
+
+
+
+class WorklistValidator:
+    def __init__(self, plate_labware, deck_config, min_volume=0.0, max_volume=None, disposal_volume=0.0,
+                 mix_volume=0.0, raise_errors=True):
+        # plate_labware: plate name -> loaded labware for every plate in deck_config (swapped plates share theirs).
+        # deck_config is the same dictionary the cherrypick scripts give to DeckMap; a source plate entry may also
+        # carry 'fill_volume' (uL in each well at the start of the run), otherwise the well is assumed to be full.
+        # max_volume=None means no upper limit per row, since aspiration_planner splits rows bigger than one tip-full.
+        self.min_volume = min_volume
+        self.max_volume = max_volume
+        self.disposal_volume = disposal_volume
+        self.mix_volume = mix_volume
+        self.raise_errors = raise_errors
+        self.plate_names = list(plate_labware)
+        self.plate_codes = {plate_name: plate_code for plate_code, plate_name in enumerate(self.plate_names)}
+        self.grids = {plate_name: labware_well_grid(labware) for plate_name, labware in plate_labware.items()}
+        # Every well of every plate gets a code: the plate's offset + row * columns + column
+        well_counts = [self.grids[plate_name][0] * self.grids[plate_name][1] for plate_name in self.plate_names]
+        self.plate_offsets = np.concatenate([[0], np.cumsum(well_counts)]).astype(np.int64)
+        self.capacities = np.repeat([labware_well_capacity(plate_labware[plate_name]) for plate_name in self.plate_names], well_counts)
+        self.fill_volumes = np.repeat([float(deck_config[plate_name].get('fill_volume', labware_well_capacity(plate_labware[plate_name])))
+                                       for plate_name in self.plate_names], well_counts)
+        # Running totals per well code, so memory follows the wells on the deck config, not the worklist length
+        self.well_totals = {well_column: np.zeros(self.plate_offsets[-1]) for well_column in [SOURCE_WELL, DESTINATION_WELL]}
+        self.source_well_counts = np.zeros(self.plate_offsets[-1], dtype=np.int64)
+        self.failures = {} # error message -> [first worklist lines, number of lines]
+        self.source_plates = {} # Source plates of the rows that passed, in worklist order
+        self.row_count = 0
+        self.finished = False
+
+    def fail(self, message, line_numbers):
+        failure = self.failures.setdefault(message, [[], 0])
+        failure[0].extend(line_numbers[:max_errors_per_check - len(failure[0])].tolist())
+        failure[1] += len(line_numbers)
+
+    def check_rows(self, csv_rows):
+        # Pass (line number, csv.DictReader row) pairs from numbered_rows() on in worklist order, holding back the ones
+        # that fail a check. Once the last row is through, every problem found is raised in one ValueError (see
+        # check()). Later passes over the same worklist (classify_transfers() reads it twice) go straight through.
+        if self.finished:
+            for numbered_row in csv_rows:
+                yield numbered_row
+            return
+        chunk = []
+        for numbered_row in csv_rows:
+            chunk.append(numbered_row)
+            if len(chunk) == chunk_rows:
+                for good_row in self.check_chunk(chunk):
+                    yield good_row
+                chunk = []
+        for good_row in self.check_chunk(chunk):
+            yield good_row
+        self.finished = True
+        if self.raise_errors:
+            self.check()
+
+    def check_chunk(self, chunk):
+        # Check one chunk of (line number, row), add its good rows to the per-well totals and return those pairs
+        if not chunk:
+            return []
+        self.row_count += len(chunk)
+        columns = chunk_columns(chunk)
+        line_numbers = columns['Line']
+        bad_rows = np.zeros(len(chunk), dtype=bool)
+
+        # Empty fields
+        for column in WORKLIST_COLUMNS:
+            empty = per_row(columns[column], lambda value: value == '', bool)
+            if empty.any():
+                self.fail('{} is empty'.format(column), line_numbers[empty])
+            bad_rows |= empty
+
+        # Plates must be in the deck config
+        plate_codes = {}
+        for plate_column in [SOURCE_PLATE, DESTINATION_PLATE]:
+            plate_names, codes = columns[plate_column]
+            plate_codes[plate_column] = per_row(columns[plate_column], lambda value: self.plate_codes.get(value, -1), np.int64)
+            for code, plate_name in enumerate(plate_names):
+                if plate_name and plate_name not in self.plate_codes:
+                    self.fail('{} "{}" is not in the deck config'.format(plate_column, plate_name), line_numbers[codes == code])
+            bad_rows |= plate_codes[plate_column] < 0
+
+        # Well names must parse and exist on the plate's labware
+        well_codes = {}
+        for plate_column, well_column in [(SOURCE_PLATE, SOURCE_WELL), (DESTINATION_PLATE, DESTINATION_WELL)]:
+            row_indexes = per_row(columns[well_column], lambda value: parse_well_name(value)[0], np.int64)
+            column_indexes = per_row(columns[well_column], lambda value: parse_well_name(value)[1], np.int64)
+            malformed = (row_indexes < 0) & per_row(columns[well_column], lambda value: value != '', bool)
+            if malformed.any():
+                self.fail('{} is not a well name like A1'.format(well_column), line_numbers[malformed])
+            grid_rows = per_row(columns[plate_column], lambda value: self.grids[value][0] if value in self.grids else 0, np.int64)
+            grid_columns = per_row(columns[plate_column], lambda value: self.grids[value][1] if value in self.grids else 0, np.int64)
+            off_plate = (row_indexes >= 0) & (plate_codes[plate_column] >= 0) & (
+                (row_indexes >= grid_rows) | (column_indexes >= grid_columns))
+            if off_plate.any():
+                self.fail('{} is not on that plate\'s labware'.format(well_column), line_numbers[off_plate])
+            bad_rows |= (row_indexes < 0) | off_plate
+            good_wells = (row_indexes >= 0) & ~off_plate & (plate_codes[plate_column] >= 0)
+            good_plate_codes = plate_codes[plate_column][good_wells]
+            well_codes[well_column] = (self.plate_offsets[good_plate_codes] + row_indexes[good_wells] * grid_columns[good_wells]
+                                       + column_indexes[good_wells]), good_wells
+
+        # Volumes must be numbers within the pipette range
+        volumes = per_row(columns[VOLUME], parse_volume)
+        not_a_number = np.isnan(volumes) & per_row(columns[VOLUME], lambda value: value != '', bool)
+        if not_a_number.any():
+            self.fail('Volume is not a number', line_numbers[not_a_number])
+        too_small = ~np.isnan(volumes) & (volumes < max(self.min_volume, 1e-9))
+        if too_small.any():
+            self.fail('Volume is below the {} uL pipette minimum'.format(self.min_volume), line_numbers[too_small])
+        bad_rows |= np.isnan(volumes) | too_small
+        if self.max_volume is not None:
+            too_large = ~np.isnan(volumes) & (volumes > self.max_volume)
+            if too_large.any():
+                self.fail('Volume is above the {} uL pipette maximum'.format(self.max_volume), line_numbers[too_large])
+            bad_rows |= too_large
+
+        # Rows with a bad volume count as 0 uL in the per-well totals; rows with a bad plate or well are left out
+        good_volumes = np.where(np.isnan(volumes), 0.0, volumes)
+        for well_column, (codes, good_wells) in well_codes.items():
+            self.well_totals[well_column] += np.bincount(codes, weights=good_volumes[good_wells],
+                                                         minlength=len(self.well_totals[well_column]))
+        self.source_well_counts += np.bincount(well_codes[SOURCE_WELL][0], minlength=len(self.source_well_counts))
+
+        good_rows = [numbered_row for numbered_row, bad_row in zip(chunk, bad_rows) if not bad_row]
+        for _, row in good_rows:
+            self.source_plates.setdefault(row[SOURCE_PLATE].strip())
+        return good_rows
+
+    def well_code_name(self, well_code):
+        plate_code = int(np.searchsorted(self.plate_offsets, well_code, side='right')) - 1
+        row_index, column_index = divmod(int(well_code - self.plate_offsets[plate_code]), self.grids[self.plate_names[plate_code]][1])
+        return self.plate_names[plate_code], '{}{}'.format(chr(ord('A') + row_index), column_index + 1)
+
+    def errors(self):
+        # Every problem found so far as a list of error lines (empty when the worklist is good to run)
+        if self.row_count == 0:
+            return ['Worklist has no transfers']
+        errors = [describe_rows(message, line_numbers, line_count)
+                  for message, (line_numbers, line_count) in self.failures.items()]
+
+        # Destination wells can't be filled past their capacity
+        totals = self.well_totals[DESTINATION_WELL]
+        for well_code in np.nonzero(totals > self.capacities + 1e-9)[0]:
+            plate_name, well_name = self.well_code_name(well_code)
+            errors.append('{} {} gets {:.1f} uL but holds {:.0f} uL'.format(
+                plate_name, well_name, totals[well_code], self.capacities[well_code]))
+
+        # Source wells need their Total Volume plus the disposal volume and the mix_before draw
+        totals = self.well_totals[SOURCE_WELL]
+        required_volumes = totals + self.disposal_volume + self.mix_volume
+        for well_code in np.nonzero((self.source_well_counts > 0) & (required_volumes > self.fill_volumes + 1e-9))[0]:
+            plate_name, well_name = self.well_code_name(well_code)
+            errors.append('{} {} needs {:.1f} uL ({:.1f} uL transfers + {} uL disposal + {} uL mix) but holds {:.0f} uL'.format(
+                plate_name, well_name, required_volumes[well_code], totals[well_code], self.disposal_volume,
+                self.mix_volume, self.fill_volumes[well_code]))
+        return errors
+
+    def check(self):
+        # Raise one ValueError listing every problem, so the whole worklist can be fixed in one go before a run
+        errors = self.errors()
+        if errors:
+            raise ValueError('Worklist failed pre-flight checks:\n' + '\n'.join(errors))
+
+
+def validate_worklist(worklist_path, plate_labware, deck_config, min_volume=0.0, max_volume=None, disposal_volume=0.0,
+                      mix_volume=0.0, delimiter=None):
+    # Stream a worklist file through a WorklistValidator on its own and return (error lines, rows checked)
+    if delimiter is None:
+        delimiter = worklist_delimiter(worklist_path)
+    validator = WorklistValidator(plate_labware, deck_config, min_volume, max_volume, disposal_volume, mix_volume,
+                                  raise_errors=False)
+    with open_worklist(worklist_path) as worklist_file:
+        csv_reader = csv.DictReader(worklist_file, delimiter=delimiter)
+        missing_columns = [column for column in WORKLIST_COLUMNS if column not in (csv_reader.fieldnames or [])]
+        if missing_columns:
+            return ['Worklist is missing column(s): {}'.format(', '.join(missing_columns))], 0
+        for _ in validator.check_rows(numbered_rows(csv_reader)):
+            pass
+    return validator.errors(), validator.row_count
+
+
+if __name__ == '__main__':
+    from deck_map import DeckMap, load_deck_config
+    from mock_protocol import ProtocolContext, read_labware_dirs
+
+    parser = argparse.ArgumentParser(description='Check a cherrypick worklist against a deck config before a run')
+    parser.add_argument('worklist_path')
+    parser.add_argument('deck_config_path', help='JSON deck config, same layout as deck_config in the cherrypick scripts')
+    parser.add_argument('--min-volume', type=float, default=20)
+    parser.add_argument('--max-volume', type=float, default=None)
+    parser.add_argument('--disposal-volume', type=float, default=50)
+    parser.add_argument('--mix-volume', type=float, default=300)
+    parser.add_argument('--labware-dir', action='append', default=[], help='directory of custom labware definitions (repeatable)')
+    args = parser.parse_args()
+
+    # Load the deck config's labware on a mock protocol to get the well layouts and capacities
+    deck_config = load_deck_config(args.deck_config_path)
+    deck_map = DeckMap(ProtocolContext(extra_labware=read_labware_dirs(args.labware_dir)), deck_config)
+    start_time = time.perf_counter()
+    errors, row_count = validate_worklist(args.worklist_path, {plate_name: deck_map.labware_by_slot[slot] for plate_name, slot in deck_map.plate_slots.items()},
+                                          deck_config, args.min_volume, args.max_volume, args.disposal_volume, args.mix_volume)
+    check_time = time.perf_counter()
+
+    for error in errors:
+        print(error)
+    print('{} rows read and checked in {:.1f} ms, {} problem(s) found'.format(
+        row_count, (check_time - start_time) * 1000, len(errors)))